@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
+import atexit
+import fcntl
+import hmac
 import os
-import subprocess
 import threading
 import time
-import hashlib
 from functools import wraps
 import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, send_file, flash
+import fetcher
+import metrics
+import runs
+import timeline
+from archive import ARCHIVE_SUFFIXES, load_index, stream_member, stream_tar_gz, stream_zip
+from catalog import Catalog
+from collector import Collector
+from config import (DEFAULT_CONFIG_FILE, SCRIPT_PATH, WEB_USERS_CONFIG, config_bool, config_int,
+                    get_servers, load_config as load_config_file)
+from events import EventStore
+from manifest import state_dir
+from jobqueue import DEFAULT_WORKERS, JobQueue
+from jobstore import ACTIVE_STATUSES, DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_JOBS, JobStore
+from search import SearchIndex
+from userstore import UserStore
+from flask import (Flask, Response, render_template, request, redirect, url_for, session,
+                   send_file, flash, jsonify, stream_with_context)
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Generate a random secret key for sessions
@@ -16,76 +33,51 @@ app.secret_key = os.urandom(24)  # Generate a random secret key for sessions
 def inject_now():
     return {'now': datetime.datetime.now()}
 
-# Default configuration
-DEFAULT_CONFIG_FILE = "/home/kburki/KTOO/Harmonic/config.cfg"
-WEB_USERS_CONFIG = "/home/kburki/KTOO/Harmonic/web_users.cfg"
-SCRIPT_PATH = "/home/kburki/KTOO/Harmonic/fetch_harmonic_logs.sh"
+# Archives shown per page on the dashboard
+ARCHIVES_PER_PAGE = 25
 
-# Status tracking for background jobs
-jobs = {}
+# Background jobs, persisted under BASE_DIR/.state, and the queue that runs them
+# (both created on first use)
+job_store = None
+job_queue = None
+job_store_lock = threading.Lock()
+
+# Comment lines sent on idle job streams to keep proxies from closing them
+STREAM_KEEPALIVE_SECONDS = 15
+
+# Web users, cached in memory (opened on first use)
+user_store = None
+
+# In-process collector service, started when COLLECTOR_ENABLED=true in config.cfg
+collector = None
+collector_lock = threading.Lock()
+collector_checked = False
+# Held open while this process runs the collector, so other worker processes don't
+collector_lock_file = None
 
 def load_config():
-    """Load configuration settings from config file"""
-    config = {}
+    """Load configuration settings, parsing config.cfg again only when it changes"""
     try:
-        with open(DEFAULT_CONFIG_FILE, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
-                    config[key.strip()] = value.strip().strip('"')
-        return config
+        return load_config_file(DEFAULT_CONFIG_FILE, log=print)
     except Exception as e:
         print(f"Error loading config: {e}")
         return {}
 
+def get_user_store():
+    """Open the web user store on first use"""
+    global user_store
+    if user_store is None:
+        user_store = UserStore(WEB_USERS_CONFIG)
+    return user_store
+
 def load_users():
-    """Load web users from web_users.cfg file"""
-    users = {}
-    try:
-        if os.path.exists(WEB_USERS_CONFIG):
-            with open(WEB_USERS_CONFIG, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#'):
-                        parts = line.split('=', 1)
-                        if len(parts) == 2:
-                            user_info = parts[0].strip()
-                            password_hash = parts[1].strip()
-                            
-                            # Check if role is specified in the username
-                            if ':' in user_info:
-                                username, role = user_info.split(':', 1)
-                            else:
-                                # Default to admin for backward compatibility
-                                username, role = user_info, 'admin'
-                                
-                            users[username] = {
-                                'password_hash': password_hash,
-                                'role': role
-                            }
-        return users
-    except Exception as e:
-        print(f"Error loading users: {e}")
-        return {}
+    """Load web users from web_users.cfg, re-reading it only when it changes"""
+    return get_user_store().users()
 
 def save_user(username, password, role='user'):
     """Save a new user to the web_users.cfg file"""
     try:
-        # Hash the password
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        
-        users = load_users()
-        users[username] = {
-            'password_hash': password_hash,
-            'role': role
-        }
-        
-        with open(WEB_USERS_CONFIG, 'w') as f:
-            f.write("# Web users configuration for Harmonic Log Fetcher\n")
-            f.write("# Format: username:role=password_hash\n")
-            for user, data in users.items():
-                f.write(f"{user}:{data['role']}={data['password_hash']}\n")
+        get_user_store().save(username, password, role)
         return True
     except Exception as e:
         print(f"Error saving user: {e}")
@@ -93,11 +85,7 @@ def save_user(username, password, role='user'):
 
 def check_auth(username, password):
     """Check if username/password combination is valid"""
-    users = load_users()
-    if username in users:
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        return users[username]['password_hash'] == password_hash
-    return False
+    return get_user_store().check(username, password)
 
 def login_required(f):
     """Decorator to require login for routes"""
@@ -125,49 +113,88 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def run_script_async(job_id, test_mode=False, num_files=1):
-    """Run the log fetcher script asynchronously"""
+def get_job_store():
+    """Open the job store in BASE_DIR on first use"""
+    global job_store
+    with job_store_lock:
+        if job_store is None:
+            config = load_config()
+            job_store = JobStore(
+                config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/'),
+                max_jobs=config_int(config, 'JOB_HISTORY_MAX_JOBS', DEFAULT_MAX_JOBS),
+                max_age_days=config_int(config, 'JOB_HISTORY_DAYS', DEFAULT_MAX_AGE_DAYS))
+        return job_store
+
+def get_job_queue():
+    """Start the job queue workers on first use"""
+    global job_queue
+    store = get_job_store()
+    with job_store_lock:
+        if job_queue is None:
+            config = load_config()
+            job_queue = JobQueue(store, run_script_async, get_servers(config),
+                                 workers=config_int(config, 'JOB_WORKERS', DEFAULT_WORKERS),
+                                 pools=collector.pools if collector else None)
+        return job_queue
+
+def run_script_async(job_id, mode='full', num_files=1, pools=None):
+    """Run a log collection for a queued job using the fetch engine"""
+    store = get_job_store()
+    log = store.logger(job_id)
     try:
-        cmd = [SCRIPT_PATH]
-        if test_mode:
-            cmd.extend(["-t", "-n", str(num_files)])
-            
-        jobs[job_id] = {
-            'status': 'running',
-            'start_time': time.time(),
-            'cmd': ' '.join(cmd),
-            'output': []
-        }
-        
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        # Capture output line by line
-        for line in process.stdout:
-            jobs[job_id]['output'].append(line.strip())
-        
-        process.wait()
+        config = load_config()
+        result = fetcher.run_collection(config, mode, num_files, log=log, pools=pools)
         
-        if process.returncode == 0:
-            jobs[job_id]['status'] = 'completed'
-            # Find the archive file path from the output
-            for line in jobs[job_id]['output']:
-                if "Archive created:" in line:
-                    archive_path = line.split("Archive created:")[1].strip()
-                    jobs[job_id]['archive_path'] = archive_path
-                    break
-        else:
-            jobs[job_id]['status'] = 'failed'
+        store.finish(job_id, 'completed' if result['success'] else 'failed',
+                     archive_path=result['archive_path'], stats=result['stats'])
             
     except Exception as e:
-        jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['output'].append(f"Error: {str(e)}")
+        log(f"Error: {str(e)}")
+        store.finish(job_id, 'failed')
+
+def start_collector():
+    """Start the collector service if it is enabled in the configuration.
+
+    Only one process runs it: with several WSGI worker processes the first to
+    start takes BASE_DIR/.state/collector.lock, and the jobs of the other
+    workers open their own FTP connections.
+    """
+    global collector, collector_checked, collector_lock_file
+    with collector_lock:
+        # Once per process, however the app was started
+        if collector_checked:
+            return
+        collector_checked = True
+        config = load_config()
+        if not config_bool(config, 'COLLECTOR_ENABLED'):
+            return
+        try:
+            lock_file = open(os.path.join(state_dir(config['BASE_DIR']), 'collector.lock'), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                print(f"Collector service already runs in another process, "
+                      f"not starting it in {os.getpid()}")
+                return
+            collector_lock_file = lock_file
+            collector = Collector(config)
+        except Exception as e:
+            # The web interface still works without the collector
+            print(f"Error starting collector service: {e}")
+            return
+        collector.start()
+        atexit.register(collector.stop)
+        print(f"Collector service started in process {os.getpid()}")
+
+def format_size(size_bytes):
+    """Convert a byte count to a human-readable string"""
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} KB"
+    else:
+        return f"{size_bytes / (1024 * 1024):.1f} MB"
 
 # Routes
 @app.route('/')
@@ -245,79 +272,50 @@ def dashboard():
     
     # Get a list of recent jobs
     recent_jobs = []
-    for job_id, job in sorted(jobs.items(), key=lambda x: x[1]['start_time'], reverse=True)[:10]:
+    for job in get_job_store().recent(10):
         job_info = {
-            'id': job_id,
+            'id': job['id'],
             'status': job['status'],
             'start_time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['start_time'])),
             'command': job['cmd']
         }
         
-        if 'archive_path' in job and job['status'] == 'completed':
+        if job['archive_path'] and job['status'] == 'completed':
             job_info['archive_path'] = job['archive_path']
             job_info['archive_filename'] = os.path.basename(job['archive_path'])
             
         recent_jobs.append(job_info)
     
-    # Get all available log archives from the logs directory
+    # Page through the archive catalog instead of scanning BASE_DIR
     available_archives = []
+    page = max(request.args.get('page', 1, type=int), 1)
+    total_archives = 0
     try:
-        base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
-        if os.path.exists(base_dir):
-            for filename in sorted(os.listdir(base_dir), reverse=True):
-                if filename.endswith('.tar.gz') and filename.startswith('harmonic_'):
-                    file_path = os.path.join(base_dir, filename)
-                    if os.path.isfile(file_path):
-                        # Extract date from filename or use file modification time
-                        try:
-                            # Try to extract date from filename format harmonic_logs_YYYY_MM_DD.tar.gz
-                            if '_logs_' in filename:
-                                date_part = filename.split('_logs_')[1].split('.')[0]
-                                # Convert YYYY_MM_DD to a readable format
-                                year, month, day = date_part.split('_')
-                                friendly_date = f"{year}-{month}-{day}"
-                            elif '_test_logs_' in filename:
-                                date_part = filename.split('_test_logs_')[1].split('.')[0]
-                                # Convert YYYY_MM_DD to a readable format
-                                year, month, day = date_part.split('_')
-                                friendly_date = f"{year}-{month}-{day} (Test)"
-                            else:
-                                # Fallback to file modification time
-                                mtime = os.path.getmtime(file_path)
-                                friendly_date = time.strftime('%Y-%m-%d', time.localtime(mtime))
-                        except:
-                            # Fallback to file modification time
-                            mtime = os.path.getmtime(file_path)
-                            friendly_date = time.strftime('%Y-%m-%d', time.localtime(mtime))
-                        
-                        # Get file size
-                        size_bytes = os.path.getsize(file_path)
-                        # Convert to human-readable format
-                        if size_bytes < 1024:
-                            size_str = f"{size_bytes} B"
-                        elif size_bytes < 1024 * 1024:
-                            size_str = f"{size_bytes / 1024:.1f} KB"
-                        else:
-                            size_str = f"{size_bytes / (1024 * 1024):.1f} MB"
-                        
-                        # Add to available archives
-                        available_archives.append({
-                            'filename': filename,
-                            'path': file_path,
-                            'date': friendly_date,
-                            'size': size_str,
-                            'mtime': os.path.getmtime(file_path)  # For sorting
-                        })
-            
-            # Sort by modification time (newest first)
-            available_archives = sorted(available_archives, key=lambda x: x['mtime'], reverse=True)
+        archive_catalog = Catalog(config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/'))
+        total_archives = archive_catalog.count_archives()
+        for archive in archive_catalog.list_archives(limit=ARCHIVES_PER_PAGE,
+                                                     offset=(page - 1) * ARCHIVES_PER_PAGE):
+            friendly_date = time.strftime('%Y-%m-%d %H:00', time.localtime(archive['timestamp']))
+            if archive['mode'] != 'full':
+                friendly_date += f" ({archive['mode'].capitalize()})"
+            available_archives.append({
+                'filename': archive['name'],
+                'path': archive['path'],
+                'date': friendly_date,
+                'size': format_size(archive['size']),
+                'files': archive['file_count'],
+            })
     except Exception as e:
         print(f"Error listing archives: {e}")
+    pages = max((total_archives + ARCHIVES_PER_PAGE - 1) // ARCHIVES_PER_PAGE, 1)
     
     return render_template('dashboard.html', 
                           config=config, 
+                          servers=get_servers(config),
                           recent_jobs=recent_jobs,
                           available_archives=available_archives,
+                          page=page,
+                          pages=pages,
                           username=session.get('username', 'User'),
                           is_admin=(session.get('role') == 'admin'))
 
@@ -335,46 +333,98 @@ def fetch_logs():
     except:
         num_files = 1
     
-    job_id = int(time.time())
-    
-    # Start a background thread to run the script
-    thread = threading.Thread(
-        target=run_script_async,
-        args=(job_id, test_mode, num_files)
-    )
-    thread.daemon = True
-    thread.start()
+    cmd = [os.path.basename(SCRIPT_PATH)]
+    if test_mode:
+        cmd.extend(["-t", "-n", str(num_files)])
+    mode = 'test' if test_mode else 'full'
+    job_id, attached = get_job_queue().submit(mode, num_files, ' '.join(cmd))
     
-    flash(f"Log fetching job started. Job ID: {job_id}")
+    if attached:
+        flash(f"The same fetch is already queued or running. Showing job {job_id}.")
+    else:
+        flash(f"Log fetching job started. Job ID: {job_id}")
     return redirect(url_for('job_status', job_id=job_id))
 
 @app.route('/job/<int:job_id>')
 @login_required
 def job_status(job_id):
     """Show status of a specific job"""
-    if job_id not in jobs:
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
         flash("Job not found")
         return redirect(url_for('dashboard'))
     
-    job = jobs[job_id]
-    
     return render_template('job_status.html',
                           job_id=job_id,
                           status=job['status'],
                           start_time=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['start_time'])),
-                          output=job['output'],
-                          archive_path=job.get('archive_path'),
-                          archive_filename=os.path.basename(job.get('archive_path', '')) if 'archive_path' in job else None)
+                          output=store.output(job_id),
+                          archive_path=job['archive_path'],
+                          archive_filename=os.path.basename(job['archive_path']) if job['archive_path'] else None)
+
+@app.route('/job/<int:job_id>/stream')
+@login_required
+def job_stream(job_id):
+    """Stream a job's output as server-sent events, starting at a line offset.
+    
+    Each event carries one output line with its line number as the event id,
+    so a reconnecting browser resumes after the last line it received. A
+    'status' event ends the stream when the job starts or finishes, i.e. when
+    its status differs from the status= the page was rendered with.
+    """
+    store = get_job_store()
+    job = store.get(job_id)
+    if job is None:
+        return Response("Job not found", status=404)
+    shown_status = request.args.get('status') or job['status']
+    
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        offset = int(last_event_id) + 1
+    else:
+        offset = max(request.args.get('offset', 0, type=int), 0)
+    
+    def events():
+        position = offset
+        last_sent = time.time()
+        while True:
+            job = store.get(job_id)
+            if job is None:
+                return
+            # Read after the status, so a finished job's last lines are included
+            status = job['status']
+            lines = store.output(job_id, position)
+            
+            for line in lines:
+                data = ''.join(f"data: {part}\n" for part in str(line).split('\n'))
+                yield f"id: {position}\n{data}\n"
+                position += 1
+            
+            if status != shown_status or status not in ACTIVE_STATUSES:
+                yield f"event: status\ndata: {status}\n\n"
+                return
+            if lines:
+                last_sent = time.time()
+            elif time.time() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            store.wait(job_id, position, STREAM_KEEPALIVE_SECONDS)
+    
+    return Response(stream_with_context(events()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/download/<int:job_id>')
 @login_required
 def download_archive(job_id):
     """Download the archive file for a completed job"""
-    if job_id not in jobs or 'archive_path' not in jobs[job_id]:
+    job = get_job_store().get(job_id)
+    if job is None or not job['archive_path']:
         flash("Archive not available")
         return redirect(url_for('dashboard'))
     
-    archive_path = jobs[job_id]['archive_path']
+    archive_path = job['archive_path']
     
     if not os.path.exists(archive_path):
         flash("Archive file not found")
@@ -382,6 +432,36 @@ def download_archive(job_id):
     
     return send_file(archive_path, as_attachment=True)
 
+def is_archive_name(filename):
+    """True for the names of the archives the fetcher writes"""
+    return (filename.endswith(tuple(ARCHIVE_SUFFIXES.values())) and
+            (filename.startswith('harmonic_logs_') or
+             filename.startswith('harmonic_test_logs_') or
+             filename.startswith('harmonic_recent_logs_')))
+
+def archive_members(base_dir, filename):
+    """The files in an archive, or in its run in the blob store if the archive was deleted.
+
+    Returns (archive path or None, members), or None if neither exists.
+    """
+    file_path = os.path.join(base_dir, filename)
+    if os.path.isfile(file_path):
+        return file_path, load_index(file_path)['members']
+    run_name = runs.archive_run_name(filename)
+    run_path = os.path.join(base_dir, run_name) if run_name else None
+    if run_path and runs.read_run_manifest(run_path) is not None:
+        return None, [dict(f, name=f"{run_name}/{f['server']}/{f['name']}", stored=f)
+                      for f in runs.iter_run_files(run_path)]
+    return None
+
+def stream_run_file(f, chunk_size=64 * 1024):
+    with runs.open_run_file(f) as source:
+        while True:
+            data = source.read(chunk_size)
+            if not data:
+                break
+            yield data
+
 @app.route('/download-file/<path:filename>')
 @login_required
 def download_file(filename):
@@ -395,25 +475,288 @@ def download_file(filename):
         safe_filename = os.path.basename(filename)
         file_path = os.path.join(base_dir, safe_filename)
         
+        # Check if the file is a log archive and has the expected prefix
+        if not is_archive_name(safe_filename):
+            flash("Invalid file type")
+            return redirect(url_for('dashboard'))
+        
         # Verify the file exists and is within the base directory
         if not os.path.exists(file_path) or not os.path.isfile(file_path):
+            # An archive deleted to save space is rebuilt from its run in the blob store
+            run_name = runs.archive_run_name(safe_filename)
+            run_path = os.path.join(base_dir, run_name) if run_name else None
+            if safe_filename.endswith('.tar.gz') and run_path and runs.read_run_manifest(run_path):
+                files = list(runs.iter_run_files(run_path))
+                for f in files:
+                    f['arcname'] = f"{run_name}/{f['server']}/{f['name']}"
+                return Response(stream_with_context(stream_tar_gz(files)),
+                                mimetype='application/gzip',
+                                headers={'Content-Disposition': f'attachment; filename="{safe_filename}"'})
             flash("File not found")
             return redirect(url_for('dashboard'))
         
-        # Check if the file is a tar.gz archive and has the expected prefix
-        if not (safe_filename.endswith('.tar.gz') and 
-                (safe_filename.startswith('harmonic_logs_') or 
-                 safe_filename.startswith('harmonic_test_logs_') or
-                 safe_filename.startswith('harmonic_recent_logs_'))):
-            flash("Invalid file type")
-            return redirect(url_for('dashboard'))
-        
         # Send the file
         return send_file(file_path, as_attachment=True)
     except Exception as e:
         flash(f"Error downloading file: {str(e)}")
         return redirect(url_for('dashboard'))
 
+@app.route('/archive/<path:filename>')
+@login_required
+def browse_archive(filename):
+    """List the files in an archive"""
+    config = load_config()
+    base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
+    safe_filename = os.path.basename(filename)
+    if not is_archive_name(safe_filename):
+        flash("Invalid file type")
+        return redirect(url_for('dashboard'))
+    try:
+        found = archive_members(base_dir, safe_filename)
+    except Exception as e:
+        flash(f"Error reading archive: {str(e)}")
+        return redirect(url_for('dashboard'))
+    if found is None:
+        flash("File not found")
+        return redirect(url_for('dashboard'))
+    members = [{'name': m['name'],
+                'size': format_size(m['size']),
+                'date': time.strftime('%Y-%m-%d %H:%M', time.localtime(m['mtime']))}
+               for m in found[1]]
+    return render_template('archive.html', filename=safe_filename, members=members)
+
+@app.route('/archive/<path:filename>/member')
+@login_required
+def download_archive_member(filename):
+    """Stream one file out of an archive without sending the whole archive"""
+    config = load_config()
+    base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
+    safe_filename = os.path.basename(filename)
+    name = request.args.get('name', '')
+    if not is_archive_name(safe_filename):
+        flash("Invalid file type")
+        return redirect(url_for('dashboard'))
+    try:
+        found = archive_members(base_dir, safe_filename)
+    except Exception as e:
+        flash(f"Error reading archive: {str(e)}")
+        return redirect(url_for('dashboard'))
+    member = next((m for m in found[1] if m['name'] == name), None) if found else None
+    if member is None:
+        flash("File not found in archive")
+        return redirect(url_for('browse_archive', filename=safe_filename))
+    archive_path = found[0]
+    stream = stream_member(archive_path, member) if archive_path else stream_run_file(member['stored'])
+    return Response(stream_with_context(stream),
+                    mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename="{os.path.basename(name)}"',
+                             'Content-Length': str(member['size'])})
+
+def parse_datetime_arg(name):
+    """Parse a datetime-local form value (YYYY-MM-DDTHH:MM) into epoch seconds"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return time.mktime(datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M').timetuple())
+
+@app.route('/bundle')
+@login_required
+def download_bundle():
+    """Stream a tar.gz or zip of the stored logs matching a server, time range and filename filter"""
+    config = load_config()
+    base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
+    servers = request.args.getlist('server') or None
+    pattern = request.args.get('pattern', '').strip() or None
+    bundle_format = 'zip' if request.args.get('format') == 'zip' else 'tar.gz'
+    
+    try:
+        start = parse_datetime_arg('start')
+        end = parse_datetime_arg('end')
+    except ValueError:
+        flash("Invalid start or end time", 'error')
+        return redirect(url_for('dashboard'))
+    
+    files = timeline.select_window_files(base_dir, servers=servers, start=start, end=end,
+                                         pattern=pattern)
+    if not files:
+        flash("No log files match this filter", 'error')
+        return redirect(url_for('dashboard'))
+    
+    for f in files:
+        f['arcname'] = f"{f['server']}/{f['name']}"
+    
+    # Built on the fly in small chunks, so nothing is written to disk
+    stream = stream_zip(files) if bundle_format == 'zip' else stream_tar_gz(files)
+    filename = f"harmonic_bundle_{time.strftime('%Y_%m_%d_%H%M')}.{bundle_format}"
+    return Response(stream_with_context(stream),
+                    mimetype='application/zip' if bundle_format == 'zip' else 'application/gzip',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/search')
+@login_required
+def search_logs():
+    """Search the indexed log lines; add format=json for an API response"""
+    config = load_config()
+    base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
+    query = request.args.get('q', '').strip()
+    servers = request.args.getlist('server') or None
+    limit = min(max(request.args.get('limit', 200, type=int), 1), 1000)
+    results = []
+    error = None
+    elapsed = 0.0
+    
+    try:
+        start = parse_datetime_arg('start')
+        end = parse_datetime_arg('end')
+        if query:
+            started = time.time()
+            results = SearchIndex(base_dir).search(query, servers=servers, start=start,
+                                                   end=end, limit=limit)
+            elapsed = time.time() - started
+    except ValueError:
+        error = "Invalid start or end time"
+    except Exception as e:
+        error = f"Search failed: {str(e)}"
+    
+    for result in results:
+        result['time'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(result['timestamp']))
+    
+    if request.args.get('format') == 'json':
+        if error:
+            return jsonify({'error': error}), 400
+        return jsonify({'query': query, 'count': len(results), 'seconds': round(elapsed, 3),
+                        'results': results})
+    
+    if error:
+        flash(error, 'error')
+    return render_template('search.html',
+                          query=query,
+                          selected_servers=servers or [],
+                          servers=get_servers(config),
+                          start=request.args.get('start', ''),
+                          end=request.args.get('end', ''),
+                          results=results,
+                          elapsed=elapsed)
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """Structured events in a time range, newest first, as JSON"""
+    config = load_config()
+    base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+    try:
+        start = parse_datetime_arg('start')
+        end = parse_datetime_arg('end')
+    except ValueError:
+        return jsonify({'error': "Invalid start or end time"}), 400
+    
+    started = time.time()
+    try:
+        events = EventStore(base_dir).query(start=start, end=end,
+                                            servers=request.args.getlist('server') or None,
+                                            severities=request.args.getlist('severity') or None,
+                                            component=request.args.get('component') or None,
+                                            text=request.args.get('q') or None,
+                                            limit=limit)
+    except Exception as e:
+        return jsonify({'error': f"Event query failed: {str(e)}"}), 500
+    return jsonify({'count': len(events), 'seconds': round(time.time() - started, 3),
+                    'events': events})
+
+def timeline_files(base_dir):
+    """Parse a timeline request: (files, start, end); raises ValueError for bad arguments"""
+    try:
+        start = parse_datetime_arg('start')
+        end = parse_datetime_arg('end')
+    except ValueError:
+        raise ValueError("Invalid start or end time") from None
+    if start is None:
+        raise ValueError("Choose a start time")
+    if end is not None and end < start:
+        raise ValueError("The end time is before the start time")
+    names = {tuple(value.split('/', 1)) for value in request.args.getlist('file') if '/' in value}
+    files = timeline.select_timeline_files(base_dir,
+                                           servers=request.args.getlist('server') or None,
+                                           start=start,
+                                           pattern=request.args.get('pattern', '').strip() or None,
+                                           names=names)
+    if len(files) > timeline.MAX_FILES:
+        raise ValueError(f"{len(files)} files match; narrow the servers, time window or file "
+                         f"pattern to at most {timeline.MAX_FILES}")
+    return files, start, end
+
+@app.route('/timeline')
+@login_required
+def log_timeline():
+    """Lines of the chosen servers' logs merged in time order, a page at a time"""
+    config = load_config()
+    base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
+    limit = min(max(request.args.get('limit', timeline.DEFAULT_LIMIT, type=int), 1),
+                timeline.MAX_LIMIT)
+    lines = []
+    files = []
+    next_cursor = None
+    elapsed = 0.0
+    
+    if request.args.get('start'):
+        try:
+            started = time.time()
+            files, start, end = timeline_files(base_dir)
+            lines, next_cursor = timeline.timeline_page(files, start, end,
+                                                        request.args.get('cursor'), limit)
+            elapsed = time.time() - started
+        except ValueError as e:
+            flash(str(e), 'error')
+    
+    next_args = request.args.to_dict(flat=False)
+    next_args['cursor'] = next_cursor
+    return render_template('timeline.html',
+                          servers=get_servers(config),
+                          selected_servers=request.args.getlist('server'),
+                          start=request.args.get('start', ''),
+                          end=request.args.get('end', ''),
+                          pattern=request.args.get('pattern', ''),
+                          files=files,
+                          lines=lines,
+                          first_page=not request.args.get('cursor'),
+                          next_url=url_for('log_timeline', **next_args) if next_cursor else None,
+                          elapsed=elapsed)
+
+@app.route('/api/timeline')
+@login_required
+def api_timeline():
+    """A page of the merged timeline as JSON, or the whole window as JSON lines (format=ndjson)"""
+    config = load_config()
+    base_dir = config.get('BASE_DIR', '/home/kburki/KTOO/Harmonic/logs/')
+    try:
+        files, start, end = timeline_files(base_dir)
+        cursor = request.args.get('cursor')
+        if request.args.get('format') == 'ndjson':
+            limit = max(request.args.get('limit', 0, type=int), 0)
+            stream = timeline.stream_ndjson(files, start, end, cursor, limit)
+            return Response(stream_with_context(stream), mimetype='application/x-ndjson')
+        limit = min(max(request.args.get('limit', timeline.DEFAULT_LIMIT, type=int), 1),
+                    timeline.MAX_LIMIT)
+        started = time.time()
+        lines, next_cursor = timeline.timeline_page(files, start, end, cursor, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'count': len(lines), 'files': len(files),
+                    'seconds': round(time.time() - started, 3), 'lines': lines,
+                    'next': next_cursor})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Fetch counters, stage timings and FTP reconnects in the Prometheus text format"""
+    # Scrapers can't log in; with METRICS_TOKEN set they send it as a bearer token
+    token = load_config().get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                         f'Bearer {token}'.encode()):
+        return Response("Unauthorized\n", status=401, mimetype='text/plain',
+                        headers={'WWW-Authenticate': 'Bearer'})
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/users')
 @admin_required
 def user_management():
@@ -449,6 +792,11 @@ def add_user():
     
     return redirect(url_for('user_management'))
 
+if __name__ != '__main__':
+    # Imported by a WSGI server (gunicorn, uwsgi, flask run): start the collector
+    # with the app rather than waiting for a request
+    start_collector()
+
 if __name__ == '__main__':
     # Ensure the script is executable
     if os.path.exists(SCRIPT_PATH):
@@ -461,12 +809,17 @@ if __name__ == '__main__':
     
     # Check if all required templates exist
     required_templates = ['base.html', 'login.html', 'setup.html', 'dashboard.html', 
-                         'job_status.html', 'users.html']
+                         'job_status.html', 'users.html', 'search.html', 'archive.html',
+                         'timeline.html']
     missing_templates = [t for t in required_templates if not os.path.exists(os.path.join(template_dir, t))]
     
     if missing_templates:
         print(f"WARNING: The following templates are missing: {', '.join(missing_templates)}")
         print(f"Make sure all template files are in the {template_dir} directory")
     
+    # With the debug reloader only the child process runs the collector
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_collector()
+    
     # Run the Flask app
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
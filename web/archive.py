@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Streaming archive builder for the Harmonic Log Fetcher.
+Files are added to the tar archive as soon as they are downloaded, and the
+tar stream is compressed in blocks on several cores while the fetch is
+still running, so the archive is ready as soon as the last file arrives.
+
+The default output is a multi-member gzip file (like pigz produces) that
+any gzip or tar can read. zstd is available as an option when the
+zstandard package is installed.
+
+Next to each archive a small member index (name.index.json) records
+where every file starts and, for gzip, where each compressed block starts,
+so a single file can be streamed out of an archive without reading it all.
+
+Also provides chunked tar.gz and zip streams for building download
+bundles on the fly.
+"""
+import bisect
+import collections
+import gzip
+import json
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import runs
+from manifest import write_json_atomic
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_SUFFIXES = {'gzip': '.tar.gz', 'zstd': '.tar.zst'}
+DEFAULT_LEVEL = 6
+BLOCK_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Members that are already compressed are stored, not compressed again
+COMPRESSED_SUFFIXES = ('.gz', '.zip', '.bz2', '.xz', '.zst')
+
+INDEX_SUFFIX = '.index.json'
+INDEX_VERSION = 1
+READ_SIZE = 256 * 1024
+
+
+class ParallelGzipWriter:
+    """Write-only file object that compresses fixed-size blocks in parallel.
+
+    Each block becomes its own gzip member; zlib releases the GIL, so the
+    blocks are compressed concurrently and written out in order.
+    """
+
+    def __init__(self, fileobj, level=DEFAULT_LEVEL, workers=None, block_size=BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._position = 0
+        # (compressed offset, uncompressed offset) of each gzip member, for the archive index
+        self.blocks = []
+        self._submitted = 0
+        self._compressed = 0
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self._position += len(data)
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def tell(self):
+        """Position in the uncompressed stream (tarfile needs this)"""
+        return self._position
+
+    def set_level(self, level):
+        """Change the compression level, starting a new block at the current position"""
+        if level != self.level:
+            self.flush_block()
+            self.level = level
+
+    def flush_block(self):
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _submit(self, block):
+        self._pending.append((self._executor.submit(gzip.compress, block, self.level, mtime=0),
+                              self._submitted))
+        self._submitted += len(block)
+        # Bound memory: keep at most two blocks per worker in flight
+        while len(self._pending) > self.workers * 2:
+            self._write_next()
+
+    def _write_next(self):
+        future, start = self._pending.popleft()
+        data = future.result()
+        self.blocks.append((self._compressed, start))
+        self.fileobj.write(data)
+        self._compressed += len(data)
+
+    def close(self):
+        self.flush_block()
+        while self._pending:
+            self._write_next()
+        self._executor.shutdown()
+
+
+class ZstdWriter:
+    """Multi-threaded zstd stream with the same interface as ParallelGzipWriter"""
+
+    def __init__(self, fileobj, level=3, workers=None):
+        compressor = zstandard.ZstdCompressor(level=level, threads=workers or -1)
+        self._writer = compressor.stream_writer(fileobj, closefd=False)
+        self._position = 0
+
+    def write(self, data):
+        self._writer.write(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def set_level(self, level):
+        # zstd detects incompressible data itself, so there is nothing to switch
+        pass
+
+    def close(self):
+        self._writer.close()
+
+
+class StreamingArchiveBuilder:
+    """Build a tar archive in the background from files added while a fetch runs"""
+
+    def __init__(self, archive_path, compression='gzip', level=None, workers=None, log=print):
+        if compression == 'zstd' and zstandard is None:
+            log("zstandard is not installed, falling back to gzip")
+            compression = 'gzip'
+        self.compression = compression
+        self.archive_path = archive_path
+        self.partial_path = archive_path + '.part'
+        self.log = log
+        self.members = 0
+        # name, size, mtime and data offset of each file, for the archive index
+        self._index = []
+        self._file = open(self.partial_path, 'wb')
+        if compression == 'zstd':
+            self._level = level or 3
+            self._writer = ZstdWriter(self._file, self._level, workers)
+        else:
+            self._level = level or DEFAULT_LEVEL
+            self._writer = ParallelGzipWriter(self._file, self._level, workers)
+        self._tar = tarfile.open(fileobj=self._writer, mode='w', format=tarfile.PAX_FORMAT)
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, path, arcname, stored=None):
+        """Queue a finished file, or a file from the blob store; safe to call from any thread"""
+        self._queue.put((path, arcname, stored))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error:
+                continue
+            path, arcname, stored = item
+            try:
+                if stored:
+                    self._add_stored(stored, arcname)
+                else:
+                    self._add_member(path, arcname)
+            except Exception as e:
+                self._error = e
+
+    def _add_member(self, path, arcname):
+        tarinfo = self._tar.gettarinfo(path, arcname)
+        if tarinfo.isdir():
+            self._tar.addfile(tarinfo)
+            return
+        compressed = path.endswith(COMPRESSED_SUFFIXES)
+        if compressed:
+            self._writer.set_level(0)
+        with open(path, 'rb') as f:
+            self._tar.addfile(tarinfo, f)
+        if compressed:
+            self._writer.set_level(self._level)
+        self._indexed(tarinfo)
+
+    def _add_stored(self, f, arcname):
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = f['size']
+        tarinfo.mtime = f['mtime']
+        tarinfo.mode = 0o644
+        compressed = f['name'].endswith(COMPRESSED_SUFFIXES)
+        if compressed:
+            self._writer.set_level(0)
+        with runs.open_run_file(f) as source:
+            self._tar.addfile(tarinfo, source)
+        if compressed:
+            self._writer.set_level(self._level)
+        self._indexed(tarinfo)
+
+    def _indexed(self, tarinfo):
+        # The data ends, padded to a whole block, where the tar stream is now
+        padded = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        self._index.append({'name': tarinfo.name, 'size': tarinfo.size, 'mtime': tarinfo.mtime,
+                            'offset': self._tar.offset - padded})
+        self.members += 1
+
+    def close(self):
+        """Finish the archive once all queued files are written; returns its path"""
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if self._error:
+                raise self._error
+            self._tar.close()
+            self._writer.close()
+            self._file.close()
+            os.replace(self.partial_path, self.archive_path)
+        except Exception:
+            self.abort()
+            raise
+        try:
+            write_index(self.archive_path, self._index,
+                        getattr(self._writer, 'blocks', None))
+        except OSError as e:
+            # The index is rebuilt from the archive when it is first needed
+            self.log(f"Error writing archive index: {e}")
+        return self.archive_path
+
+    def abort(self):
+        """Discard a partly written archive"""
+        try:
+            self._file.close()
+        finally:
+            if os.path.exists(self.partial_path):
+                os.remove(self.partial_path)
+
+
+def write_index(archive_path, members, blocks=None):
+    """Save the member index of an archive next to it"""
+    stat = os.stat(archive_path)
+    write_json_atomic(archive_path + INDEX_SUFFIX, {
+        'version': INDEX_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime,
+        'members': members, 'blocks': [list(block) for block in blocks] if blocks else None,
+    })
+
+
+class _GzipMemberReader:
+    """Sequential reader of a (multi-member) gzip file that notes where each member starts"""
+
+    def __init__(self, fileobj, compressed_offset=0, uncompressed_offset=0):
+        self.fileobj = fileobj
+        self.blocks = [(compressed_offset, uncompressed_offset)]
+        self._decompressor = zlib.decompressobj(31)
+        self._consumed = compressed_offset
+        self._produced = uncompressed_offset
+        self._buffer = bytearray()
+
+    def _fill(self):
+        if self._decompressor.eof:
+            data = self._decompressor.unused_data
+            if not data:
+                data = self.fileobj.read(READ_SIZE)
+                self._consumed += len(data)
+            # Some tools pad the end of a gzip file with zeros
+            if not data.strip(b'\0'):
+                return False
+            self.blocks.append((self._consumed - len(data), self._produced))
+            self._decompressor = zlib.decompressobj(31)
+        else:
+            data = self.fileobj.read(READ_SIZE)
+            self._consumed += len(data)
+            if not data:
+                return False
+        output = self._decompressor.decompress(data)
+        self._produced += len(output)
+        self._buffer.extend(output)
+        return True
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buffer) < size) and self._fill():
+            pass
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _open_archive_stream(f, path, block=(0, 0)):
+    """Decompressed stream of an archive, starting at a gzip block"""
+    if path.endswith('.tar.zst'):
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(f)
+    f.seek(block[0])
+    return _GzipMemberReader(f, *block)
+
+
+def build_index(archive_path):
+    """Read an archive once from start to end and save its member index"""
+    members = []
+    with open(archive_path, 'rb') as f:
+        stream = _open_archive_stream(f, archive_path)
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for tarinfo in tar:
+                if tarinfo.isfile():
+                    members.append({'name': tarinfo.name, 'size': tarinfo.size,
+                                    'mtime': tarinfo.mtime, 'offset': tarinfo.offset_data})
+    blocks = getattr(stream, 'blocks', None)
+    try:
+        write_index(archive_path, members, blocks)
+    except OSError:
+        pass
+    return {'members': members, 'blocks': blocks}
+
+
+def load_index(archive_path):
+    """The member index of an archive, built and cached on first use"""
+    try:
+        with open(archive_path + INDEX_SUFFIX, 'r') as f:
+            index = json.load(f)
+        stat = os.stat(archive_path)
+        if (index.get('version') == INDEX_VERSION and index['size'] == stat.st_size
+                and index['mtime'] == stat.st_mtime):
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_index(archive_path)
+
+
+def stream_member(archive_path, member, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the contents of one file in an archive.
+
+    member is an entry of the archive's index. gzip archives are read from the
+    start of the compressed block that holds the member, so only a little
+    more than the member itself is decompressed.
+    """
+    index = load_index(archive_path)
+    block = (0, 0)
+    if index.get('blocks'):
+        starts = [u for _, u in index['blocks']]
+        block = tuple(index['blocks'][bisect.bisect_right(starts, member['offset']) - 1])
+    with open(archive_path, 'rb') as f:
+        stream = _open_archive_stream(f, archive_path, block)
+        skip = member['offset'] - block[1]
+        while skip > 0:
+            data = stream.read(min(READ_SIZE, skip))
+            if not data:
+                return
+            skip -= len(data)
+        remaining = member['size']
+        while remaining > 0:
+            data = stream.read(min(chunk_size, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+
+
+class _ChunkSink:
+    """File-like object that collects written bytes until they are taken"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _GzipStream:
+    """Incremental gzip compressor that stores already-compressed data in separate members"""
+
+    def __init__(self, level=DEFAULT_LEVEL):
+        self.level = level
+        self._compressor = None
+        self._stored = None
+
+    def compress(self, data, stored=False):
+        out = b''
+        if self._compressor is not None and stored != self._stored:
+            out += self._compressor.flush()
+            self._compressor = None
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(0 if stored else self.level, zlib.DEFLATED, 31)
+            self._stored = stored
+        return out + self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush() if self._compressor else b''
+
+
+def stream_tar_gz(files, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield a tar.gz of the given files in chunks, without a temporary file.
+
+    files come from runs.iter_run_files, with an 'arcname' added. Memory use is bounded
+    by chunk_size regardless of how large the files are.
+    """
+    gz = _GzipStream()
+    for f in files:
+        stored = f['path'].endswith(COMPRESSED_SUFFIXES)
+        try:
+            source = runs.open_run_file(f)
+        except OSError:
+            # Removed by rotation since it was selected
+            continue
+        with source:
+            tarinfo = tarfile.TarInfo(f['arcname'])
+            tarinfo.size = f['size']
+            tarinfo.mtime = int(f.get('mtime', 0))
+            tarinfo.mode = 0o644
+            yield gz.compress(tarinfo.tobuf(tarfile.PAX_FORMAT))
+            remaining = f['size']
+            while remaining > 0:
+                data = source.read(min(chunk_size, remaining))
+                if not data:
+                    # The file shrank; pad so the tar stays valid
+                    data = tarfile.NUL * remaining
+                remaining -= len(data)
+                yield gz.compress(data, stored)
+            padding = -f['size'] % tarfile.BLOCKSIZE
+            if padding:
+                yield gz.compress(tarfile.NUL * padding)
+    yield gz.compress(tarfile.NUL * (tarfile.BLOCKSIZE * 2)) + gz.flush()
+
+
+def stream_zip(files, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield a zip of the given files in chunks, without a temporary file"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for f in files:
+            try:
+                source = runs.open_run_file(f)
+            except OSError:
+                continue
+            with source:
+                info = zipfile.ZipInfo(f['arcname'], time.localtime(f.get('mtime', 0))[:6])
+                info.compress_type = (zipfile.ZIP_STORED if f['path'].endswith(COMPRESSED_SUFFIXES)
+                                      else zipfile.ZIP_DEFLATED)
+                with zf.open(info, 'w', force_zip64=True) as dest:
+                    while True:
+                        data = source.read(chunk_size)
+                        if not data:
+                            break
+                        dest.write(data)
+                        yield sink.take()
+            yield sink.take()
+    yield sink.take()
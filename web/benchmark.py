@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the Harmonic Log Fetcher against a local stand-in FTP server.
+Generates synthetic Harmonic-style log trees for each server, serves them
+with pyftpdlib (optionally with added per-command latency and a bandwidth
+cap), and times a cold full collection, a recent collection after the
+active logs have grown, an unchanged full collection, log rotation and the
+dashboard and download endpoints of the web interface. Results, with
+throughput, wall time and peak RSS, are written as JSON.
+
+Requires the pyftpdlib package; the web endpoints also need Flask.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+except ImportError:
+    ThreadedFTPServer = None
+
+import fetcher
+import retention
+import runs
+from config import DEFAULT_CONNECTIONS_PER_SERVER
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench'
+COMPONENTS = ('PlayoutEngine', 'AutomationServer', 'MediaMover', 'DeviceControl', 'Scheduler')
+SEVERITIES = ('INFO', 'INFO', 'INFO', 'DEBUG', 'WARN', 'ERROR')
+MESSAGES = (
+    "Channel {n}: clip {id} cued at frame {frame}",
+    "Channel {n}: frame drop detected, {frame} frames behind",
+    "Device VTR{n} status changed to PLAY",
+    "Playlist {id} loaded with {frame} events",
+    "Transfer of clip {id} completed in {n}.{frame} s",
+)
+
+
+def log_lines(start, count, rng):
+    """Yield synthetic Harmonic-style log lines starting at epoch seconds start"""
+    for i in range(count):
+        timestamp = start + i * 0.05
+        message = rng.choice(MESSAGES).format(n=rng.randint(1, 8), id=rng.randint(1000, 99999),
+                                              frame=rng.randint(0, 9999))
+        yield (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))}."
+               f"{int(timestamp * 1000) % 1000:03d} [{rng.choice(COMPONENTS)}] "
+               f"{rng.choice(SEVERITIES)} {message}\n")
+
+
+def write_log(path, size, start, rng, compress=False):
+    """Write a synthetic log of about size bytes"""
+    data = ''.join(log_lines(start, max(1, size // 80), rng)).encode()
+    if compress:
+        data = gzip.compress(data, 6)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def generate_tree(root, servers, files, file_size, gz_ratio, seed=0):
+    """Fill root/<server> with log files; returns the total bytes written"""
+    rng = random.Random(seed)
+    now = time.time()
+    total = 0
+    for server in servers:
+        directory = os.path.join(root, server)
+        os.makedirs(directory, exist_ok=True)
+        for i in range(files):
+            # Oldest files are rotated logs, compressed; the newest ones are still being written
+            compress = i < files * gz_ratio
+            name = f"{server}_{i:04d}.log" + ('.gz' if compress else '')
+            start = now - (files - i) * 3600
+            path = os.path.join(directory, name)
+            total += write_log(path, file_size, start, rng, compress)
+            os.utime(path, (start + 3600, start + 3600))
+    return total
+
+
+def grow_files(root, servers, count, nbytes, seed=1):
+    """Append nbytes to the newest count plain logs of each server; returns bytes added"""
+    rng = random.Random(seed)
+    added = 0
+    for server in servers:
+        directory = os.path.join(root, server)
+        logs = sorted(name for name in os.listdir(directory) if name.endswith('.log'))
+        for name in logs[-count:] if count else []:
+            data = ''.join(log_lines(time.time(), max(1, nbytes // 80), rng)).encode()
+            with open(os.path.join(directory, name), 'ab') as f:
+                f.write(data)
+            added += len(data)
+    return added
+
+
+def start_ftp_server(root, latency=0.0, bandwidth=0):
+    """Serve root on a free local port; returns (server, port)"""
+
+    class SlowHandler(FTPHandler):
+        # Each connection has its own thread, so sleeping only delays this client
+        def pre_process_command(self, line, cmd, arg):
+            if latency:
+                time.sleep(latency)
+            super().pre_process_command(line, cmd, arg)
+
+    authorizer = DummyAuthorizer()
+    authorizer.add_user(BENCH_USER, BENCH_PASSWORD, root, perm='elr')
+    SlowHandler.authorizer = authorizer
+    if bandwidth:
+        dtp = type('BenchDTPHandler', (ThrottledDTPHandler,), {'read_limit': bandwidth,
+                                                               'write_limit': bandwidth})
+        SlowHandler.dtp_handler = dtp
+    # pyftpdlib logs every command to stderr unless its logger already has a handler
+    ftp_logger = logging.getLogger('pyftpdlib')
+    if not ftp_logger.handlers:
+        ftp_logger.addHandler(logging.NullHandler())
+    ftp_logger.setLevel(logging.WARNING)
+    server = ThreadedFTPServer(('127.0.0.1', 0), SlowHandler)
+    server.max_cons = 64
+    threading.Thread(target=server.serve_forever, kwargs={'timeout': 0.5, 'handle_exit': False},
+                     daemon=True).start()
+    return server, server.address[1]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and its finished children, in MB"""
+    # ru_maxrss is in KB on Linux
+    return {'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}
+
+
+def measure(name, func, results, log):
+    """Run one stage and record its wall time, throughput and peak RSS"""
+    log(f"Running {name}...")
+    start = time.perf_counter()
+    info = func() or {}
+    seconds = time.perf_counter() - start
+    result = {'stage': name, 'seconds': round(seconds, 3), **info, 'peak_rss_mb': peak_rss_mb()}
+    if info.get('bytes'):
+        result['throughput_mb_s'] = round(info['bytes'] / (1024 * 1024) / seconds, 2)
+    results.append(result)
+    log(f"{name}: {seconds:.2f}s"
+        + (f", {result['throughput_mb_s']} MB/s" if 'throughput_mb_s' in result else ""))
+    return result
+
+
+def collection_info(result):
+    stats = result['stats'].values()
+    return {'bytes': sum(s['bytes'] for s in stats),
+            'files': sum(s['files'] for s in stats),
+            'linked': sum(s['linked'] for s in stats),
+            'resumed': sum(s['resumed'] for s in stats),
+            'archive_bytes': os.path.getsize(result['archive_path']),
+            'timings': result['timings']}
+
+
+def bench_web(config_path, base_dir, requests, results, log):
+    """Time the dashboard, archive download and bundle endpoints with Flask's test client"""
+    # The web app reads its config file when it is imported
+    import config as config_module
+    config_module.DEFAULT_CONFIG_FILE = config_path
+    try:
+        import app as web_app
+    except ImportError as e:
+        log(f"Skipping web endpoints ({e})")
+        return
+    web_app.DEFAULT_CONFIG_FILE = config_path
+    client = web_app.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['username'] = BENCH_USER
+        session['role'] = 'admin'
+    archive = sorted(name for name in os.listdir(base_dir) if runs.parse_archive_name(name))[-1]
+
+    def requester(url):
+        def run():
+            nbytes = 0
+            for _ in range(requests):
+                response = client.get(url)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{url} returned {response.status_code}")
+                nbytes += len(response.get_data())
+            return {'requests': requests, 'bytes': nbytes}
+        return run
+
+    for name, url in (('dashboard', '/dashboard'),
+                      ('download_archive', f'/download-file/{archive}'),
+                      ('download_bundle', '/bundle?pattern=*.log')):
+        result = measure(name, requester(url), results, log)
+        result['ms_per_request'] = round(result['seconds'] * 1000 / requests, 2)
+
+
+def run_benchmark(args, log=print):
+    if ThreadedFTPServer is None:
+        raise RuntimeError("pyftpdlib is not installed (pip install pyftpdlib)")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='harmonic_bench_')
+    remote_dir = os.path.join(work_dir, 'remote')
+    base_dir = os.path.join(work_dir, 'logs')
+    os.makedirs(base_dir, exist_ok=True)
+    server_names = [f'server{i}' for i in range(1, args.servers + 1)]
+    results = []
+    ftp_server = None
+    try:
+        log(f"Generating {args.files} files of {args.file_size_mb} MB for {len(server_names)} servers "
+            f"in {remote_dir}")
+        generated = generate_tree(remote_dir, server_names, args.files,
+                                  int(args.file_size_mb * 1024 * 1024), args.gz_ratio)
+        ftp_server, port = start_ftp_server(remote_dir, args.latency_ms / 1000,
+                                            int(args.bandwidth_mbps * 1024 * 1024 / 8))
+
+        config = {
+            'BASE_DIR': base_dir,
+            'RETENTION_DAYS': '5',
+            'RECENT_RETENTION_HOURS': '24',
+            'SEARCH_INDEX': 'true' if args.index else 'false',
+            'EVENT_STORE': 'true' if args.index else 'false',
+            'BLOB_STORE': 'true' if args.blob_store else 'false',
+            'ARCHIVE_FORMAT': args.archive_format,
+            'FETCH_CONNECTIONS_PER_SERVER': str(args.connections),
+            'FETCH_MAX_TRANSFERS': str(args.max_transfers),
+            'SERVERS': ' '.join(name.upper() for name in server_names),
+        }
+        for name in server_names:
+            prefix = name.upper()
+            config.update({f'{prefix}_IP': '127.0.0.1', f'{prefix}_PORT': str(port),
+                           f'{prefix}_USER': BENCH_USER, f'{prefix}_PASS': BENCH_PASSWORD,
+                           f'{prefix}_PATH': f'/{name}'})
+        config_path = os.path.join(work_dir, 'config.cfg')
+        with open(config_path, 'w') as f:
+            f.writelines(f'{key}="{value}"\n' for key, value in config.items())
+
+        quiet = (lambda message: None) if not args.verbose else log
+        # Full collections rotate at the end; time the collections and the rotation separately
+        no_rotation = dict(config, RETENTION_DAYS='36500')
+        # The cold run is dated a week back so the rotation stage has something to delete
+        old = time.strftime('%Y_%m_%d_%H', time.localtime(time.time() - 7 * 86400))
+        now = time.strftime('%Y_%m_%d_%H')
+        measure('full_cold', lambda: collection_info(
+            fetcher.run_collection(no_rotation, 'full', timestamp=old, log=quiet)), results, log)
+        grown = grow_files(remote_dir, server_names, args.growing, int(args.grow_kb * 1024))
+        measure('recent_grown', lambda: dict(collection_info(
+            fetcher.run_collection(config, 'recent', args.recent_files, timestamp=now, log=quiet)), grown_bytes=grown), results, log)
+        measure('full_unchanged', lambda: collection_info(
+            fetcher.run_collection(no_rotation, 'full', timestamp=now, log=quiet)), results, log)
+
+        def rotate():
+            before = len(os.listdir(base_dir))
+            retention.rotate_logs(config, log=quiet)
+            return {'deleted': before - len(os.listdir(base_dir))}
+
+        measure('rotation', rotate, results, log)
+        if args.web_requests:
+            bench_web(config_path, base_dir, args.web_requests, results, log)
+    finally:
+        if ftp_server:
+            ftp_server.close_all()
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'settings': {'servers': len(server_names), 'files': args.files,
+                     'file_size_mb': args.file_size_mb, 'gz_ratio': args.gz_ratio,
+                     'growing': args.growing, 'grow_kb': args.grow_kb,
+                     'latency_ms': args.latency_ms, 'bandwidth_mbps': args.bandwidth_mbps,
+                     'connections': args.connections, 'max_transfers': args.max_transfers,
+                     'archive_format': args.archive_format, 'index': args.index,
+                     'blob_store': args.blob_store, 'generated_bytes': generated},
+        'stages': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark log collection against a local FTP server")
+    parser.add_argument('-o', dest='output', help="Write the results as JSON to this file")
+    parser.add_argument('--servers', type=int, default=2,
+                        help="Number of servers to simulate")
+    parser.add_argument('--files', type=int, default=50, help="Log files per server")
+    parser.add_argument('--file-size-mb', type=float, default=2.0, help="Size of each log file")
+    parser.add_argument('--gz-ratio', type=float, default=0.5,
+                        help="Fraction of the files that are rotated .gz logs")
+    parser.add_argument('--growing', type=int, default=3,
+                        help="Active logs per server that grow before the recent run")
+    parser.add_argument('--grow-kb', type=float, default=256, help="KB appended to each growing log")
+    parser.add_argument('--recent-files', type=int, default=10,
+                        help="Files fetched by the recent collection")
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help="Delay added to every FTP command")
+    parser.add_argument('--bandwidth-mbps', type=float, default=0,
+                        help="Per-connection transfer limit (default: unlimited)")
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS_PER_SERVER,
+                        help="FTP connections per server")
+    parser.add_argument('--max-transfers', type=int, default=fetcher.DEFAULT_MAX_TRANSFERS,
+                        help="Concurrent transfers across all servers")
+    parser.add_argument('--archive-format', choices=sorted(fetcher.ARCHIVE_SUFFIXES), default='gzip')
+    parser.add_argument('--index', action='store_true',
+                        help="Also build the search index and event store after each collection")
+    parser.add_argument('--blob-store', action='store_true', help="Store runs in the blob store")
+    parser.add_argument('--web-requests', type=int, default=5,
+                        help="Requests per web endpoint (0 to skip the web interface)")
+    parser.add_argument('--work-dir', help="Directory for the generated files (kept afterwards)")
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary directory")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Show the collection output")
+    args = parser.parse_args()
+
+    try:
+        report = run_benchmark(args)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return 1
+    output = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
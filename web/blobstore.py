@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Content-addressed storage for the downloaded log files.
+With BLOB_STORE=true each downloaded file is split into fixed-size chunks
+that are stored once under BASE_DIR/.state/blobs, named by their SHA-256,
+and a run directory only keeps a files.json listing the chunks of each
+file. A log that grew since the previous run shares every chunk but the
+last with the older copy, so a run only costs the disk space of what is
+new. Chunks of plain logs are stored zlib compressed.
+"""
+import argparse
+import fcntl
+import hashlib
+import io
+import os
+import sys
+import zlib
+from contextlib import contextmanager
+
+from config import DEFAULT_CONFIG_FILE, load_config
+from manifest import state_dir
+
+CHUNK_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 6
+# First byte of a chunk file: how the rest of it is stored
+RAW = b'r'
+ZLIB = b'z'
+
+
+def chunk_path(root, digest):
+    return os.path.join(root, digest[:2], digest)
+
+
+def read_chunk(root, digest):
+    """The original bytes of a stored chunk"""
+    with open(chunk_path(root, digest), 'rb') as f:
+        data = f.read()
+    if data[:1] == ZLIB:
+        return zlib.decompress(data[1:])
+    return data[1:]
+
+
+class ChunkReader(io.RawIOBase):
+    """Read-only, seekable file object over the chunks of a stored file"""
+
+    def __init__(self, root, chunks, size):
+        self.root = root
+        self.chunks = chunks
+        self.size = size
+        self._position = 0
+        self._index = None
+        self._data = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        if self._position >= self.size:
+            return 0
+        # Every chunk but the last is exactly CHUNK_SIZE, so seeking needs no index
+        index = self._position // CHUNK_SIZE
+        if index != self._index:
+            self._data = read_chunk(self.root, self.chunks[index])
+            self._index = index
+        start = self._position - index * CHUNK_SIZE
+        count = min(len(buffer), len(self._data) - start)
+        buffer[:count] = self._data[start:start + count]
+        self._position += count
+        return count
+
+
+class BlobStore:
+    """Deduplicated chunk store under BASE_DIR/.state/blobs"""
+
+    def __init__(self, base_dir):
+        self.root = state_dir(base_dir, 'blobs')
+        self.lock_path = os.path.join(self.root, '.lock')
+
+    def has(self, chunks):
+        """True if every chunk of a stored file is present"""
+        return all(os.path.exists(chunk_path(self.root, digest)) for digest in set(chunks))
+
+    def put(self, data, compress=True):
+        """Store one chunk; returns (digest, bytes added to the store)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = chunk_path(self.root, digest)
+        if os.path.exists(path):
+            return digest, 0
+        payload = ZLIB + zlib.compress(data, COMPRESSION_LEVEL) if compress else b''
+        if not payload or len(payload) > len(data):
+            payload = RAW + data
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Dot-named temp file, so garbage collection leaves it alone
+        tmp_path = os.path.join(os.path.dirname(path), f".{digest}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        return digest, len(payload)
+
+    def put_file(self, path, compress=True):
+        """Store a file; returns {'chunks', 'size'} and the bytes added to the store"""
+        chunks = []
+        size = added = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                digest, stored = self.put(data, compress)
+                chunks.append(digest)
+                size += len(data)
+                added += stored
+        return {'chunks': chunks, 'size': size}, added
+
+    def open(self, chunks, size):
+        return ChunkReader(self.root, chunks, size)
+
+    def restore(self, chunks, dest):
+        """Write a stored file back out as a regular file"""
+        with open(dest, 'wb') as f:
+            for digest in chunks:
+                f.write(read_chunk(self.root, digest))
+
+    @contextmanager
+    def writing(self):
+        """Held while a collection adds chunks that no run references yet"""
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            yield
+
+    def collect_garbage(self, referenced):
+        """Delete chunks no run uses any more; returns (chunks, bytes) removed.
+
+        referenced() returns the set of chunks still in use and is called with
+        the store locked. Returns None without doing anything while a
+        collection is writing to the store.
+        """
+        with open(self.lock_path, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            live = referenced()
+            removed = freed = 0
+            for prefix in os.scandir(self.root):
+                if not prefix.is_dir():
+                    continue
+                for item in os.scandir(prefix.path):
+                    if item.name.startswith('.') or item.name in live:
+                        continue
+                    freed += item.stat().st_size
+                    os.remove(item.path)
+                    removed += 1
+            return removed, freed
+
+    def usage(self):
+        """(number of chunks, bytes on disk)"""
+        count = size = 0
+        for prefix in os.scandir(self.root):
+            if prefix.is_dir():
+                for item in os.scandir(prefix.path):
+                    if not item.name.startswith('.'):
+                        count += 1
+                        size += item.stat().st_size
+        return count, size
+
+
+def main():
+    import runs
+
+    parser = argparse.ArgumentParser(description="Show or clean up the Harmonic log blob store")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    parser.add_argument('--gc', action='store_true',
+                        help="Delete chunks that no run directory uses")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+    base_dir = config['BASE_DIR']
+    store = BlobStore(base_dir)
+
+    if args.gc:
+        result = store.collect_garbage(lambda: runs.referenced_chunks(base_dir))
+        if result is None:
+            print("A collection is writing to the blob store, try again later")
+            return 1
+        print(f"Removed {result[0]} unused chunks ({result[1] / (1024 * 1024):.1f} MB)")
+
+    logical = stored_runs = 0
+    for run in runs.list_runs(base_dir):
+        files = runs.read_run_manifest(run['path'])
+        if files is not None:
+            stored_runs += 1
+            logical += sum(f['size'] for f in files)
+    count, size = store.usage()
+    print(f"{stored_runs} runs hold {logical / (1024 * 1024):.1f} MB of logs, "
+          f"stored in {count} chunks using {size / (1024 * 1024):.1f} MB"
+          + (f" ({logical / size:.1f}x)" if size else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Catalog of the archives and run directories stored under BASE_DIR.
+A small SQLite database (BASE_DIR/.state/catalog.db) that the fetcher and
+log rotation keep up to date, so the dashboard can page through archives
+without scanning the directory on every request.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+
+import runs
+from config import DEFAULT_CONFIG_FILE, load_config
+from manifest import state_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    run_name TEXT
+);
+CREATE INDEX IF NOT EXISTS archives_timestamp ON archives (timestamp DESC);
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    size INTEGER NOT NULL,
+    file_count INTEGER NOT NULL,
+    servers TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp DESC);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class Catalog:
+    """Persistent index of archives and run directories"""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path = os.path.join(state_dir(base_dir), 'catalog.db')
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            initialized = db.execute("SELECT value FROM meta WHERE key = 'initialized'").fetchone()
+        # Existing installations: index what is already on disk once
+        if not initialized:
+            self.sync()
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def _run_row(self, path):
+        parsed = runs.parse_run_name(os.path.basename(path))
+        if not parsed:
+            return None
+        counts = {}
+        size = 0
+        for f in runs.iter_run_files(path):
+            counts[f['server']] = counts.get(f['server'], 0) + 1
+            size += f['size']
+        return (os.path.basename(path), path, parsed[0], parsed[1].timestamp(), size,
+                sum(counts.values()), json.dumps(counts, sort_keys=True))
+
+    def _archive_row(self, path):
+        name = os.path.basename(path)
+        parsed = runs.parse_archive_name(name)
+        if not parsed:
+            return None
+        stat = os.stat(path)
+        mode, timestamp = parsed
+        return (name, path, mode, timestamp.timestamp(), stat.st_size, stat.st_mtime,
+                runs.archive_run_name(name))
+
+    def record_run(self, run_path, archive_path=None):
+        """Add or refresh a run directory and its archive after a collection"""
+        run_row = self._run_row(run_path)
+        archive_row = self._archive_row(archive_path) if archive_path else None
+        with self._connect() as db:
+            if run_row:
+                db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)", run_row)
+            if archive_row:
+                db.execute("INSERT OR REPLACE INTO archives VALUES (?, ?, ?, ?, ?, ?, ?)", archive_row)
+
+    def remove(self, paths):
+        """Forget deleted archives and run directories"""
+        names = [os.path.basename(path) for path in paths]
+        with self._connect() as db:
+            db.executemany("DELETE FROM archives WHERE name = ?", [(n,) for n in names])
+            db.executemany("DELETE FROM runs WHERE name = ?", [(n,) for n in names])
+
+    def sync(self):
+        """Rebuild the catalog from what is actually on disk"""
+        run_rows, archive_rows = [], []
+        if os.path.isdir(self.base_dir):
+            with os.scandir(self.base_dir) as it:
+                for item in it:
+                    if item.is_dir() and runs.parse_run_name(item.name):
+                        row = self._run_row(item.path)
+                        if row:
+                            run_rows.append(row)
+                    elif item.is_file() and runs.parse_archive_name(item.name):
+                        archive_rows.append(self._archive_row(item.path))
+        with self._connect() as db:
+            db.execute("DELETE FROM runs")
+            db.execute("DELETE FROM archives")
+            db.executemany("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)", run_rows)
+            db.executemany("INSERT INTO archives VALUES (?, ?, ?, ?, ?, ?, ?)", archive_rows)
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('initialized', '1')")
+        return len(run_rows), len(archive_rows)
+
+    def count_archives(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM archives").fetchone()[0]
+
+    def list_archives(self, limit=25, offset=0):
+        """Archives newest first, with file counts from their run directory"""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT a.*, r.file_count, r.servers FROM archives a "
+                "LEFT JOIN runs r ON r.name = a.run_name "
+                "ORDER BY a.timestamp DESC, a.name DESC LIMIT ? OFFSET ?",
+                (limit, offset)).fetchall()
+        archives = []
+        for row in rows:
+            archive = dict(row)
+            archive['servers'] = json.loads(row['servers']) if row['servers'] else {}
+            archives.append(archive)
+        return archives
+
+    def list_runs(self, limit=None):
+        with self._connect() as db:
+            rows = db.execute("SELECT * FROM runs ORDER BY timestamp DESC LIMIT ?",
+                              (limit if limit is not None else -1,)).fetchall()
+        return [dict(row, servers=json.loads(row['servers'])) for row in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the Harmonic archive catalog")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+    run_count, archive_count = Catalog(config['BASE_DIR']).sync()
+    print(f"Catalog rebuilt: {run_count} run directories, {archive_count} archives")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
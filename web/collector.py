@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Long-running collector service for the Harmonic Log Fetcher.
+Keeps authenticated FTP connections open to every server and runs the
+recent and full collections on an internal schedule instead of cron.
+With COLLECTOR_POLL_SECONDS set it also lists every server that often and,
+as soon as a file is new or has changed since it was last fetched, fetches
+just those files into the current hour's recent run. That run's archive is
+rebuilt from the stored files every COLLECTOR_ARCHIVE_MINUTES and once its
+hour is over, rather than after every change.
+Run it on its own (python3 collector.py -c config.cfg) or start it from
+the web interface with COLLECTOR_ENABLED=true.
+"""
+import argparse
+import signal
+import sys
+import threading
+import time
+
+import fetcher
+import metrics
+from config import DEFAULT_CONFIG_FILE, config_bool, config_int, get_servers, load_config
+from manifest import Manifest
+from pool import close_pools, create_pools
+
+# Defaults match the recommended crontab: recent every hour, full every 3 hours
+DEFAULT_RECENT_INTERVAL_MINUTES = 60
+DEFAULT_RECENT_FILES = 10
+DEFAULT_FULL_INTERVAL_HOURS = 3
+DEFAULT_KEEPALIVE_SECONDS = 60
+# Change polling is off unless COLLECTOR_POLL_SECONDS is set
+DEFAULT_POLL_SECONDS = 0
+# Longest a run updated by the poller waits for its archive to be rebuilt
+DEFAULT_ARCHIVE_MINUTES = 15
+
+
+def next_aligned(now, interval):
+    """Next wall-clock time that is a multiple of interval seconds after local midnight"""
+    local = time.localtime(now)
+    midnight = time.mktime((local.tm_year, local.tm_mon, local.tm_mday, 0, 0, 0, 0, 0, -1))
+    elapsed = now - midnight
+    return midnight + (int(elapsed // interval) + 1) * interval
+
+
+class Collector:
+    """Schedules collections and keeps FTP connection pools alive between them"""
+
+    def __init__(self, config, log=print):
+        self.config = config
+        self.log = log
+        self.servers = get_servers(config)
+        self.pools = create_pools(self.servers, log=log)
+        self.recent_interval = 60 * config_int(
+            config, 'COLLECTOR_RECENT_INTERVAL_MINUTES', DEFAULT_RECENT_INTERVAL_MINUTES)
+        self.recent_files = config_int(config, 'COLLECTOR_RECENT_FILES', DEFAULT_RECENT_FILES)
+        self.full_interval = 3600 * config_int(
+            config, 'COLLECTOR_FULL_INTERVAL_HOURS', DEFAULT_FULL_INTERVAL_HOURS)
+        self.keepalive_interval = config_int(
+            config, 'COLLECTOR_KEEPALIVE_SECONDS', DEFAULT_KEEPALIVE_SECONDS)
+        self.poll_interval = config_int(config, 'COLLECTOR_POLL_SECONDS', DEFAULT_POLL_SECONDS)
+        if self.poll_interval and not config_bool(config, 'INCREMENTAL_SYNC', True):
+            # Changes are detected against the incremental sync manifests
+            log("Collector: change polling needs INCREMENTAL_SYNC, polling is disabled")
+            self.poll_interval = 0
+        self.archive_interval = 60 * config_int(config, 'COLLECTOR_ARCHIVE_MINUTES',
+                                                DEFAULT_ARCHIVE_MINUTES)
+        # Only used to list the servers; remembers which servers support MLSD
+        self._lister = fetcher.FetchEngine(self.servers, log=log)
+        # Previous listing of each server: {name: (size, mtime)}
+        self._listings = {}
+        # Changed files of each server the last poll tried to fetch: {name: set of file names}
+        self._pending = {}
+        # Recent runs the poller added files to since their archive was built:
+        # {timestamp: time of the first such change}
+        self._stale_archives = {}
+        self.last_runs = {}
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        """Start the scheduler and keepalive threads in the background"""
+        targets = [self._connect_all, self._schedule_loop, self._keepalive_loop]
+        if self.poll_interval:
+            targets.append(self._poll_loop)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self.update_archives(force=True)
+        close_pools(self.pools)
+
+    def wait(self):
+        while not self._stop.wait(1):
+            pass
+
+    def _connect_all(self):
+        for pool in self.pools.values():
+            try:
+                pool.warm_up(pool.size)
+                self.log(f"Collector: {pool.size} connections open to {pool.server['label']}")
+            except Exception as e:
+                self.log(f"Collector: could not connect to {pool.server['label']}: {e}")
+
+    def _keepalive_loop(self):
+        while not self._stop.wait(self.keepalive_interval):
+            for pool in self.pools.values():
+                try:
+                    pool.keepalive()
+                except Exception as e:
+                    self.log(f"Collector: keepalive for {pool.server['label']} failed: {e}")
+
+    def _schedule_loop(self):
+        now = time.time()
+        next_recent = next_aligned(now, self.recent_interval)
+        next_full = next_aligned(now, self.full_interval)
+        while not self._stop.is_set():
+            due = min(next_recent, next_full)
+            if self._stop.wait(max(0, due - time.time())):
+                break
+            now = time.time()
+            # When both are due the quick recent run goes first
+            if now >= next_recent:
+                self.run('recent', self.recent_files)
+                next_recent = next_aligned(time.time(), self.recent_interval)
+            if now >= next_full:
+                self.run('full')
+                next_full = next_aligned(time.time(), self.full_interval)
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            # A collection that is running will pick up the changes itself
+            if self._run_lock.locked():
+                continue
+            try:
+                self.poll()
+            except Exception as e:
+                self.log(f"Collector: polling failed: {e}")
+            self.update_archives()
+
+    def changed_files(self):
+        """List every server; returns {server name: new or changed file names}
+
+        A file is changed when its listing differs from the previous poll and from
+        the manifest. Files an earlier poll found stay changed until the manifest
+        has them, so a failed fetch is retried on the next poll.
+        """
+        base_dir = self.config['BASE_DIR']
+        changed = {}
+        for server in self.servers:
+            try:
+                entries = self._lister.list_files(self.pools[server['name']])
+            except Exception as e:
+                self.log(f"Collector: listing {server['label']} failed: {e}")
+                continue
+            previous = self._listings.get(server['name'])
+            self._listings[server['name']] = {e['name']: (e['size'], e['mtime']) for e in entries}
+            # The first listing is only the baseline; old files are left to the scheduled runs
+            if previous is None:
+                continue
+            manifest = Manifest(base_dir, server['name'])
+            pending = self._pending.get(server['name'], set())
+            names = {entry['name'] for entry in manifest.changed(entries)
+                     if entry['name'] in pending
+                     or previous.get(entry['name']) != (entry['size'], entry['mtime'])}
+            self._pending[server['name']] = names
+            if names:
+                metrics.POLL_CHANGES.labels(server=server['name']).inc(len(names - pending))
+                changed[server['name']] = names
+        return changed
+
+    def poll(self):
+        """Fetch new and changed files into this hour's recent run; returns the result or None"""
+        changed = self.changed_files()
+        if not changed:
+            return None
+        self.log("Collector: changes found on " + ", ".join(
+            f"{name} ({len(names)} files)" for name, names in changed.items()))
+        # Only the changed files are fetched and indexed; the archive is rebuilt later
+        timestamp = time.strftime('%Y_%m_%d_%H')
+        self._stale_archives.setdefault(timestamp, time.time())
+        return self.run('recent', names=changed, timestamp=timestamp)
+
+    def update_archives(self, force=False):
+        """Rebuild the archives of runs the poller changed, once they are due"""
+        current = time.strftime('%Y_%m_%d_%H')
+        for timestamp, since in sorted(self._stale_archives.items()):
+            # Due when the run's hour is over or it has waited COLLECTOR_ARCHIVE_MINUTES
+            if not force and timestamp == current and time.time() - since < self.archive_interval:
+                continue
+            if self._stale_archives.pop(timestamp, None) is None:
+                continue
+            with self._run_lock:
+                try:
+                    fetcher.rebuild_archive(self.config, 'recent', timestamp, log=self.log)
+                except Exception as e:
+                    self.log(f"Collector: rebuilding the archive of the {timestamp} run failed: {e}")
+
+    def run(self, mode, num_files=1, names=None, timestamp=None):
+        """Run one collection using the persistent connections"""
+        # One scheduled collection at a time; a run that overruns skips the missed slot
+        with self._run_lock:
+            start = time.time()
+            self.log(f"Collector: starting {mode} collection")
+            try:
+                result = fetcher.run_collection(self.config, mode, num_files, timestamp=timestamp,
+                                                log=self.log, pools=self.pools, names=names)
+            except Exception as e:
+                self.log(f"Collector: {mode} collection failed: {e}")
+                result = {'success': False}
+            result['duration'] = time.time() - start
+            result['finished'] = time.time()
+            self.last_runs[mode] = result
+            self.log(f"Collector: {mode} collection finished in {result['duration']:.1f}s")
+            return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Harmonic log collector service")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+
+    def log(message):
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+    collector = Collector(config, log=log)
+    signal.signal(signal.SIGTERM, lambda signum, frame: collector.stop())
+    log(f"Collector started: recent every {collector.recent_interval // 60} minutes "
+        f"({collector.recent_files} files), full every {collector.full_interval // 3600} hours"
+        + (f", polling for changes every {collector.poll_interval} seconds "
+           f"(archives rebuilt every {collector.archive_interval // 60} minutes)"
+           if collector.poll_interval else ""))
+    collector.start()
+    try:
+        collector.wait()
+    except KeyboardInterrupt:
+        collector.stop()
+    log("Collector stopped")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
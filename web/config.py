@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Configuration for the Harmonic Log Fetcher.
+config.cfg is a bash-style file of KEY="value" lines. It is parsed once per
+process and only parsed again when its modification time or size changes,
+so the web interface can look at it on every request without re-reading it.
+
+Settings are checked against a schema of known keys and their types. Any
+number of playout servers can be configured: SERVERS lists their prefixes
+and each one has its own PREFIX_IP, PREFIX_PORT, PREFIX_USER, PREFIX_PASS and
+PREFIX_PATH, plus optional PREFIX_LABEL, PREFIX_CONNECTIONS, PREFIX_MAX_KBPS,
+PREFIX_ONAIR_CONNECTIONS, PREFIX_ONAIR_MAX_KBPS and PREFIX_RETENTION_DAYS.
+
+Run it to check a config file (the shell scripts do so before a collection):
+    python3 config.py -c /path/to/config.cfg [--get KEY] [--servers]
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+
+# Paths of the installation; HARMONIC_CONFIG points at a different config file
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG_FILE = os.environ.get('HARMONIC_CONFIG', "/home/kburki/KTOO/Harmonic/config.cfg")
+WEB_USERS_CONFIG = os.path.join(os.path.dirname(DEFAULT_CONFIG_FILE), "web_users.cfg")
+SCRIPT_PATH = os.path.join(INSTALL_DIR, "fetch_harmonic_logs.sh")
+
+DEFAULT_SERVERS = "MEDIACENTER MEDIADECK"
+DEFAULT_CONNECTIONS_PER_SERVER = 2
+# Display names of the servers the fetcher was first written for
+SERVER_LABELS = {'MEDIACENTER': 'MediaCenter', 'MEDIADECK': 'MediaDeck'}
+
+
+def parse_hours(value):
+    """Parse hour ranges such as "06-23" or "22-02,12-14" into [(start, end)]"""
+    hours = []
+    for part in filter(None, re.split(r'[\s,]+', value)):
+        match = re.match(r'^(\d{1,2})-(\d{1,2})$', part)
+        if not match or not all(0 <= int(h) <= 24 for h in match.groups()):
+            raise ValueError(f"{part!r} is not a range of hours like 06-23")
+        hours.append((int(match.group(1)) % 24, int(match.group(2)) % 24))
+    return hours
+
+
+# Known settings and their types; values are kept as strings in the config dict
+SETTINGS = {
+    'BASE_DIR': str,
+    'SERVERS': str,
+    'RETENTION_DAYS': int,
+    'RECENT_RETENTION_HOURS': int,
+    'RETENTION_MAX_GB': float,
+    'FETCH_CONNECTIONS_PER_SERVER': int,
+    'FETCH_MAX_TRANSFERS': int,
+    'ADAPTIVE_CONCURRENCY': bool,
+    'ONAIR_HOURS': parse_hours,
+    'ONAIR_MAX_KBPS': int,
+    'ONAIR_CONNECTIONS': int,
+    'INCREMENTAL_SYNC': bool,
+    'BLOB_STORE': bool,
+    'COLLECTOR_ENABLED': bool,
+    'COLLECTOR_RECENT_INTERVAL_MINUTES': int,
+    'COLLECTOR_RECENT_FILES': int,
+    'COLLECTOR_FULL_INTERVAL_HOURS': int,
+    'COLLECTOR_KEEPALIVE_SECONDS': int,
+    'COLLECTOR_POLL_SECONDS': int,
+    'COLLECTOR_ARCHIVE_MINUTES': int,
+    'ARCHIVE_FORMAT': ('gzip', 'zstd'),
+    'ARCHIVE_THREADS': int,
+    'ARCHIVE_COMPRESSION_LEVEL': int,
+    'SEARCH_INDEX': bool,
+    'EVENT_STORE': bool,
+    'EVENT_WORKERS': int,
+    'METRICS_FILE': str,
+    'METRICS_TOKEN': str,
+    'JOB_HISTORY_MAX_JOBS': int,
+    'JOB_HISTORY_DAYS': int,
+    'JOB_WORKERS': int,
+}
+REQUIRED_SETTINGS = ('BASE_DIR',)
+
+# Settings of each server, prefixed with the server's name from SERVERS
+SERVER_SETTINGS = {
+    'IP': str,
+    'PORT': int,
+    'USER': str,
+    'PASS': str,
+    'PATH': str,
+    'LABEL': str,
+    'CONNECTIONS': int,
+    'MAX_KBPS': int,
+    'ONAIR_CONNECTIONS': int,
+    'ONAIR_MAX_KBPS': int,
+    'RETENTION_DAYS': int,
+}
+REQUIRED_SERVER_SETTINGS = ('IP', 'USER', 'PATH')
+
+BOOLEAN_VALUES = ('true', 'false')
+SERVER_PREFIX_PATTERN = re.compile(r'^[A-Z][A-Z0-9]*$')
+
+# Parsed config files: path -> ((mtime, size), config)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def parse_config(config_file):
+    """Parse a bash-style config file into a dict of strings"""
+    config = {}
+    with open(config_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('export '):
+                line = line[len('export '):].lstrip()
+            if line and not line.startswith('#') and '=' in line:
+                key, value = line.split('=', 1)
+                config[key.strip()] = value.strip().strip('"').strip("'")
+    return config
+
+
+def load_config(config_file=DEFAULT_CONFIG_FILE, log=None):
+    """Return the settings in a config file, parsing it only when it has changed.
+
+    Each call gets its own copy, so callers may change it. With a log function,
+    problems found by validate_config are reported whenever the file is parsed.
+    """
+    stat = os.stat(config_file)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(config_file)
+        if cached is None or cached[0] != version:
+            cached = (version, parse_config(config_file))
+            _cache[config_file] = cached
+            if log:
+                for problem in validate_config(cached[1]):
+                    log(f"Warning: {config_file}: {problem}")
+    return dict(cached[1])
+
+
+def _check_value(key, kind, value):
+    """Return a problem with one setting's value, or None"""
+    if isinstance(kind, tuple):
+        if value not in kind:
+            return f"{key} must be one of {', '.join(kind)}, not {value!r}"
+    elif kind is bool:
+        if value.lower() not in BOOLEAN_VALUES:
+            return f"{key} must be true or false, not {value!r}"
+    elif kind in (int, float):
+        try:
+            number = kind(value)
+        except ValueError:
+            return f"{key} must be a{'n integer' if kind is int else ' number'}, not {value!r}"
+        if number < 0:
+            return f"{key} must not be negative"
+    elif kind is parse_hours:
+        try:
+            parse_hours(value)
+        except ValueError as e:
+            return f"{key}: {e}"
+    return None
+
+
+def validate_config(config):
+    """Check settings against the schema; returns a list of problems"""
+    problems = [f"{key} is not set" for key in REQUIRED_SETTINGS if not config.get(key)]
+    for key, kind in SETTINGS.items():
+        if config.get(key):
+            problems.append(_check_value(key, kind, config[key]))
+    prefixes = server_prefixes(config)
+    if not prefixes:
+        problems.append("SERVERS lists no servers")
+    for prefix in prefixes:
+        if not SERVER_PREFIX_PATTERN.match(prefix):
+            problems.append(f"Server name {prefix!r} in SERVERS must be letters and digits")
+            continue
+        for key in REQUIRED_SERVER_SETTINGS:
+            if not config.get(f'{prefix}_{key}'):
+                problems.append(f"{prefix}_{key} is not set")
+        for key, kind in SERVER_SETTINGS.items():
+            if config.get(f'{prefix}_{key}'):
+                problems.append(_check_value(f'{prefix}_{key}', kind, config[f'{prefix}_{key}']))
+    return [problem for problem in problems if problem]
+
+
+def config_int(config, key, default):
+    """Read a positive integer setting, falling back to the default"""
+    try:
+        value = int(config.get(key, default))
+        return value if value > 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+def config_float(config, key, default=0.0):
+    """Read a non-negative number setting, falling back to the default"""
+    try:
+        value = float(config.get(key) or default)
+        return value if value >= 0 else default
+    except (TypeError, ValueError):
+        return default
+
+
+def config_bool(config, key, default=False):
+    """Read a true/false setting, falling back to the default"""
+    value = (config.get(key) or '').lower()
+    return value == 'true' if value in BOOLEAN_VALUES else default
+
+
+def server_prefixes(config):
+    """Config prefixes of the servers listed in SERVERS"""
+    return [prefix for prefix in re.split(r'[\s,]+', config.get('SERVERS') or DEFAULT_SERVERS)
+            if prefix]
+
+
+def get_servers(config):
+    """Build the list of servers to fetch from the configuration"""
+    connections = config_int(config, 'FETCH_CONNECTIONS_PER_SERVER', DEFAULT_CONNECTIONS_PER_SERVER)
+    onair_connections = config_int(config, 'ONAIR_CONNECTIONS', 0)
+    onair_max_kbps = config_int(config, 'ONAIR_MAX_KBPS', 0)
+    try:
+        onair_hours = parse_hours(config.get('ONAIR_HOURS', ''))
+    except ValueError:
+        onair_hours = []
+    servers = []
+    for prefix in server_prefixes(config):
+        if not config.get(f'{prefix}_IP'):
+            continue
+        servers.append({
+            'name': prefix.lower(),
+            'label': config.get(f'{prefix}_LABEL') or SERVER_LABELS.get(prefix, prefix.title()),
+            'ip': config[f'{prefix}_IP'],
+            'port': config_int(config, f'{prefix}_PORT', 21),
+            'user': config.get(f'{prefix}_USER', ''),
+            'password': config.get(f'{prefix}_PASS', ''),
+            'path': config.get(f'{prefix}_PATH', '/'),
+            'connections': config_int(config, f'{prefix}_CONNECTIONS', connections),
+            # Bytes per second over all of the server's connections (0 = no limit)
+            'max_rate': config_int(config, f'{prefix}_MAX_KBPS', 0) * 1024,
+            # Lower limits during ONAIR_HOURS (0 = same as the rest of the day)
+            'onair_hours': onair_hours,
+            'onair_connections': config_int(config, f'{prefix}_ONAIR_CONNECTIONS', onair_connections),
+            'onair_max_rate': config_int(config, f'{prefix}_ONAIR_MAX_KBPS', onair_max_kbps) * 1024,
+            # Fewer transfers while the server responds slowly or fails
+            'adaptive': config_bool(config, 'ADAPTIVE_CONCURRENCY', True),
+            # Days to keep this server's files in run directories (0 = RETENTION_DAYS)
+            'retention_days': config_int(config, f'{prefix}_RETENTION_DAYS', 0),
+        })
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a Harmonic Log Fetcher config file")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    parser.add_argument('--get', metavar='KEY', help="Print the value of one setting")
+    parser.add_argument('--servers', action='store_true',
+                        help="Print the directory name of each configured server")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}", file=sys.stderr)
+        return 1
+    if args.get:
+        print(config.get(args.get, ''))
+        return 0
+    if args.servers:
+        for server in get_servers(config):
+            print(server['name'])
+        return 0
+    problems = validate_config(config)
+    for problem in problems:
+        print(f"Error: {args.config_file}: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
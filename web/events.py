@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Structured event store for the collected Harmonic logs.
+After each collection the downloaded files are parsed in a process pool
+into events (timestamp, server, severity, component, message) that are
+written as Parquet files partitioned by day and server:
+
+    BASE_DIR/.state/events/date=2025-06-01/server=mediacenter/*.parquet
+
+Time-range queries only read the partitions for the days and servers
+asked for. Requires the pyarrow package; without it extraction is skipped.
+"""
+import argparse
+import datetime
+import fcntl
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import runs
+from config import DEFAULT_CONFIG_FILE, config_bool, config_int, load_config
+from manifest import state_dir, write_json_atomic
+from search import HEAD_SIZE, head_crc, match_line_timestamp
+
+DEFAULT_QUERY_LIMIT = 1000
+# Events are written out in parts of this many rows, bounding worker memory
+PART_ROWS = 100000
+# Partitions with more parts than this are merged into one file
+COMPACT_PARTS = 16
+READ_SIZE = 1024 * 1024
+MAX_MESSAGE_LENGTH = 8192
+
+SEVERITY_PATTERN = re.compile(
+    r'\b(TRACE|DEBUG|INFO|NOTICE|WARNING|WARN|ERROR|ERR|CRITICAL|CRIT|FATAL)\b', re.IGNORECASE)
+SEVERITY_NAMES = {'WARNING': 'WARN', 'ERR': 'ERROR', 'CRIT': 'CRITICAL'}
+# "[Component]", "<Component>" or "Component:" in front of the message
+COMPONENT_PATTERN = re.compile(r'[\[(<]([^\])>]{1,64})[\])>]\s*[:-]?\s*|([\w.\-/]{1,64}):\s+')
+FRACTION_PATTERN = re.compile(r'[.,]\d{1,6}')
+
+
+def event_schema():
+    return pyarrow.schema([
+        ('timestamp', pyarrow.timestamp('ms', tz='UTC')),
+        ('server', pyarrow.string()),
+        ('file', pyarrow.string()),
+        ('line_no', pyarrow.int64()),
+        ('severity', pyarrow.string()),
+        ('component', pyarrow.string()),
+        ('message', pyarrow.string()),
+    ])
+
+
+def events_dir(base_dir):
+    return state_dir(base_dir, 'events')
+
+
+def partition_path(root, day, server):
+    return os.path.join(root, f"date={day}", f"server={server}")
+
+
+def parse_event(line):
+    """Split a log line into (timestamp, severity, component, message).
+
+    timestamp is None for lines without one, such as stack trace continuations.
+    """
+    timestamp, end = match_line_timestamp(line)
+    if timestamp is None:
+        return None, None, None, line.strip()
+    fraction = FRACTION_PATTERN.match(line, end)
+    if fraction:
+        timestamp += float('0.' + fraction.group(0)[1:])
+        end = fraction.end()
+    rest = line[end:].lstrip(' \t|-:,')
+
+    severity = None
+    match = SEVERITY_PATTERN.search(rest, 0, 40)
+    if match:
+        severity = match.group(1).upper()
+        severity = SEVERITY_NAMES.get(severity, severity)
+        rest = (rest[:match.start()] + ' ' + rest[match.end():]).strip(' \t|-:,')
+
+    component = None
+    match = COMPONENT_PATTERN.match(rest)
+    if match:
+        component = (match.group(1) or match.group(2)).strip()
+        rest = rest[match.end():]
+    return timestamp, severity, component, rest.strip()
+
+
+class _PartWriter:
+    """Collects events and writes them to day partitions in bounded parts"""
+
+    def __init__(self, root, server, name):
+        self.root = root
+        self.server = server
+        self.name = name
+        self.rows = []
+        self.written = set()  # partition directories written to
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def extend_message(self, text):
+        """Append a continuation line to the previous event"""
+        row = self.rows[-1]
+        if len(row[4]) < MAX_MESSAGE_LENGTH:
+            self.rows[-1] = row[:4] + ((row[4] + '\n' + text)[:MAX_MESSAGE_LENGTH],)
+
+    def flush(self, offset, keep_last=False):
+        """Write the collected events; keep_last holds back the newest for continuation lines"""
+        rows = self.rows[:-1] if keep_last else self.rows
+        self.rows = self.rows[-1:] if keep_last else []
+        by_day = {}
+        for row in rows:
+            day = time.strftime('%Y-%m-%d', time.localtime(row[0]))
+            by_day.setdefault(day, []).append(row)
+        for day, day_rows in by_day.items():
+            directory = partition_path(self.root, day, self.server)
+            os.makedirs(directory, exist_ok=True)
+            columns = list(zip(*day_rows))
+            table = pyarrow.Table.from_arrays([
+                pyarrow.array([int(t * 1000) for t in columns[0]], pyarrow.int64()).cast(
+                    pyarrow.timestamp('ms', tz='UTC')),
+                pyarrow.array([self.server] * len(day_rows), pyarrow.string()),
+                pyarrow.array([self.name] * len(day_rows), pyarrow.string()),
+                pyarrow.array(columns[1], pyarrow.int64()),
+                pyarrow.array(columns[2], pyarrow.string()),
+                pyarrow.array(columns[3], pyarrow.string()),
+                pyarrow.array(columns[4], pyarrow.string()),
+            ], schema=event_schema())
+            path = os.path.join(directory, f"{self.name}@{offset}.parquet")
+            pyarrow.parquet.write_table(table, path + '.part', compression='zstd')
+            os.replace(path + '.part', path)
+            self.written.add(directory)
+
+
+def extract_file(root, f, offset, line_no, last_timestamp):
+    """Parse new lines of one log file into event parts (runs in a worker process).
+
+    Returns the new (offset, line_no, last_timestamp) and the partitions written.
+    """
+    writer = _PartWriter(root, f['server'], f['name'])
+    compressed = f['name'].endswith('.gz')
+    timestamp = last_timestamp or f['mtime']
+    part_offset = offset
+    raw = runs.open_run_file(f)
+    if compressed:
+        source = gzip.GzipFile(fileobj=raw)
+    else:
+        source = raw
+        source.seek(offset)
+    with raw, source:
+        remainder = b''
+        while True:
+            data = source.read(READ_SIZE)
+            if not data and compressed and remainder:
+                # A compressed log is complete, so its last line counts too
+                data, remainder = remainder + b'\n', b''
+            elif not data:
+                break
+            else:
+                data = remainder + data
+            end = data.rfind(b'\n')
+            if end < 0:
+                remainder = data
+                continue
+            remainder = data[end + 1:]
+            # Only complete lines are parsed; the rest is picked up next run
+            offset += end + 1
+            for raw in data[:end].split(b'\n'):
+                line_no += 1
+                line = raw.decode('utf-8', 'replace').rstrip('\r')
+                if not line.strip():
+                    continue
+                event_time, severity, component, message = parse_event(line)
+                if event_time is None and writer.rows:
+                    writer.extend_message(message)
+                    continue
+                timestamp = event_time or timestamp
+                writer.add((timestamp, line_no, severity, component,
+                            message[:MAX_MESSAGE_LENGTH]))
+            if len(writer.rows) >= PART_ROWS:
+                writer.flush(part_offset, keep_last=True)
+                part_offset = offset
+    if writer.rows:
+        writer.flush(part_offset)
+    return offset, line_no, timestamp, sorted(writer.written)
+
+
+class EventStore:
+    """Parquet event partitions under BASE_DIR/.state/events"""
+
+    def __init__(self, base_dir, workers=None):
+        self.base_dir = base_dir
+        self.root = events_dir(base_dir)
+        self.state_path = os.path.join(self.root, 'state.json')
+        self.lock_path = os.path.join(self.root, '.lock')
+        self.workers = workers or min(4, os.cpu_count() or 1)
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return json.load(f).get('files', {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Error reading event state {self.state_path}: {e}")
+            return {}
+
+    def extract_run(self, run_path, log=print):
+        """Parse the new lines of a run directory's files; returns the number of files parsed"""
+        # One extraction at a time: recent and full collections can overlap
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self._read_state()
+            jobs = []
+            for f in runs.iter_run_files(run_path):
+                key = f"{f['server']}/{f['name']}"
+                previous = state.get(key)
+                # Many runs hold a copy of the same file; an older one than was parsed adds nothing
+                if previous and (f['mtime'], f['size']) <= (previous['mtime'], previous['size']):
+                    continue
+                # Plain logs only grow; anything else that changed is parsed again from the start
+                append = (previous is not None and not f['name'].endswith('.gz')
+                          and f['size'] >= previous['offset']
+                          and previous['head_crc'] == head_crc(f, min(HEAD_SIZE, previous['offset'])))
+                if previous and not append:
+                    self._remove_file(f['server'], f['name'])
+                start = previous if append else {'offset': 0, 'line_no': 0, 'last_timestamp': None}
+                jobs.append((f, key, start))
+
+            touched = set()
+            # Collections run in threads of the web app and collector; forking those
+            # could copy a lock another thread holds, so the workers come from a forkserver
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=multiprocessing.get_context('forkserver')) as executor:
+                futures = [(f, key, executor.submit(extract_file, self.root, f, start['offset'],
+                                                    start['line_no'], start['last_timestamp']))
+                           for f, key, start in jobs]
+                for f, key, future in futures:
+                    try:
+                        offset, line_no, last_timestamp, written = future.result()
+                    except (OSError, EOFError, zlib.error, pyarrow.ArrowException) as e:
+                        log(f"Error extracting events from {f['path']}: {e}")
+                        continue
+                    touched.update(written)
+                    state[key] = {'size': f['size'], 'mtime': f['mtime'], 'offset': offset,
+                                  'line_no': line_no, 'last_timestamp': last_timestamp,
+                                  'head_crc': head_crc(f, min(HEAD_SIZE, offset))}
+            write_json_atomic(self.state_path, {'files': state})
+            for directory in touched:
+                self._compact(directory)
+        return len(jobs)
+
+    def _parts(self, directory):
+        return sorted(entry.path for entry in os.scandir(directory)
+                      if entry.name.endswith('.parquet'))
+
+    def _compact(self, directory):
+        """Merge the small parts that incremental runs leave in a partition"""
+        parts = self._parts(directory)
+        if len(parts) <= COMPACT_PARTS:
+            return
+        table = pyarrow.concat_tables(pyarrow.parquet.read_table(part) for part in parts)
+        path = os.path.join(directory, f"compacted-{time.time_ns()}.parquet")
+        pyarrow.parquet.write_table(table.sort_by('timestamp'), path + '.part', compression='zstd')
+        os.replace(path + '.part', path)
+        for part in parts:
+            os.remove(part)
+
+    def _remove_file(self, server, name):
+        """Drop the events of a file that was replaced, so it can be parsed again"""
+        if not os.path.isdir(self.root):
+            return
+        for day_dir in os.scandir(self.root):
+            directory = os.path.join(day_dir.path, f"server={server}")
+            if not day_dir.name.startswith('date=') or not os.path.isdir(directory):
+                continue
+            for part in self._parts(directory):
+                if os.path.basename(part).startswith(f"{name}@"):
+                    os.remove(part)
+                elif os.path.basename(part).startswith('compacted-'):
+                    table = pyarrow.parquet.read_table(part)
+                    kept = table.filter(pyarrow.compute.not_equal(table['file'], name))
+                    if kept.num_rows != table.num_rows:
+                        pyarrow.parquet.write_table(kept, part + '.part', compression='zstd')
+                        os.replace(part + '.part', part)
+
+    def prune(self, keep_days, servers=None):
+        """Delete partitions older than keep_days; returns the number removed.
+
+        Without servers whole days are removed, otherwise only those servers' partitions.
+        """
+        cutoff = (datetime.date.today() - datetime.timedelta(days=keep_days)).isoformat()
+        removed = 0
+        if not os.path.isdir(self.root):
+            return removed
+        for day_dir in os.scandir(self.root):
+            if not (day_dir.is_dir() and day_dir.name.startswith('date=') and day_dir.name[5:] < cutoff):
+                continue
+            if not servers:
+                shutil.rmtree(day_dir.path)
+                removed += 1
+                continue
+            for server in servers:
+                server_dir = os.path.join(day_dir.path, f"server={server}")
+                if os.path.isdir(server_dir):
+                    shutil.rmtree(server_dir)
+                    removed += 1
+        return removed
+
+    def query(self, start=None, end=None, servers=None, severities=None, component=None,
+              text=None, limit=DEFAULT_QUERY_LIMIT):
+        """Events in a time range, newest first, reading only the matching partitions.
+
+        start and end are epoch seconds. Returns dicts with epoch timestamps.
+        """
+        first_day = time.strftime('%Y-%m-%d', time.localtime(start)) if start is not None else ''
+        last_day = time.strftime('%Y-%m-%d', time.localtime(end)) if end is not None else '9999'
+        parts = []
+        for day_dir in sorted(os.scandir(self.root), key=lambda entry: entry.name):
+            day = day_dir.name[5:]
+            if not day_dir.name.startswith('date=') or not first_day <= day <= last_day:
+                continue
+            for server_dir in os.scandir(day_dir.path):
+                if servers and server_dir.name[7:] not in servers:
+                    continue
+                parts.extend(self._parts(server_dir.path))
+        if not parts:
+            return []
+
+        field = pyarrow.dataset.field
+        conditions = []
+        if start is not None:
+            conditions.append(field('timestamp') >= pyarrow.scalar(
+                int(start * 1000), pyarrow.int64()).cast(pyarrow.timestamp('ms', tz='UTC')))
+        if end is not None:
+            conditions.append(field('timestamp') <= pyarrow.scalar(
+                int(end * 1000), pyarrow.int64()).cast(pyarrow.timestamp('ms', tz='UTC')))
+        if severities:
+            conditions.append(field('severity').isin([s.upper() for s in severities]))
+        if component:
+            conditions.append(pyarrow.compute.match_substring(
+                field('component'), component, ignore_case=True))
+        if text:
+            conditions.append(pyarrow.compute.match_substring(
+                field('message'), text, ignore_case=True))
+        condition = None
+        for expression in conditions:
+            condition = expression if condition is None else condition & expression
+
+        dataset = pyarrow.dataset.dataset(parts, schema=event_schema(), format='parquet')
+        table = dataset.to_table(filter=condition)
+        table = table.sort_by([('timestamp', 'descending'), ('line_no', 'descending')])
+        events = table.slice(0, limit).to_pylist()
+        for event in events:
+            event['timestamp'] = event['timestamp'].timestamp()
+        return events
+
+
+def extract_collection(config, log_dir, log=print):
+    """Extract events from a finished collection if EVENT_STORE is enabled"""
+    if not config_bool(config, 'EVENT_STORE', True):
+        return
+    if pyarrow is None:
+        log("pyarrow is not installed, skipping event extraction")
+        return
+    start = time.time()
+    try:
+        store = EventStore(config['BASE_DIR'], workers=config_int(config, 'EVENT_WORKERS', 0))
+        parsed = store.extract_run(log_dir, log=log)
+        log(f"Event store updated: {parsed} files parsed in {time.time() - start:.1f}s")
+    except Exception as e:
+        log(f"Error updating event store: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract or query structured Harmonic log events")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Extract events from every stored run directory")
+    parser.add_argument('--start', help="Start time (YYYY-MM-DDTHH:MM)")
+    parser.add_argument('--end', help="End time (YYYY-MM-DDTHH:MM)")
+    parser.add_argument('-s', dest='server', action='append', help="Only this server")
+    parser.add_argument('--severity', action='append', help="Only this severity (e.g. ERROR)")
+    parser.add_argument('--component', help="Component name contains this text")
+    parser.add_argument('-n', dest='limit', type=int, default=DEFAULT_QUERY_LIMIT,
+                        help="Maximum number of events to show")
+    parser.add_argument('text', nargs='?', help="Message contains this text")
+    args = parser.parse_args()
+
+    if pyarrow is None:
+        print("Error: the event store requires pyarrow (pip install pyarrow)")
+        return 1
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+    store = EventStore(config['BASE_DIR'])
+
+    if args.rebuild:
+        # Oldest first, so each file ends up parsed from its newest copy
+        for run in reversed(runs.list_runs(config['BASE_DIR'])):
+            print(f"Extracted {run['name']}: {store.extract_run(run['path'])} files parsed")
+        return 0
+
+    def epoch(value):
+        return time.mktime(datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M').timetuple())
+
+    started = time.time()
+    events = store.query(start=epoch(args.start) if args.start else None,
+                         end=epoch(args.end) if args.end else None,
+                         servers=args.server, severities=args.severity,
+                         component=args.component, text=args.text, limit=args.limit)
+    for event in reversed(events):
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['timestamp']))
+        print(f"{when} {event['server']} {event['severity'] or '-'} "
+              f"[{event['component'] or '-'}] {event['message']}")
+    print(f"{len(events)} events in {time.time() - started:.3f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
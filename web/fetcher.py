@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+"""
+Concurrent fetch engine for the Harmonic Log Fetcher.
+Downloads log files from all configured playout servers at the same time,
+using several FTP connections per server and a global cap on transfers.
+Can be run from the command line (fetch_harmonic_logs.sh calls it) or
+imported by the web interface.
+"""
+import argparse
+import contextlib
+import fcntl
+import ftplib
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import runs
+from archive import ARCHIVE_SUFFIXES, StreamingArchiveBuilder
+from blobstore import BlobStore
+from catalog import Catalog
+from config import (DEFAULT_CONFIG_FILE, config_bool, config_int, get_servers, load_config,
+                    validate_config)
+from events import extract_collection
+from listing import parse_listing, parse_mlsd, select_recent
+from manifest import Manifest, link_or_copy
+from pool import close_pools, create_pools
+from retention import rotate_logs
+from search import index_collection
+from shaping import create_shapers
+
+# Default fetch settings
+DEFAULT_MAX_TRANSFERS = 4
+BLOCK_SIZE = 64 * 1024
+DOWNLOAD_ATTEMPTS = 3
+# Bytes re-read before the resume offset to check the remote file was only appended to
+RESUME_OVERLAP = 4096
+
+# Only files matching these patterns are collected (same as the old grep filter)
+LOG_PATTERNS = ('.log', '.gz', '.txt')
+
+
+def is_log_file(name):
+    """Check whether a remote file name looks like a Harmonic log file"""
+    return name not in ('.', '..') and any(pattern in name for pattern in LOG_PATTERNS)
+
+
+class ServerStats:
+    """Transfer statistics for one server"""
+
+    def __init__(self, label):
+        self.label = label
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.linked = 0
+        self.linked_bytes = 0
+        self.resumed = 0
+        self.start = time.time()
+        self.end = None
+        self.lock = threading.Lock()
+
+    def add(self, nbytes):
+        with self.lock:
+            self.files += 1
+            self.bytes += nbytes
+
+    def add_linked(self, nbytes):
+        with self.lock:
+            self.linked += 1
+            self.linked_bytes += nbytes
+
+    def add_resumed(self):
+        with self.lock:
+            self.resumed += 1
+
+    def add_failure(self):
+        with self.lock:
+            self.failed += 1
+
+    def finish(self):
+        self.end = time.time()
+
+    @property
+    def seconds(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def throughput(self):
+        """Bytes per second over the whole server fetch"""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self):
+        return (f"{self.label}: {self.files} files, {self.bytes / (1024 * 1024):.1f} MB "
+                f"in {self.seconds:.1f}s ({self.throughput / (1024 * 1024):.2f} MB/s)"
+                + (f", {self.linked} unchanged files linked" if self.linked else "")
+                + (f", {self.resumed} resumed" if self.resumed else "")
+                + (f", {self.failed} failed" if self.failed else ""))
+
+    def as_dict(self):
+        return {'files': self.files, 'failed': self.failed, 'bytes': self.bytes,
+                'linked': self.linked, 'linked_bytes': self.linked_bytes, 'resumed': self.resumed,
+                'seconds': self.seconds, 'throughput': self.throughput}
+
+
+class FetchEngine:
+    """Download logs from several FTP servers concurrently"""
+
+    def __init__(self, servers, max_transfers=DEFAULT_MAX_TRANSFERS, log=print,
+                 base_dir=None, pools=None, on_file=None, blobs=None, timings=None):
+        self.servers = servers
+        self.pools = pools
+        # Per-stage timings of this run, also exported as metrics
+        self.timings = timings or metrics.RunTimings()
+        # Called with (server name, local path, stored file or None) as each file becomes available
+        self.on_file = on_file
+        # With a base directory, unchanged files are tracked in a manifest and not re-downloaded
+        self.base_dir = base_dir
+        # With a blob store, files are also kept there and listed in stored_files for the run
+        self.blobs = blobs
+        self.stored_files = []
+        self._stored_lock = threading.Lock()
+        self.transfer_slots = threading.BoundedSemaphore(max_transfers)
+        # Servers that rejected MLSD are listed with LIST instead
+        self._mlsd_supported = {}
+        self._log = log
+        self._log_lock = threading.Lock()
+        # Bandwidth cap and adaptive number of transfers of each server
+        self.shapers = create_shapers(servers, log=self.log)
+
+    def log(self, message):
+        with self._log_lock:
+            self._log(message)
+
+    def list_files(self, pool):
+        """Get the log files available on a server"""
+        name = pool.server['name']
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            try:
+                with pool.connection() as ftp:
+                    lines = []
+                    if self._mlsd_supported.get(name, True):
+                        try:
+                            ftp.retrlines('MLSD', lines.append)
+                            entries = parse_mlsd(lines)
+                        except ftplib.error_perm:
+                            # Older servers only have LIST
+                            self._mlsd_supported[name] = False
+                    if not self._mlsd_supported.get(name, True):
+                        ftp.retrlines('LIST', lines.append)
+                        entries = parse_listing(lines)
+                return [entry for entry in entries if is_log_file(entry['name'])]
+            except ftplib.all_errors as e:
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    raise
+                self.log(f"Listing {pool.server['label']} failed (attempt {attempt}): {e}")
+
+    def fetch(self, log_dir, num_files=None, names=None):
+        """Fetch from all servers at once; returns stats keyed by server name.
+
+        names ({server name: file names}) limits the fetch to those files.
+        """
+        stats = {}
+        # Without long-lived pools (e.g. from the collector daemon) use pools for this run only
+        pools = self.pools or create_pools(self.servers, log=self.log)
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(self.servers))) as executor:
+                futures = {}
+                for server in self.servers:
+                    if names is not None and not names.get(server['name']):
+                        continue
+                    output_dir = os.path.join(log_dir, server['name'])
+                    os.makedirs(output_dir, exist_ok=True)
+                    stats[server['name']] = ServerStats(server['label'])
+                    futures[server['name']] = executor.submit(
+                        self._fetch_server, pools[server['name']], output_dir, num_files,
+                        stats[server['name']], names.get(server['name']) if names else None)
+                for name, future in futures.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.log(f"Error fetching from {stats[name].label}: {e}")
+                        stats[name].add_failure()
+        finally:
+            if pools is not self.pools:
+                close_pools(pools)
+        return stats
+
+    def _fetch_server(self, pool, output_dir, num_files, stats, names=None):
+        server = pool.server
+        label = server['label']
+        self.log(f"Connecting to {label} ({server['ip']})...")
+        with self.timings.stage('listing', server['name']):
+            entries = self.list_files(pool)
+        self.log(f"Found {len(entries)} log files on {label}")
+
+        if names is not None:
+            entries = [entry for entry in entries if entry['name'] in names]
+            self.log(f"Fetching {len(entries)} selected files from {label}")
+
+        if num_files:
+            entries = select_recent(entries, num_files)
+            self.log(f"Selected the {len(entries)} most recent files from {label}:")
+            for entry in entries:
+                self.log(f"- {entry['name']}")
+
+        manifest = Manifest(self.base_dir, server['name']) if self.base_dir else None
+        if manifest:
+            with self.timings.stage('link_unchanged', server['name']):
+                entries = self._link_unchanged(manifest, entries, output_dir, stats, server)
+
+        shaper = self.shapers[server['name']]
+
+        def worker(entry):
+            resume = True
+            for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+                try:
+                    with shaper.transfer(), pool.connection() as ftp:
+                        local_path = self._download(ftp, entry, output_dir, stats, label,
+                                                    manifest, resume=resume)
+                    stored = self._store(server, entry, local_path) if self.blobs else None
+                    if manifest:
+                        manifest.record(entry, local_path, stored)
+                    if self.on_file:
+                        self.on_file(server['name'], local_path, None)
+                    return
+                except (ResumeMismatch, *ftplib.all_errors) as e:
+                    if isinstance(e, ResumeMismatch):
+                        # The remote file was rotated or rewritten, so fetch it from the start
+                        resume = False
+                        with contextlib.suppress(FileNotFoundError):
+                            os.unlink(os.path.join(output_dir, entry['name']) + '.part')
+                    else:
+                        shaper.observe(error=True)
+                    self.log(f"Failed to download {entry['name']} from {label} "
+                             f"(attempt {attempt} of {DOWNLOAD_ATTEMPTS}): {e}")
+            stats.add_failure()
+            metrics.FILES.labels(server=server['name'], result='failed').inc()
+            partial_path = os.path.join(output_dir, entry['name']) + '.part'
+            if manifest and os.path.exists(partial_path):
+                manifest.record_partial(entry, partial_path)
+
+        self.log(f"Starting download of {len(entries)} files from {label} "
+                 f"using {pool.size} connections...")
+        try:
+            with ThreadPoolExecutor(max_workers=pool.size) as executor:
+                list(executor.map(worker, entries))
+        finally:
+            if manifest:
+                manifest.save()
+            stats.finish()
+        self.log(f"Finished {stats.summary()}")
+
+    def _link_unchanged(self, manifest, entries, output_dir, stats, server):
+        """Link files that are unchanged since the last run; returns the files still to download"""
+        label = server['label']
+        to_download = []
+        for entry in entries:
+            stored = manifest.unchanged_blob(entry, self.blobs) if self.blobs else None
+            if stored:
+                f = self._add_stored(server, entry, stored)
+                manifest.record(entry, os.path.join(output_dir, entry['name']), stored)
+                stats.add_linked(entry['size'])
+                metrics.FILES.labels(server=server['name'], result='linked').inc()
+                if self.on_file:
+                    self.on_file(server['name'], None, dict(f, blobs=self.blobs.root))
+                continue
+            source = manifest.unchanged_copy(entry)
+            if not source:
+                to_download.append(entry)
+                continue
+            dest = os.path.join(output_dir, entry['name'])
+            if os.path.abspath(source) != os.path.abspath(dest):
+                link_or_copy(source, dest)
+            manifest.record(entry, dest, self._store(server, entry, dest) if self.blobs else None)
+            stats.add_linked(entry['size'])
+            metrics.FILES.labels(server=server['name'], result='linked').inc()
+            if self.on_file:
+                self.on_file(server['name'], dest, None)
+        if stats.linked:
+            self.log(f"{stats.linked} files on {label} are unchanged since the last run "
+                     f"({stats.linked_bytes / (1024 * 1024):.1f} MB not re-downloaded)")
+        return to_download
+
+    def _add_stored(self, server, entry, stored):
+        """List a file kept in the blob store as part of this run"""
+        f = {'server': server['name'], 'name': entry['name'], 'size': stored['size'],
+             'mtime': entry['mtime'], 'chunks': stored['chunks']}
+        with self._stored_lock:
+            self.stored_files.append(f)
+        return f
+
+    def _store(self, server, entry, local_path):
+        """Add a fetched file to the blob store; returns its chunks"""
+        with self.timings.stage('blob_store', server['name']):
+            stored, _ = self.blobs.put_file(local_path, compress=not entry['name'].endswith('.gz'))
+        self._add_stored(server, entry, stored)
+        return stored
+
+    def _download(self, ftp, entry, output_dir, stats, label, manifest=None, resume=True):
+        """Download one file, resuming from a local copy when possible, and restore its timestamp.
+
+        An interrupted download (the .part file) is always resumed; the manifest
+        adds the copies kept by earlier runs.
+        """
+        local_path = os.path.join(output_dir, entry['name'])
+        partial_path = local_path + '.part'
+        # Run directories have one sub-directory per server
+        server_name = os.path.basename(output_dir)
+        shaper = self.shapers[server_name]
+        offset = prepare_resume(entry, partial_path, manifest, self.blobs) if resume else 0
+        with self.transfer_slots:
+            start = time.perf_counter()
+            # Time until the server starts sending, a measure of how busy it is
+            first_data = []
+
+            def throttle(nbytes):
+                if not first_data:
+                    first_data.append(time.perf_counter() - start)
+                shaper.throttle(nbytes)
+
+            received = None
+            if offset:
+                try:
+                    received = self._resume(ftp, entry, partial_path, offset, throttle)
+                except ftplib.error_perm as e:
+                    # Server does not support REST, fall back to a full download
+                    self.log(f"Cannot resume {entry['name']} on {label} ({e}), downloading in full")
+            if received is None:
+                with open(partial_path, 'wb') as f:
+                    def write(data):
+                        throttle(len(data))
+                        f.write(data)
+
+                    ftp.retrbinary(f"RETR {entry['name']}", write, blocksize=BLOCK_SIZE)
+                received = os.path.getsize(partial_path)
+            seconds = time.perf_counter() - start
+        shaper.observe(first_data[0] if first_data else seconds)
+        with self.timings.stage('restore_timestamp', server_name):
+            os.replace(partial_path, local_path)
+            os.utime(local_path, (entry['mtime'], entry['mtime']))
+        stats.add(received)
+        resumed = bool(offset) and received < entry['size']
+        self.timings.download(server_name, received, seconds, resumed)
+        if resumed:
+            stats.add_resumed()
+            self.log(f"Downloaded {entry['name']} from {label} "
+                     f"(appended {received} bytes after offset {offset})")
+        else:
+            self.log(f"Downloaded {entry['name']} from {label}")
+        return local_path
+
+    def _resume(self, ftp, entry, partial_path, offset, throttle):
+        """Append the bytes after offset to a partial copy; returns the number of new bytes"""
+        # Re-read a little of what we already have so a rotated or rewritten file is detected
+        overlap_start = max(0, offset - RESUME_OVERLAP)
+        with open(partial_path, 'r+b') as f:
+            f.seek(overlap_start)
+            expected = f.read(offset - overlap_start)
+            f.truncate(offset)
+            f.seek(offset)
+            state = {'pending': bytearray(), 'checked': not expected, 'received': 0}
+
+            def write(data):
+                throttle(len(data))
+                if not state['checked']:
+                    state['pending'].extend(data)
+                    if len(state['pending']) < len(expected):
+                        return
+                    if state['pending'][:len(expected)] != expected:
+                        raise ResumeMismatch(f"{entry['name']} no longer matches the local copy")
+                    state['checked'] = True
+                    data = bytes(state['pending'][len(expected):])
+                f.write(data)
+                state['received'] += len(data)
+
+            ftp.retrbinary(f"RETR {entry['name']}", write, blocksize=BLOCK_SIZE, rest=overlap_start)
+        if not state['checked']:
+            raise ResumeMismatch(f"{entry['name']} is shorter than the local copy")
+        return state['received']
+
+
+class ResumeMismatch(Exception):
+    """Raised when a remote file no longer starts with the bytes of our local copy"""
+
+
+def prepare_resume(entry, partial_path, manifest, blobs=None):
+    """Seed the partial file with the largest usable local prefix; returns its size"""
+    candidates = [partial_path]
+    record = {}
+    if manifest:
+        record = manifest.get(entry['name']) or {}
+        candidates.extend(record[key] for key in ('path', 'partial') if record.get(key))
+    best, best_size = None, 0
+    for path in candidates:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if best_size < size < entry['size']:
+            best, best_size = path, size
+    # The previous copy may only be kept in the blob store
+    stored_size = record.get('stored_size', 0)
+    if blobs and best_size < stored_size < entry['size'] and blobs.has(record['chunks']):
+        blobs.restore(record['chunks'], partial_path)
+        return stored_size
+    if best is None:
+        return 0
+    if best != partial_path:
+        # Copy rather than link: the copy is appended to and must not change older runs
+        shutil.copyfile(best, partial_path)
+    return best_size
+
+
+def run_paths(base_dir, mode, timestamp, suffix='.tar.gz'):
+    """Return the run directory and archive path for a fetch mode"""
+    if mode == 'test':
+        return (os.path.join(base_dir, f"test_{timestamp}"),
+                os.path.join(base_dir, f"harmonic_test_logs_{timestamp}{suffix}"))
+    if mode == 'recent':
+        return (os.path.join(base_dir, f"recent_{timestamp}"),
+                os.path.join(base_dir, f"harmonic_recent_logs_{timestamp}{suffix}"))
+    return (os.path.join(base_dir, timestamp),
+            os.path.join(base_dir, f"harmonic_logs_{timestamp}{suffix}"))
+
+
+def store_run(log_dir, files, log=print):
+    """Replace the downloaded copies in a run directory with a manifest of their chunks.
+
+    Files the run already listed, such as those the change poller added earlier
+    in the hour, are kept unless they were fetched again.
+    """
+    fetched = {(f['server'], f['name']) for f in files}
+    listed = [f for f in runs.read_run_manifest(log_dir) or []
+              if (f['server'], f['name']) not in fetched] + files
+    runs.write_run_manifest(log_dir, listed)
+    for f in files:
+        try:
+            os.remove(os.path.join(log_dir, f['server'], f['name']))
+        except FileNotFoundError:
+            pass
+    for f in files:
+        try:
+            # Server directories are kept while interrupted downloads are left in them
+            os.rmdir(os.path.join(log_dir, f['server']))
+        except OSError:
+            pass
+    log(f"Stored {len(files)} files of {os.path.basename(log_dir)} in the blob store")
+
+
+def record_run_metrics(mode, stats, seconds, success):
+    metrics.RUNS.labels(mode=mode, result='success' if success else 'failed').inc()
+    metrics.RUN_SECONDS.labels(mode=mode).observe(seconds)
+    metrics.RUN_FILES.labels(mode=mode).observe(sum(s.files + s.linked for s in stats.values()))
+    if success:
+        metrics.LAST_SUCCESS.labels(mode=mode).set(time.time())
+
+
+@contextlib.contextmanager
+def run_lock(log_dir, log=print):
+    """Hold a lock on a run directory (creating it), waiting while another process has it.
+
+    Web jobs, the collector and the cron script may start the same run in the
+    same hour; they would write into one run directory and truncate each
+    other's archive, so they take turns.
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    fd = os.open(log_dir, os.O_RDONLY)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log(f"Waiting for another collection of {os.path.basename(log_dir)} to finish...")
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def archive_compression(config, log=print):
+    compression = config.get('ARCHIVE_FORMAT', 'gzip')
+    if compression not in ARCHIVE_SUFFIXES:
+        log(f"Unknown ARCHIVE_FORMAT '{compression}', using gzip")
+        compression = 'gzip'
+    return compression
+
+
+def create_archive_builder(config, archive_path, compression, log=print):
+    return StreamingArchiveBuilder(archive_path, compression,
+                                   level=config_int(config, 'ARCHIVE_COMPRESSION_LEVEL', 0) or None,
+                                   workers=config_int(config, 'ARCHIVE_THREADS', 0) or None,
+                                   log=log)
+
+
+def rebuild_archive(config, mode, timestamp, log=print):
+    """Build a run's archive again from the files stored in its directory; returns its path.
+
+    The change poller adds files to a run without rewriting its archive each
+    time; this brings the archive up to date without contacting the servers.
+    """
+    base_dir = config['BASE_DIR']
+    compression = archive_compression(config, log)
+    log_dir, archive_path = run_paths(base_dir, mode, timestamp, ARCHIVE_SUFFIXES[compression])
+    run_name = os.path.basename(log_dir)
+    with run_lock(log_dir, log=log):
+        files = sorted(runs.iter_run_files(log_dir), key=lambda f: (f['server'], f['name']))
+        builder = create_archive_builder(config, archive_path, compression, log)
+        try:
+            builder.add(log_dir, run_name)
+            for server in sorted({f['server'] for f in files}):
+                # Server directories are removed once their files are in the blob store
+                if os.path.isdir(os.path.join(log_dir, server)):
+                    builder.add(os.path.join(log_dir, server), f"{run_name}/{server}")
+            for f in files:
+                arcname = f"{run_name}/{f['server']}/{f['name']}"
+                if 'chunks' in f:
+                    builder.add(None, arcname, f)
+                else:
+                    builder.add(f['path'], arcname)
+        except BaseException:
+            builder.abort()
+            raise
+        builder.close()
+        try:
+            Catalog(base_dir).record_run(log_dir, archive_path)
+        except Exception as e:
+            log(f"Error updating archive catalog: {e}")
+    log(f"Archive of {run_name} rebuilt with {len(files)} files: {archive_path}")
+    return archive_path
+
+
+def run_collection(config, mode='full', num_files=1, timestamp=None, log=print, pools=None,
+                   names=None):
+    """Run a complete collection: fetch all servers, build the archive and rotate old logs.
+
+    names ({server name: file names}) fetches only those files, for the change
+    poller: they are added to the run's files, and its archive is left to
+    rebuild_archive.
+    """
+    timestamp = timestamp or time.strftime('%Y_%m_%d_%H')
+    log_dir, _ = run_paths(config['BASE_DIR'], mode, timestamp)
+    with run_lock(log_dir, log=log):
+        return _run_collection(config, mode, num_files, timestamp, log, pools, names)
+
+
+def _run_collection(config, mode, num_files, timestamp, log, pools, names):
+    base_dir = config['BASE_DIR']
+    compression = archive_compression(config, log)
+    log_dir, archive_path = run_paths(base_dir, mode, timestamp, ARCHIVE_SUFFIXES[compression])
+    # Files fetched by the poller are added to a run that may already hold others
+    update = names is not None
+    run_name = os.path.basename(log_dir)
+    servers = get_servers(config)
+    timings = metrics.RunTimings()
+
+    log("==========================================================")
+    log("Harmonic Server Log Fetcher")
+    if update:
+        log(f"Fetching {sum(len(n) for n in names.values())} new or changed files "
+            f"into the {mode} run")
+    elif mode == 'full':
+        log(f"Fetching all logs from {len(servers)} servers")
+    else:
+        log(f"{mode.title()} mode - downloading the {num_files} most recent files from each server")
+    log(f"Current timestamp: {time.ctime()}")
+    log("==========================================================")
+
+    # The archive is written while the fetch runs, one member per file as it arrives
+    os.makedirs(log_dir, exist_ok=True)
+    builder = None if update else create_archive_builder(config, archive_path, compression, log)
+    if builder:
+        builder.add(log_dir, run_name)
+    for server in servers:
+        server_dir = os.path.join(log_dir, server['name'])
+        os.makedirs(server_dir, exist_ok=True)
+        if builder:
+            builder.add(server_dir, f"{run_name}/{server['name']}")
+
+    archived = set()
+
+    def add_to_archive(server_name, path, stored):
+        archived.add((server_name, stored['name'] if stored else os.path.basename(path)))
+        if stored:
+            builder.add(None, f"{run_name}/{server_name}/{stored['name']}", stored)
+        else:
+            builder.add(path, f"{run_name}/{server_name}/{os.path.basename(path)}")
+
+    incremental = config_bool(config, 'INCREMENTAL_SYNC', True)
+    blobs = BlobStore(base_dir) if config_bool(config, 'BLOB_STORE') else None
+    engine = FetchEngine(servers,
+                         max_transfers=config_int(config, 'FETCH_MAX_TRANSFERS', DEFAULT_MAX_TRANSFERS),
+                         log=log,
+                         base_dir=base_dir if incremental else None,
+                         pools=pools,
+                         on_file=add_to_archive if builder else None,
+                         blobs=blobs,
+                         timings=timings)
+    start = time.time()
+    # Chunks of this run are not referenced by a run manifest until it is written
+    with blobs.writing() if blobs else contextlib.nullcontext():
+        try:
+            with timings.stage('fetch'):
+                # Selected files are fetched whatever their age
+                recent_only = mode != 'full' and names is None
+                stats = engine.fetch(log_dir, num_files=num_files if recent_only else None,
+                                     names=names)
+        except BaseException:
+            if builder:
+                builder.abort()
+            metrics.RUNS.labels(mode=mode, result='error').inc()
+            raise
+
+        if builder:
+            # Files an earlier collection of this hour stored, such as the poller's, stay in it
+            for f in runs.iter_run_files(log_dir):
+                if (f['server'], f['name']) not in archived:
+                    add_to_archive(f['server'], f['path'], f if 'chunks' in f else None)
+            log(f"Finishing compressed archive at {archive_path}")
+            with timings.stage('archive'):
+                builder.close()
+        if blobs:
+            with timings.stage('store_run'):
+                store_run(log_dir, engine.stored_files, log=log)
+    if builder:
+        with timings.stage('catalog'):
+            try:
+                Catalog(base_dir).record_run(log_dir, archive_path)
+            except Exception as e:
+                log(f"Error updating archive catalog: {e}")
+    with timings.stage('search_index'):
+        index_collection(config, log_dir, log=log)
+    with timings.stage('event_store'):
+        extract_collection(config, log_dir, log=log)
+
+    log("==========================================================")
+    log("Log collection complete")
+    for server_stats in stats.values():
+        log(server_stats.summary())
+    log(f"Total time: {time.time() - start:.1f}s")
+    log("Stage timings: " + ", ".join(
+        f"{t['stage']}" + (f" ({t['server']})" if t['server'] else "") + f" {t['seconds']:.1f}s"
+        for t in timings.as_list()))
+    if builder:
+        log(f"Archive created: {archive_path}")
+    else:
+        log(f"Archive {archive_path} is rebuilt with the new files later")
+    log(f"Log files stored in: {log_dir}")
+    log("==========================================================")
+
+    # Log rotation only runs after full collections
+    if mode == 'full':
+        with timings.stage('rotation'):
+            rotate_logs(config, log=log, current=run_name)
+    elif mode == 'test':
+        log("Test mode: Skipping log rotation")
+        log(f"You may want to manually remove the test logs at: {log_dir}")
+    else:
+        log("Recent mode: Skipping log rotation")
+
+    # A collection that missed any file failed, even if the rest of the server's files arrived
+    success = all(s.failed == 0 for s in stats.values())
+    record_run_metrics(mode, stats, time.time() - start, success)
+    if config.get('METRICS_FILE'):
+        try:
+            metrics.write_textfile(config['METRICS_FILE'])
+        except OSError as e:
+            log(f"Error writing metrics to {config['METRICS_FILE']}: {e}")
+
+    return {
+        'log_dir': log_dir,
+        'archive_path': archive_path,
+        'stats': {name: s.as_dict() for name, s in stats.items()},
+        'timings': timings.as_list(),
+        'archived': builder is not None,
+        'success': success,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch logs from Harmonic playout servers")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    parser.add_argument('-t', dest='test_mode', action='store_true',
+                        help="Test mode: download only recent files from each server")
+    parser.add_argument('-r', dest='recent_mode', action='store_true',
+                        help="Recent mode: download only recent files (for frequent runs)")
+    parser.add_argument('-n', dest='num_files', type=int, default=1,
+                        help="Number of recent files to download in test or recent mode")
+    parser.add_argument('--timestamp', help="Run timestamp (YYYY_MM_DD_HH), defaults to now")
+    args = parser.parse_args()
+
+    if args.num_files < 1:
+        parser.error("Number of files (-n) must be a positive integer")
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+    problems = validate_config(config)
+    if problems:
+        for problem in problems:
+            print(f"Error: {args.config_file}: {problem}")
+        return 1
+
+    mode = 'test' if args.test_mode else 'recent' if args.recent_mode else 'full'
+    result = run_collection(config, mode, args.num_files, timestamp=args.timestamp)
+    return 0 if result['success'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Job queue for collections started from the web interface.
+A fixed number of worker threads run queued collections one at a time
+each. A request that matches a collection already queued or running, in
+this or another web worker process, is attached to that job instead of
+starting another one. All web jobs share
+one set of FTP connection pools, so together they never open more
+connections to a server than FETCH_CONNECTIONS_PER_SERVER allows.
+"""
+import queue
+import threading
+
+from pool import close_pools, create_pools
+
+DEFAULT_WORKERS = 2
+
+
+class JobQueue:
+    """Runs collections on a bounded worker pool, coalescing duplicate requests"""
+
+    def __init__(self, store, run, servers, workers=DEFAULT_WORKERS, pools=None, log=print):
+        """run(job_id, mode, num_files, pools) performs one collection.
+
+        pools are shared connection pools owned by someone else (the collector);
+        without them the queue opens its own while jobs are active.
+        """
+        self.store = store
+        self.run = run
+        self.servers = servers
+        self.log = log
+        self._shared_pools = pools
+        self._pools = None
+        self._running = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        for _ in range(workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, mode, num_files, cmd):
+        """Queue a collection; returns (job id, True if it was attached to an existing job)"""
+        # The same cmd means the same collection; jobs.db knows those of every process
+        job_id, attached = self.store.create_unique(cmd, status='queued')
+        if not attached:
+            self._queue.put(((mode, None if mode == 'full' else num_files), job_id))
+        return job_id, attached
+
+    def _acquire_pools(self):
+        with self._lock:
+            self._running += 1
+            if self._shared_pools is not None:
+                return self._shared_pools
+            if self._pools is None:
+                self._pools = create_pools(self.servers, log=self.log)
+            return self._pools
+
+    def _release_pools(self):
+        with self._lock:
+            self._running -= 1
+            # Don't hold FTP connections open while the queue is idle
+            if self._running == 0 and self._pools is not None and self._queue.empty():
+                pools, self._pools = self._pools, None
+            else:
+                pools = None
+        if pools:
+            close_pools(pools)
+
+    def _worker(self):
+        while True:
+            key, job_id = self._queue.get()
+            # Runs that share a run directory (with each other, the collector or
+            # cron) wait for each other in fetcher.run_lock
+            pools = self._acquire_pools()
+            try:
+                self.store.set_running(job_id)
+                self.run(job_id, key[0], key[1] or 1, pools)
+            except Exception as e:
+                self.log(f"Job {job_id} failed: {e}")
+            finally:
+                self._release_pools()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Persistent store for the web interface's background jobs.
+Jobs and their output are kept in SQLite (BASE_DIR/.state/jobs.db), so job
+history survives a restart and memory stays bounded however many jobs run.
+Output lines are buffered briefly in memory and written in batches; old
+jobs are evicted by age and count. Each job records the process that runs
+it, so with several web worker processes one starting up only fails the
+jobs of processes that are gone.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from manifest import state_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    status TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    cmd TEXT NOT NULL,
+    archive_path TEXT,
+    stats TEXT,
+    line_count INTEGER NOT NULL DEFAULT 0,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_start_time ON jobs (start_time DESC);
+CREATE TABLE IF NOT EXISTS job_output (
+    job_id INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (job_id, line_no)
+) WITHOUT ROWID;
+"""
+
+DEFAULT_MAX_JOBS = 200
+DEFAULT_MAX_AGE_DAYS = 30
+# Output beyond this many lines is dropped to bound the size of a runaway job
+MAX_OUTPUT_LINES = 20000
+# Buffered output is written when this many lines or seconds have accumulated
+FLUSH_LINES = 100
+FLUSH_SECONDS = 2
+
+# How often a stream checks a job run by another process for output
+POLL_SECONDS = 1
+
+# Jobs that are waiting for a worker or running
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def process_owner(pid=None):
+    """Identify a process by its pid and start time, which a reused pid doesn't share"""
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            # The start time is the 22nd field, counted after the command name
+            started = f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return str(pid)
+    return f"{pid}:{started}"
+
+
+def owner_alive(owner):
+    """Whether the process a job was recorded for is still running"""
+    if not owner:
+        return False
+    pid = int(owner.split(':', 1)[0])
+    if ':' in owner:
+        return process_owner(pid) == owner
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """Jobs and their output, persisted in SQLite"""
+
+    def __init__(self, base_dir, max_jobs=DEFAULT_MAX_JOBS, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.path = os.path.join(state_dir(base_dir), 'jobs.db')
+        self.max_jobs = max_jobs
+        self.max_age = max_age_days * 86400
+        # Notified whenever a job's output or status changes, so live streams wake up at once
+        self.updates = threading.Condition()
+        self._pending = {}  # job id -> output lines not yet written
+        self._line_counts = {}  # job id -> lines so far, for running jobs
+        self._last_flush = {}
+        self.owner = process_owner()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            # Databases from before jobs recorded their process
+            if 'owner' not in [row['name'] for row in db.execute("PRAGMA table_info(jobs)")]:
+                db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            # Jobs whose process stopped while they were queued or running will never
+            # finish; those of other worker processes that are still running will
+            interrupted = [row['id'] for row in db.execute(
+                "SELECT id, owner FROM jobs WHERE status IN ('queued', 'running')")
+                if not owner_alive(row['owner'])]
+            for job_id in interrupted:
+                self._write_lines(db, job_id, ["Error: interrupted by a restart of the web interface"])
+            db.executemany("UPDATE jobs SET status = 'failed', end_time = ? WHERE id = ?",
+                           [(time.time(), job_id) for job_id in interrupted])
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def create(self, cmd, status='running'):
+        """Record a new job and return its id"""
+        with self.updates, self._connect() as db:
+            job_id = db.execute("INSERT INTO jobs (status, start_time, cmd, owner) "
+                                "VALUES (?, ?, ?, ?)",
+                                (status, time.time(), cmd, self.owner)).lastrowid
+            self._pending[job_id] = []
+            self._line_counts[job_id] = 0
+            self._last_flush[job_id] = time.time()
+        return job_id
+
+    def create_unique(self, cmd, status='queued'):
+        """Record a new job unless the same cmd is already queued or running.
+
+        The check and insert are one transaction, so web worker processes that
+        get the same request at once still share one job. Returns (job id,
+        True if it is an existing job).
+        """
+        with self.updates, self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            for row in db.execute("SELECT id, owner FROM jobs WHERE cmd = ? AND status IN "
+                                  "('queued', 'running') ORDER BY id", (cmd,)).fetchall():
+                if owner_alive(row['owner']):
+                    return row['id'], True
+            job_id = db.execute("INSERT INTO jobs (status, start_time, cmd, owner) "
+                                "VALUES (?, ?, ?, ?)",
+                                (status, time.time(), cmd, self.owner)).lastrowid
+            self._pending[job_id] = []
+            self._line_counts[job_id] = 0
+            self._last_flush[job_id] = time.time()
+        return job_id, False
+
+    def set_running(self, job_id):
+        """Mark a queued job as started"""
+        with self.updates, self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+            self.updates.notify_all()
+
+    def append(self, job_id, line):
+        """Add an output line to a running job"""
+        with self.updates:
+            count = self._line_counts.get(job_id)
+            if count is None or count > MAX_OUTPUT_LINES:
+                return
+            if count == MAX_OUTPUT_LINES:
+                line = f"... output truncated after {MAX_OUTPUT_LINES} lines"
+            self._pending[job_id].append(str(line))
+            self._line_counts[job_id] = count + 1
+            if (len(self._pending[job_id]) >= FLUSH_LINES
+                    or time.time() - self._last_flush[job_id] >= FLUSH_SECONDS):
+                with self._connect() as db:
+                    self._flush(db, job_id)
+            self.updates.notify_all()
+
+    def logger(self, job_id):
+        """Return a log function that appends to a job's output"""
+        return lambda message: self.append(job_id, message)
+
+    def finish(self, job_id, status, archive_path=None, stats=None):
+        """Mark a job completed or failed and evict old jobs"""
+        with self.updates, self._connect() as db:
+            self._flush(db, job_id)
+            db.execute("UPDATE jobs SET status = ?, end_time = ?, archive_path = ?, stats = ? "
+                       "WHERE id = ?",
+                       (status, time.time(), archive_path,
+                        json.dumps(stats) if stats is not None else None, job_id))
+            self._pending.pop(job_id, None)
+            self._line_counts.pop(job_id, None)
+            self._last_flush.pop(job_id, None)
+            self._evict(db)
+            self.updates.notify_all()
+
+    def _flush(self, db, job_id):
+        lines = self._pending.get(job_id)
+        if lines:
+            self._write_lines(db, job_id, lines)
+            self._pending[job_id] = []
+        self._last_flush[job_id] = time.time()
+
+    def _write_lines(self, db, job_id, lines):
+        start = db.execute("SELECT line_count FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        db.executemany("INSERT INTO job_output (job_id, line_no, text) VALUES (?, ?, ?)",
+                       [(job_id, start + i, line) for i, line in enumerate(lines)])
+        db.execute("UPDATE jobs SET line_count = ? WHERE id = ?", (start + len(lines), job_id))
+
+    def _evict(self, db):
+        expired = [row['id'] for row in db.execute(
+            "SELECT id FROM jobs WHERE status NOT IN ('queued', 'running') "
+            "AND (start_time < ? OR id NOT IN (SELECT id FROM jobs ORDER BY start_time DESC LIMIT ?))",
+            (time.time() - self.max_age, self.max_jobs))]
+        db.executemany("DELETE FROM job_output WHERE job_id = ?", [(job_id,) for job_id in expired])
+        db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+
+    def _job(self, row):
+        job = dict(row)
+        job['stats'] = json.loads(row['stats']) if row['stats'] else None
+        # Running jobs also count the lines still waiting to be written
+        job['line_count'] = self._line_counts.get(row['id'], row['line_count'])
+        return job
+
+    def get(self, job_id):
+        """A job's details without its output, or None"""
+        with self.updates, self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._job(row) if row else None
+
+    def recent(self, limit=10):
+        """The newest jobs, newest first"""
+        with self.updates, self._connect() as db:
+            rows = db.execute("SELECT * FROM jobs ORDER BY start_time DESC LIMIT ?",
+                              (limit,)).fetchall()
+            return [self._job(row) for row in rows]
+
+    def output(self, job_id, offset=0):
+        """A job's output lines from a line offset"""
+        with self.updates, self._connect() as db:
+            lines = [row['text'] for row in db.execute(
+                "SELECT text FROM job_output WHERE job_id = ? AND line_no >= ? ORDER BY line_no",
+                (job_id, offset))]
+            written = db.execute("SELECT line_count FROM jobs WHERE id = ?",
+                                 (job_id,)).fetchone()
+            pending = self._pending.get(job_id, [])
+            if written is not None:
+                lines.extend(pending[max(offset - written[0], 0):])
+            return lines
+
+    def wait(self, job_id, offset, timeout):
+        """Wait until an active job has output past offset or changes status.
+
+        Only this process's jobs notify it; for a job run by another process
+        (or one that has finished) this waits POLL_SECONDS before checking again.
+        """
+        with self.updates:
+            count = self._line_counts.get(job_id)
+            if count is None:
+                self.updates.wait(min(timeout, POLL_SECONDS))
+            elif count <= offset:
+                self.updates.wait(timeout)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+FTP directory listing parsers for the Harmonic Log Fetcher.
+Turns MLSD, unix-style LIST and MS-DOS style LIST output into file
+records ({'name', 'size', 'mtime'}) and picks the most recent files.
+"""
+import calendar
+import datetime
+import heapq
+
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+def parse_mlsd(lines):
+    """Parse MLSD lines ("type=file;size=123;modify=20250601141500; name").
+
+    MLSD times are UTC with second precision, unlike LIST.
+    """
+    entries = []
+    for line in lines:
+        facts_text, sep, name = line.partition(' ')
+        if not sep or not name:
+            continue
+        facts = {}
+        for fact in facts_text.split(';'):
+            key, _, value = fact.partition('=')
+            if key:
+                facts[key.lower()] = value
+        if facts.get('type', '').lower() != 'file':
+            continue
+        try:
+            size = int(facts['size'])
+            modify = facts['modify']
+            # Sliced by hand: strptime would dominate the time for large listings
+            mtime = calendar.timegm((int(modify[0:4]), int(modify[4:6]), int(modify[6:8]),
+                                     int(modify[8:10]), int(modify[10:12]), int(modify[12:14])))
+        except (KeyError, ValueError):
+            continue
+        entries.append({'name': name, 'size': size, 'mtime': float(mtime)})
+    return entries
+
+
+def _parse_unix_line(line, now):
+    # -rw-r--r--   1 owner group   12345 Jun  1 14:15 name with spaces.log
+    parts = line.split(None, 8)
+    if len(parts) < 9 or line[0] in 'dl':
+        return None
+    size = int(parts[4])
+    month = int(parts[5]) if parts[5].isdigit() else MONTHS[parts[5][:3].title()]
+    day = int(parts[6])
+    if ':' in parts[7]:
+        hour, minute = (int(x) for x in parts[7].split(':'))
+        mtime = datetime.datetime(now.year, month, day, hour, minute)
+        # Listings without a year are from the last 12 months
+        if mtime > now + datetime.timedelta(days=1):
+            mtime = mtime.replace(year=now.year - 1)
+    else:
+        mtime = datetime.datetime(int(parts[7]), month, day)
+    return {'name': parts[8], 'size': size, 'mtime': mtime.timestamp()}
+
+
+def _parse_dos_line(line):
+    # 06-01-25  02:15PM                12345 name.log
+    parts = line.split(None, 3)
+    if len(parts) < 4 or parts[2] == '<DIR>':
+        return None
+    date_format = '%m-%d-%Y' if len(parts[0]) == 10 else '%m-%d-%y'
+    mtime = datetime.datetime.strptime(f"{parts[0]} {parts[1]}", f"{date_format} %I:%M%p")
+    return {'name': parts[3], 'size': int(parts[2]), 'mtime': mtime.timestamp()}
+
+
+def parse_listing(lines, now=None):
+    """Parse LIST output in unix (`ls -l`) or MS-DOS (IIS) style into file records"""
+    now = now or datetime.datetime.now()
+    entries = []
+    for line in lines:
+        if not line or line.startswith('total'):
+            continue
+        try:
+            entry = _parse_dos_line(line) if line[0].isdigit() else _parse_unix_line(line, now)
+        except (KeyError, ValueError, IndexError):
+            continue
+        if entry:
+            entries.append(entry)
+    return entries
+
+
+def select_recent(entries, count):
+    """The count most recently modified entries, newest first"""
+    # A heap keeps this O(n log count) for directories with thousands of files
+    return heapq.nlargest(count, entries, key=lambda e: (e['mtime'], e['name']))
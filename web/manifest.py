@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Persistent manifest of remote files that have already been fetched.
+One JSON file per server under BASE_DIR/.state/manifests records the
+name, size and mtime of every remote file together with the newest local
+copy (or its chunks in the blob store), so a run only downloads new or
+changed files and hard-links or references the rest.
+"""
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+
+STATE_DIR_NAME = ".state"
+
+
+def state_dir(base_dir, *parts):
+    """Return (and create) a directory under BASE_DIR/.state"""
+    path = os.path.join(base_dir, STATE_DIR_NAME, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file in the same directory and rename it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class Manifest:
+    """Fetched-file manifest for one server, keyed by remote file name"""
+
+    def __init__(self, base_dir, server_name):
+        directory = state_dir(base_dir, 'manifests')
+        self.path = os.path.join(directory, f"{server_name}.json")
+        self.lock_path = self.path + '.lock'
+        self.entries = self._read()
+        self.changes = {}
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f).get('files', {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Error reading manifest {self.path}: {e}")
+            return {}
+
+    def get(self, name):
+        return self.changes.get(name) or self.entries.get(name)
+
+    def unchanged_copy(self, entry):
+        """Return the local copy of a remote file if it has not changed since it was fetched"""
+        record = self.get(entry['name'])
+        if (record and record['size'] == entry['size'] and record['mtime'] == entry['mtime']
+                and record.get('path') and os.path.isfile(record['path'])
+                and os.path.getsize(record['path']) == entry['size']):
+            return record['path']
+        return None
+
+    def unchanged_blob(self, entry, blobs):
+        """Return the stored chunks of a remote file if it has not changed since it was fetched"""
+        record = self.get(entry['name'])
+        if (record and record['size'] == entry['size'] and record['mtime'] == entry['mtime']
+                and record.get('chunks') is not None and blobs.has(record['chunks'])):
+            return {'chunks': record['chunks'], 'size': record['stored_size']}
+        return None
+
+    def changed(self, entries):
+        """Return the remote files that are new or differ from what was last fetched"""
+        changed = []
+        for entry in entries:
+            record = self.get(entry['name'])
+            if not record or record['size'] != entry['size'] or record['mtime'] != entry['mtime']:
+                changed.append(entry)
+        return changed
+
+    def record(self, entry, local_path, stored=None):
+        """Remember the newest local copy of a remote file, or its chunks in the blob store"""
+        self.changes[entry['name']] = {
+            'size': entry['size'],
+            'mtime': entry['mtime'],
+            'path': local_path,
+        }
+        if stored:
+            self.changes[entry['name']].update(chunks=stored['chunks'], stored_size=stored['size'])
+
+    def record_partial(self, entry, partial_path):
+        """Remember an interrupted download so the next run can resume it"""
+        record = dict(self.get(entry['name']) or {'size': None, 'mtime': None, 'path': None})
+        record['partial'] = partial_path
+        self.changes[entry['name']] = record
+
+    def save(self):
+        """Merge this run's changes into the manifest on disk"""
+        if not self.changes:
+            return
+        # Concurrent runs (hourly recent + 3-hourly full) may update the same manifest
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self._read()
+            entries.update(self.changes)
+            write_json_atomic(self.path, {'files': entries})
+        self.entries = entries
+        self.changes = {}
+
+
+def link_or_copy(source, dest):
+    """Hard-link an unchanged file into a run directory, copying if linking is not possible"""
+    if os.path.exists(dest):
+        os.unlink(dest)
+    try:
+        os.link(source, dest)
+        return True
+    except OSError:
+        shutil.copy2(source, dest)
+        return False
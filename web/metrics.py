@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics and per-stage timings for the Harmonic Log Fetcher.
+Counters, gauges and histograms are kept in memory and rendered in the
+Prometheus text format by the web interface's /metrics endpoint. A fetch
+run records how long each stage took (listing, downloads, timestamp
+restore, archiving, indexing, rotation) for each server.
+
+Only the standard library is used, so the command-line fetcher keeps
+working without extra packages; runs started from cron can write their
+metrics to a file for node_exporter's textfile collector (METRICS_FILE).
+"""
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# Bytes per second, from a slow WAN link up to a local gigabit network
+RATE_BUCKETS = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 128e6)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, **labels):
+        return _Child(self, tuple(str(labels[n]) for n in self.labelnames))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class _Child:
+    """A metric with its label values filled in"""
+
+    def __init__(self, metric, key):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount=1):
+        self._metric._inc(self._key, amount)
+
+    def set(self, value):
+        self._metric._set(self._key, value)
+
+    def observe(self, value):
+        self._metric._observe(self._key, value)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(buckets) + (float('inf'),)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _observe(self, key, value):
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _samples(self, key, value):
+        counts, total = value
+        samples = []
+        for bound, count in zip(self.buckets, counts):
+            labels = _format_labels(self.labelnames + ('le',), key + (_format_value(bound),))
+            samples.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key)
+        samples.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        samples.append(f"{self.name}_count{labels} {counts[-1]}")
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+RUNS = Counter('harmonic_fetch_runs_total', "Collections run, by mode and result",
+               ('mode', 'result'))
+RUN_SECONDS = Histogram('harmonic_fetch_run_duration_seconds', "Duration of whole collections",
+                        ('mode',))
+RUN_FILES = Histogram('harmonic_fetch_run_files', "Files downloaded or linked per collection",
+                      ('mode',), buckets=COUNT_BUCKETS)
+LAST_SUCCESS = Gauge('harmonic_fetch_last_success_timestamp_seconds',
+                     "Time the last successful collection finished", ('mode',))
+STAGE_SECONDS = Histogram('harmonic_fetch_stage_duration_seconds',
+                          "Duration of each collection stage, per server", ('stage', 'server'))
+FILES = Counter('harmonic_fetch_files_total',
+                "Files handled per server (downloaded, resumed, linked or failed)",
+                ('server', 'result'))
+BYTES = Counter('harmonic_fetch_bytes_total', "Bytes downloaded per server", ('server',))
+FILE_SECONDS = Histogram('harmonic_fetch_file_duration_seconds',
+                         "Time to download one file", ('server',))
+TRANSFER_RATE = Histogram('harmonic_fetch_transfer_bytes_per_second',
+                          "Transfer speed of each downloaded file", ('server',),
+                          buckets=RATE_BUCKETS)
+POLL_CHANGES = Counter('harmonic_poll_changed_files_total',
+                       "New or changed remote files found by the collector's poller", ('server',))
+CONCURRENCY = Gauge('harmonic_fetch_concurrency',
+                    "Transfers allowed at once per server, adapted to its response", ('server',))
+RATE_LIMIT = Gauge('harmonic_fetch_rate_limit_bytes_per_second',
+                   "Bandwidth cap per server in the current profile (0 = none)", ('server',))
+THROTTLE_SECONDS = Counter('harmonic_fetch_throttled_seconds_total',
+                           "Time transfers waited for the server's bandwidth cap", ('server',))
+FTP_CONNECTS = Counter('harmonic_ftp_connects_total', "FTP logins per server", ('server',))
+FTP_RECONNECTS = Counter('harmonic_ftp_reconnects_total',
+                         "FTP connections found dead or broken and replaced", ('server',))
+
+
+class RunTimings:
+    """Timings of the stages of one collection, also recorded as metrics"""
+
+    def __init__(self):
+        self.stages = {}  # (stage, server) -> {'seconds', 'count'}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, server=''):
+        STAGE_SECONDS.labels(stage=stage, server=server).observe(seconds)
+        with self._lock:
+            entry = self.stages.setdefault((stage, server), {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += seconds
+            entry['count'] += 1
+
+    @contextmanager
+    def stage(self, stage, server=''):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, server)
+
+    def download(self, server, nbytes, seconds, resumed=False):
+        """Record one downloaded file"""
+        self.add('download', seconds, server)
+        FILES.labels(server=server, result='resumed' if resumed else 'downloaded').inc()
+        BYTES.labels(server=server).inc(nbytes)
+        FILE_SECONDS.labels(server=server).observe(seconds)
+        if seconds > 0:
+            TRANSFER_RATE.labels(server=server).observe(nbytes / seconds)
+
+    def as_list(self):
+        """[{'stage', 'server', 'seconds', 'count'}] in the order the stages first ran"""
+        with self._lock:
+            return [{'stage': stage, 'server': server, 'seconds': round(entry['seconds'], 3),
+                     'count': entry['count']}
+                    for (stage, server), entry in self.stages.items()]
+
+
+def write_textfile(path):
+    """Write the metrics for node_exporter's textfile collector"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(REGISTRY.render())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
@@ -2,12 +2,19 @@
 """
 Migration script to update existing users to the new format with roles.
 This script will convert old format (username=hash) to new format (username:role=hash)
+and protect old unsalted SHA-256 password hashes with salted PBKDF2.
 """
 import os
-import sys
 
-# Configuration
-WEB_USERS_CONFIG = "/home/kburki/KTOO/Harmonic/web_users.cfg"
+from config import WEB_USERS_CONFIG
+from userstore import LEGACY_HASH_PATTERN, wrap_legacy_hash
+
+def upgrade_hash(hash_value):
+    """Wrap an unsalted SHA-256 hash in PBKDF2; returns (hash, upgraded)"""
+    hash_value = hash_value.strip()
+    if not LEGACY_HASH_PATTERN.match(hash_value):
+        return hash_value, False
+    return wrap_legacy_hash(hash_value), True
 
 def main():
     # Check if the file exists
@@ -36,6 +43,7 @@ def main():
     # Process and update users
     new_lines = []
     users_migrated = 0
+    hashes_upgraded = 0
     
     for line in lines:
         line = line.strip()
@@ -46,12 +54,20 @@ def main():
         
         # Check if already in new format
         if ':' in line.split('=')[0]:
-            new_lines.append(line + '\n')
+            user_info, hash_value = line.split('=', 1)
+            hash_value, upgraded = upgrade_hash(hash_value)
+            if upgraded:
+                print(f"Upgraded password hash for '{user_info.split(':')[0]}'")
+                hashes_upgraded += 1
+            new_lines.append(f"{user_info}={hash_value}\n")
             continue
         
         # Convert to new format - make first user admin, others regular
         try:
             username, hash_value = line.split('=', 1)
+            hash_value, upgraded = upgrade_hash(hash_value)
+            if upgraded:
+                hashes_upgraded += 1
             if users_migrated == 0:
                 # First user becomes admin
                 new_line = f"{username.strip()}:admin={hash_value.strip()}\n"
@@ -94,6 +110,7 @@ def main():
         with open(WEB_USERS_CONFIG, 'w') as f:
             f.writelines(new_lines)
         print(f"Successfully migrated {users_migrated} users to the new format")
+        print(f"Upgraded {hashes_upgraded} password hashes to salted PBKDF2")
         return True
     except Exception as e:
         print(f"Error writing file: {e}")
@@ -110,7 +127,8 @@ def main():
 if __name__ == "__main__":
     print("User Migration Script")
     print("=====================")
-    print("This script will update your existing users to use the new role-based format.")
+    print("This script will update your existing users to use the new role-based format")
+    print("and upgrade old password hashes to salted PBKDF2.")
     print("A backup of your current users file will be created before making changes.")
     
     proceed = input("Do you want to proceed? (y/n): ")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Persistent FTP connection pool for the Harmonic Log Fetcher.
+Keeps authenticated control connections open to a server so collections
+don't pay the connect and login cost every cycle. Idle connections are
+kept alive with NOOP and replaced transparently when they die.
+"""
+import ftplib
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+FTP_TIMEOUT = 60
+# Idle connections older than this are checked with NOOP before being handed out
+VALIDATE_AFTER = 30
+
+
+def connect_ftp(server):
+    """Open an authenticated FTP connection in the server's log directory"""
+    ftp = ftplib.FTP(timeout=FTP_TIMEOUT)
+    try:
+        ftp.connect(server['ip'], server['port'])
+        ftp.login(server['user'], server['password'])
+        ftp.cwd(server['path'])
+    except Exception:
+        close_quietly(ftp)
+        raise
+    return ftp
+
+
+def close_quietly(ftp):
+    """Close an FTP connection, ignoring errors from dead sockets"""
+    try:
+        ftp.quit()
+    except Exception:
+        try:
+            ftp.close()
+        except Exception:
+            pass
+
+
+class FTPConnectionPool:
+    """Bounded pool of authenticated FTP connections to one server"""
+
+    def __init__(self, server, size=None, log=print):
+        self.server = server
+        self.size = size or server['connections']
+        self.log = log
+        self.connects = 0
+        self.reconnects = 0
+        self._idle = []  # (ftp, last used)
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        ftp = connect_ftp(self.server)
+        metrics.FTP_CONNECTS.labels(server=self.server['name']).inc()
+        with self._cond:
+            self.connects += 1
+        return ftp
+
+    def acquire(self):
+        """Get a connection, waiting if all of them are in use"""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError(f"Connection pool for {self.server['label']} is closed")
+                if self._idle:
+                    ftp, last_used = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    self._open += 1
+                    ftp, last_used = None, None
+                    break
+                self._cond.wait()
+
+        if ftp is not None and time.time() - last_used > VALIDATE_AFTER:
+            try:
+                ftp.voidcmd('NOOP')
+            except ftplib.all_errors:
+                close_quietly(ftp)
+                ftp = None
+                with self._cond:
+                    self.reconnects += 1
+                    metrics.FTP_RECONNECTS.labels(server=self.server['name']).inc()
+        if ftp is None:
+            try:
+                ftp = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        return ftp
+
+    def release(self, ftp, broken=False):
+        """Return a connection; broken ones are closed and replaced on demand"""
+        with self._cond:
+            keep = not broken and not self._closed
+            if keep:
+                self._idle.append((ftp, time.time()))
+            else:
+                self._open -= 1
+                if broken:
+                    self.reconnects += 1
+                    metrics.FTP_RECONNECTS.labels(server=self.server['name']).inc()
+            self._cond.notify()
+        if not keep:
+            close_quietly(ftp)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it is discarded if the block raises"""
+        ftp = self.acquire()
+        try:
+            yield ftp
+        except BaseException:
+            # The control connection may be out of sync after an error
+            self.release(ftp, broken=True)
+            raise
+        else:
+            self.release(ftp)
+
+    def keepalive(self):
+        """Send NOOP on idle connections and reopen any that have died"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        alive = []
+        for ftp, last_used in idle:
+            try:
+                ftp.voidcmd('NOOP')
+                alive.append((ftp, time.time()))
+            except ftplib.all_errors:
+                close_quietly(ftp)
+                try:
+                    alive.append((self._connect(), time.time()))
+                    self.log(f"Reconnected to {self.server['label']}")
+                except ftplib.all_errors as e:
+                    self.log(f"Reconnect to {self.server['label']} failed: {e}")
+                    with self._cond:
+                        self._open -= 1
+                with self._cond:
+                    self.reconnects += 1
+                    metrics.FTP_RECONNECTS.labels(server=self.server['name']).inc()
+        with self._cond:
+            if self._closed:
+                to_close, alive = alive, []
+                self._open -= len(to_close)
+            else:
+                self._idle.extend(alive)
+                to_close = []
+            self._cond.notify_all()
+        for ftp, _ in to_close:
+            close_quietly(ftp)
+
+    def warm_up(self, count=1):
+        """Open connections ahead of the first collection"""
+        connections = [self.acquire() for _ in range(min(count, self.size))]
+        for ftp in connections:
+            self.release(ftp)
+
+    def close(self):
+        """Close all idle connections; busy ones are closed when released"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for ftp, _ in idle:
+            close_quietly(ftp)
+
+
+def create_pools(servers, log=print):
+    """Create one connection pool per server, keyed by server name"""
+    return {server['name']: FTPConnectionPool(server, log=log) for server in servers}
+
+
+def close_pools(pools):
+    for pool in pools.values():
+        pool.close()
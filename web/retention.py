@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Log rotation for the Harmonic Log Fetcher.
+Removes run directories and archives that are older than the configured
+retention periods: RETENTION_DAYS for regular and test logs and
+RECENT_RETENTION_HOURS for recent logs. With RETENTION_MAX_GB set, the
+oldest items are also removed until the rest fit in that many GB. A server
+with a shorter PREFIX_RETENTION_DAYS has its files removed from the run
+directories that are kept; archives always hold every server's files.
+
+Items are classified by the mode and timestamp in their name, found with a
+single scan of BASE_DIR, and sized from the archive catalog, so rotation
+takes the same time however large the stored logs are. Only the quota needs
+to look at every run's files: a file hard-linked into several runs, or a
+blob store chunk they share, is counted once, in the newest run holding it.
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+import runs
+from archive import INDEX_SUFFIX
+from blobstore import BlobStore, chunk_path
+from catalog import Catalog
+from config import DEFAULT_CONFIG_FILE, config_bool, config_float, get_servers, load_config
+from events import EventStore
+from search import SearchIndex
+
+# Display name for each (mode, kind); recent logs are kept for hours, the rest for days
+CATEGORIES = [
+    (('full', 'run'), 'regular directories'),
+    (('full', 'archive'), 'regular archives'),
+    (('test', 'run'), 'test directories'),
+    (('test', 'archive'), 'test archives'),
+    (('recent', 'run'), 'recent directories'),
+    (('recent', 'archive'), 'recent archives'),
+]
+
+
+def find_items(base_dir, shared=False):
+    """Return the run directories and archives under BASE_DIR, oldest first.
+
+    With shared, each run's size is what deleting it frees once the runs
+    before it are gone: its blob store chunks and hard-linked files are counted
+    in the newest run that holds them.
+    """
+    try:
+        run_sizes = {run['name']: run['size'] for run in Catalog(base_dir).list_runs()}
+    except Exception:
+        run_sizes = {}
+    items = []
+    with os.scandir(base_dir) as it:
+        for item in it:
+            parsed = runs.parse_run_name(item.name)
+            if parsed and item.is_dir():
+                kind = 'run'
+                manifest_path = os.path.join(item.path, runs.RUN_MANIFEST)
+                if os.path.exists(manifest_path):
+                    # The files themselves are in the blob store, shared with other runs
+                    size = os.path.getsize(manifest_path)
+                elif item.name in run_sizes:
+                    size = run_sizes[item.name]
+                else:
+                    size = sum(f['size'] for f in runs.iter_run_files(item.path))
+            else:
+                parsed = runs.parse_archive_name(item.name)
+                if not parsed or not item.is_file():
+                    continue
+                kind = 'archive'
+                size = item.stat().st_size
+            mode, timestamp = parsed
+            items.append({'name': item.name, 'path': item.path, 'kind': kind, 'mode': mode,
+                          'timestamp': timestamp.timestamp(), 'size': size})
+    items.sort(key=lambda i: (i['timestamp'], i['name']))
+    if shared:
+        seen = set()
+        for item in reversed(items):
+            if item['kind'] == 'run':
+                item['size'] = _unshared_size(item['path'], seen)
+    return items
+
+
+def _unshared_size(run_path, seen):
+    """Bytes of a run's files and chunks not in seen (which they are added to)"""
+    manifest_path = os.path.join(run_path, runs.RUN_MANIFEST)
+    size = os.path.getsize(manifest_path) if os.path.exists(manifest_path) else 0
+    for f in runs.iter_run_files(run_path):
+        if 'chunks' in f:
+            paths = [chunk_path(f['blobs'], digest) for digest in f['chunks']]
+        else:
+            paths = [f['path']]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            key = (stat.st_dev, stat.st_ino)
+            if key not in seen:
+                seen.add(key)
+                size += stat.st_size
+    return size
+
+
+def plan_rotation(items, retention_days, recent_retention_hours, max_bytes=0, now=None,
+                  current=None):
+    """Decide which items to delete; returns {category: [items]}.
+
+    Each deleted item gets a 'reason' ('age' or 'quota'). Age is counted from
+    the hour in the item's name, with the same rounding as find -mtime +N and
+    -mmin +N. Over the quota the oldest remaining items go first, but the
+    newest run and the current one (a run name) are never deleted for it, even
+    if the quota can't be met without them.
+    """
+    now = now or time.time()
+    names = dict(CATEGORIES)
+    expired = {description: [] for _, description in CATEGORIES}
+    kept = []
+    for item in items:
+        age = now - item['timestamp']
+        if item['mode'] == 'recent':
+            too_old = recent_retention_hours > 0 and int(age // 60) > recent_retention_hours * 60
+        else:
+            too_old = int(age // 86400) > retention_days
+        if too_old:
+            expired[names[(item['mode'], item['kind'])]].append(dict(item, reason='age'))
+        else:
+            kept.append(item)
+    if max_bytes:
+        # A run directory and its archive share the mode and timestamp
+        newest = max((item['timestamp'] for item in kept), default=None)
+        protected = {(item['mode'], item['timestamp']) for item in kept
+                     if item['timestamp'] == newest}
+        parsed = runs.parse_run_name(current) if current else None
+        if parsed:
+            protected.add((parsed[0], parsed[1].timestamp()))
+        total = sum(item['size'] for item in kept)
+        for item in kept:
+            if total <= max_bytes:
+                break
+            if (item['mode'], item['timestamp']) in protected:
+                continue
+            expired[names[(item['mode'], item['kind'])]].append(dict(item, reason='quota'))
+            total -= item['size']
+    return expired
+
+
+def plan_server_rotation(items, servers, now=None):
+    """Find server files in kept run directories past that server's retention.
+
+    Returns [(item, server)]; recent runs are left to RECENT_RETENTION_HOURS.
+    """
+    now = now or time.time()
+    expired = []
+    for item in items:
+        if item['kind'] != 'run' or item['mode'] == 'recent':
+            continue
+        age_days = int((now - item['timestamp']) // 86400)
+        for server in servers:
+            if (age_days > server['retention_days']
+                    and next(runs.iter_run_files(item['path'], [server['name']]), None)):
+                expired.append((item, server))
+    return expired
+
+
+def delete_server_files(run_path, server_name):
+    """Remove one server's files from a run directory"""
+    files = runs.read_run_manifest(run_path)
+    if files is not None:
+        runs.write_run_manifest(run_path, [f for f in files if f['server'] != server_name])
+    server_dir = os.path.join(run_path, server_name)
+    if os.path.isdir(server_dir):
+        shutil.rmtree(server_dir)
+
+
+def delete_items(paths, log=print):
+    """Delete run directories and archives; returns the paths that were deleted"""
+    deleted = []
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+                if os.path.exists(path + INDEX_SUFFIX):
+                    os.remove(path + INDEX_SUFFIX)
+            deleted.append(path)
+        except OSError as e:
+            log(f"Error deleting {path}: {e}")
+    return deleted
+
+
+def rotate_logs(config, log=print, dry_run=False, current=None):
+    """Delete expired run directories and archives under BASE_DIR.
+
+    current is the name of the run just collected, which the quota never removes.
+    """
+    base_dir = config['BASE_DIR']
+    try:
+        retention_days = int(config.get('RETENTION_DAYS', 5))
+        recent_retention_hours = int(config.get('RECENT_RETENTION_HOURS') or 0)
+    except ValueError as e:
+        log(f"Error: invalid retention setting: {e}")
+        return False
+    max_bytes = int(config_float(config, 'RETENTION_MAX_GB') * 1024 ** 3)
+    # Servers whose files are kept for less time than the run directories
+    servers = [server for server in get_servers(config)
+               if 0 < server['retention_days'] < retention_days]
+
+    log("Performing log rotation..." + (" (dry run, nothing is deleted)" if dry_run else ""))
+    log(f"Cleaning up regular and test logs older than {retention_days} days...")
+    if recent_retention_hours > 0:
+        log(f"Cleaning up recent logs older than {recent_retention_hours} hours...")
+    if max_bytes:
+        log(f"Keeping run directories and archives under {max_bytes / 1024 ** 3:.1f} GB...")
+    for server in servers:
+        log(f"Cleaning up {server['label']} files older than {server['retention_days']} days...")
+
+    items = find_items(base_dir, shared=bool(max_bytes))
+    expired = plan_rotation(items, retention_days, recent_retention_hours, max_bytes,
+                            current=current)
+    paths = []
+    for description, selected in expired.items():
+        if not selected:
+            continue
+        size = sum(item['size'] for item in selected)
+        log(f"{'Would delete' if dry_run else 'Deleting'} {len(selected)} old {description} "
+            f"({size / (1024 * 1024):.1f} MB):")
+        for item in selected:
+            writable = os.access(os.path.dirname(item['path']), os.W_OK)
+            log(f"  {item['path']} ({item['reason']}"
+                + ("" if writable else ", no permission to delete") + ")")
+        paths.extend(item['path'] for item in selected)
+    kept_size = sum(item['size'] for item in items) - sum(
+        item['size'] for selected in expired.values() for item in selected)
+    log(f"{len(items) - len(paths)} of {len(items)} items kept ({kept_size / (1024 * 1024):.1f} MB)")
+    if max_bytes and kept_size > max_bytes:
+        log(f"Warning: the newest run takes more than RETENTION_MAX_GB "
+            f"({max_bytes / 1024 ** 3:.1f} GB) on its own; it is kept anyway")
+    expired_paths = set(paths)
+    kept = [item for item in items if item['path'] not in expired_paths]
+    server_expired = plan_server_rotation(kept, servers)
+    for item, server in server_expired:
+        log(f"{'Would delete' if dry_run else 'Deleting'} {server['label']} files from "
+            f"{item['path']} (server retention)")
+    if dry_run:
+        return True
+
+    deleted = delete_items(paths, log=log)
+    success = len(deleted) == len(paths)
+    trimmed = []
+    for item, server in server_expired:
+        try:
+            delete_server_files(item['path'], server['name'])
+            trimmed.append(item['path'])
+        except OSError as e:
+            log(f"Error deleting {server['label']} files from {item['path']}: {e}")
+            success = False
+
+    if deleted or trimmed:
+        try:
+            catalog = Catalog(base_dir)
+            catalog.remove(deleted)
+            for path in set(trimmed):
+                catalog.record_run(path)
+        except Exception as e:
+            log(f"Error updating archive catalog: {e}")
+        try:
+            removed = SearchIndex(base_dir).prune()
+            log(f"Removed {removed} expired files from the search index")
+        except Exception as e:
+            log(f"Error updating search index: {e}")
+        try:
+            store = EventStore(base_dir)
+            removed = store.prune(retention_days)
+            for server in servers:
+                removed += store.prune(server['retention_days'], servers=[server['name']])
+            if removed:
+                log(f"Removed {removed} expired partitions from the event store")
+        except Exception as e:
+            log(f"Error updating event store: {e}")
+        if config_bool(config, 'BLOB_STORE'):
+            try:
+                result = BlobStore(base_dir).collect_garbage(lambda: runs.referenced_chunks(base_dir))
+                if result is None:
+                    log("A collection is writing to the blob store, skipping its cleanup")
+                elif result[0]:
+                    log(f"Removed {result[0]} unused chunks from the blob store "
+                        f"({result[1] / (1024 * 1024):.1f} MB)")
+            except Exception as e:
+                log(f"Error cleaning up blob store: {e}")
+
+    log("Log rotation completed")
+    return success
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove Harmonic logs past their retention period")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="Only report what would be deleted")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+    return 0 if rotate_logs(config, dry_run=args.dry_run) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Helpers for the run directories and archives stored under BASE_DIR.
+Run directories are named YYYY_MM_DD_HH (full), recent_YYYY_MM_DD_HH or
+test_YYYY_MM_DD_HH, with one sub-directory per server. Runs stored in the
+blob store (BLOB_STORE=true) keep a files.json manifest instead, so files
+should be read through iter_run_files and open_run_file.
+Run on its own it lists the files of one run directory, however they are stored.
+"""
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import re
+import sys
+import time
+
+from blobstore import ChunkReader
+from manifest import STATE_DIR_NAME, write_json_atomic
+
+RUN_PATTERN = re.compile(r'^(?:(recent|test)_)?(\d{4}_\d{2}_\d{2}_\d{2})$')
+ARCHIVE_PATTERN = re.compile(
+    r'^harmonic_(?:(recent|test)_)?logs_(\d{4}_\d{2}_\d{2}_\d{2})\.(tar\.gz|tar\.zst)$')
+TIMESTAMP_FORMAT = '%Y_%m_%d_%H'
+
+# Files that are still being written by the fetcher
+PARTIAL_SUFFIX = '.part'
+# Lists the files of a run kept in the blob store
+RUN_MANIFEST = 'files.json'
+
+
+def parse_name(pattern, name):
+    """Return (mode, datetime) for a run or archive name, or None if it doesn't match"""
+    match = pattern.match(name)
+    if not match:
+        return None
+    try:
+        timestamp = datetime.datetime.strptime(match.group(2), TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+    return (match.group(1) or 'full', timestamp)
+
+
+def parse_run_name(name):
+    return parse_name(RUN_PATTERN, name)
+
+
+def parse_archive_name(name):
+    return parse_name(ARCHIVE_PATTERN, name)
+
+
+def archive_run_name(name):
+    """The run directory name an archive was built from, or None"""
+    parsed = parse_archive_name(name)
+    if not parsed:
+        return None
+    mode, timestamp = parsed
+    prefix = '' if mode == 'full' else f"{mode}_"
+    return prefix + timestamp.strftime(TIMESTAMP_FORMAT)
+
+
+def list_runs(base_dir):
+    """List run directories, newest first"""
+    runs = []
+    with os.scandir(base_dir) as it:
+        for item in it:
+            parsed = parse_run_name(item.name)
+            if parsed and item.is_dir():
+                runs.append({'name': item.name, 'path': item.path,
+                             'mode': parsed[0], 'timestamp': parsed[1]})
+    runs.sort(key=lambda r: r['timestamp'], reverse=True)
+    return runs
+
+
+def read_run_manifest(run_path):
+    """The files of a run kept in the blob store, or None for a plain run directory"""
+    try:
+        with open(os.path.join(run_path, RUN_MANIFEST), 'r') as f:
+            return json.load(f)['files']
+    except FileNotFoundError:
+        return None
+
+
+def write_run_manifest(run_path, files):
+    write_json_atomic(os.path.join(run_path, RUN_MANIFEST),
+                      {'files': sorted(files, key=lambda f: (f['server'], f['name']))})
+
+
+def referenced_chunks(base_dir):
+    """The blob store chunks used by any run directory"""
+    chunks = set()
+    for run in list_runs(base_dir):
+        for f in read_run_manifest(run['path']) or []:
+            chunks.update(f['chunks'])
+    return chunks
+
+
+def iter_run_files(run_path, servers=None):
+    """Yield the stored log files of one run directory"""
+    stored = read_run_manifest(run_path)
+    if stored is not None:
+        blobs = os.path.join(os.path.dirname(os.path.abspath(run_path)), STATE_DIR_NAME, 'blobs')
+        for f in stored:
+            if not servers or f['server'] in servers:
+                yield dict(f, path=os.path.join(run_path, f['server'], f['name']), blobs=blobs)
+        return
+    with os.scandir(run_path) as servers_it:
+        for server_dir in servers_it:
+            if not server_dir.is_dir() or (servers and server_dir.name not in servers):
+                continue
+            with os.scandir(server_dir.path) as files_it:
+                for item in files_it:
+                    if not item.is_file() or item.name.endswith(PARTIAL_SUFFIX):
+                        continue
+                    stat = item.stat()
+                    yield {'server': server_dir.name, 'name': item.name, 'path': item.path,
+                           'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def open_run_file(f):
+    """Open a file from iter_run_files for binary reading, wherever it is stored"""
+    if 'chunks' in f:
+        return ChunkReader(f['blobs'], f['chunks'], f['size'])
+    return open(f['path'], 'rb')
+
+
+def select_files(base_dir, servers=None, start=None, pattern=None):
+    """Find stored log files by server, modification time and name pattern.
+
+    The same remote file is usually stored in many runs; only the newest copy
+    of each (server, name) is returned. start is epoch seconds; a file's
+    modification time is its last line, so files modified before start are
+    left out.
+    """
+    newest = {}
+    for run in list_runs(base_dir):
+        # A run can't hold files modified after the hour it was taken in
+        if start is not None and run['timestamp'].timestamp() + 3600 < start:
+            continue
+        for f in iter_run_files(run['path'], servers):
+            if pattern and not fnmatch.fnmatch(f['name'], pattern):
+                continue
+            if start is not None and f['mtime'] < start:
+                continue
+            key = (f['server'], f['name'])
+            current = newest.get(key)
+            if current is None or (f['mtime'], f['size']) > (current['mtime'], current['size']):
+                newest[key] = f
+    return sorted(newest.values(), key=lambda f: (f['server'], f['mtime']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the log files stored in a run directory")
+    parser.add_argument('run_dir', help="Run directory, e.g. BASE_DIR/recent_2025_06_01_14")
+    parser.add_argument('-s', '--server', action='append',
+                        help="Only list this server's files (repeatable)")
+    args = parser.parse_args()
+
+    try:
+        files = sorted(iter_run_files(args.run_dir, args.server),
+                       key=lambda f: (f['server'], f['name']))
+    except OSError as e:
+        print(f"Error reading {args.run_dir}: {e}")
+        return 1
+    for f in files:
+        modified = time.strftime('%Y-%m-%d %H:%M', time.localtime(f['mtime']))
+        print(f"{f['size']:>12} {modified} {f['server']}/{f['name']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Full-text search index over the collected Harmonic logs.
+Every line of the stored log files is indexed in a SQLite FTS5 table
+(BASE_DIR/.state/search.db) after each collection, so the web interface can
+find matching lines across the whole retention window without unpacking
+archives. Growing logs are indexed incrementally from where the last run
+stopped; compressed .gz logs are read as streams.
+"""
+import argparse
+import datetime
+import gzip
+import os
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+
+import runs
+from config import DEFAULT_CONFIG_FILE, config_bool, load_config
+from manifest import state_dir
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    server TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    offset INTEGER NOT NULL,
+    line_count INTEGER NOT NULL,
+    head_crc INTEGER NOT NULL,
+    last_timestamp REAL,
+    UNIQUE (server, name)
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    timestamp REAL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_file ON lines (file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(content, content='lines', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS lines_delete AFTER DELETE ON lines BEGIN
+    INSERT INTO lines_fts (lines_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+"""
+
+# Leading bytes that identify a file; if they change the file was replaced
+HEAD_SIZE = 4096
+READ_SIZE = 1024 * 1024
+INSERT_BATCH = 5000
+MAX_LINE_LENGTH = 4096
+DEFAULT_LIMIT = 200
+
+# Timestamps found at the start of Harmonic log lines
+TIMESTAMP_PATTERNS = [
+    (re.compile(r'(\d{4})[-/](\d{2})[-/](\d{2})[ T](\d{2}):(\d{2}):(\d{2})'), (0, 1, 2)),
+    (re.compile(r'(\d{2})/(\d{2})/(\d{4}) (\d{2}):(\d{2}):(\d{2})'), (2, 0, 1)),
+]
+
+
+def match_line_timestamp(line):
+    """(epoch seconds, end of the timestamp) for the start of a log line, or (None, 0)"""
+    head = line[:64]
+    for pattern, (year, month, day) in TIMESTAMP_PATTERNS:
+        match = pattern.search(head)
+        if not match:
+            continue
+        parts = match.groups()
+        try:
+            return (datetime.datetime(int(parts[year]), int(parts[month]), int(parts[day]),
+                                      int(parts[3]), int(parts[4]), int(parts[5])).timestamp(),
+                    match.end())
+        except ValueError:
+            return None, 0
+    return None, 0
+
+
+def parse_line_timestamp(line):
+    """Epoch seconds for the timestamp near the start of a log line, or None"""
+    return match_line_timestamp(line)[0]
+
+
+def build_query(text):
+    """Turn search box text into an FTS5 query.
+
+    Words are matched in any order, "quoted phrases" exactly, and a trailing *
+    matches a prefix. FTS5 operators are not passed through.
+    """
+    terms = []
+    for token in re.findall(r'"[^"]*"|\S+', text):
+        prefix = token.endswith('*') and not token.startswith('"')
+        token = token.strip('"').rstrip('*')
+        if not token:
+            continue
+        term = '"' + token.replace('"', '""') + '"'
+        terms.append(term + '*' if prefix else term)
+    return ' '.join(terms)
+
+
+def head_crc(f, length):
+    """CRC of the first length bytes of a stored file"""
+    with runs.open_run_file(f) as source:
+        return zlib.crc32(source.read(length))
+
+
+class SearchIndex:
+    """Incrementally updated full-text index of stored log lines"""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.path = os.path.join(state_dir(base_dir), 'search.db')
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=60)
+        try:
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA cache_size=-65536")
+            yield db
+            db.commit()
+        finally:
+            db.close()
+
+    def index_run(self, run_path, log=print):
+        """Index new lines from the files of one run directory; returns lines added"""
+        added = 0
+        with self._connect() as db:
+            for f in runs.iter_run_files(run_path):
+                try:
+                    added += self._index_file(db, f)
+                except (OSError, EOFError, zlib.error) as e:
+                    log(f"Error indexing {f['path']}: {e}")
+                # Commit per file so searches see progress and a failure loses little
+                db.commit()
+        return added
+
+    def _index_file(self, db, f):
+        # Take the write lock before reading anything: the recent and full runs
+        # can index at the same time, and must not both append the same lines
+        # or number their full-text rows from the same MAX(id)
+        if not db.in_transaction:
+            db.execute("BEGIN IMMEDIATE")
+        state = db.execute("SELECT * FROM files WHERE server = ? AND name = ?",
+                           (f['server'], f['name'])).fetchone()
+        # Many runs hold a copy of the same file; an older one than was indexed adds nothing
+        if state and (f['mtime'], f['size']) <= (state['mtime'], state['size']):
+            return 0
+
+        compressed = f['name'].endswith('.gz')
+        # Plain logs only grow; anything else that changed is indexed again from the start
+        append = (state is not None and not compressed and f['size'] >= state['offset']
+                  and state['head_crc'] == head_crc(f, min(HEAD_SIZE, state['offset'])))
+        if state:
+            file_id = state['id']
+            if not append:
+                db.execute("DELETE FROM lines WHERE file_id = ?", (file_id,))
+        else:
+            file_id = db.execute(
+                "INSERT INTO files (server, name, size, mtime, offset, line_count, head_crc) "
+                "VALUES (?, ?, 0, 0, 0, 0, 0)", (f['server'], f['name'])).lastrowid
+
+        offset = state['offset'] if append else 0
+        line_no = state['line_count'] if append else 0
+        timestamp = (state['last_timestamp'] if append else None) or f['mtime']
+        batch = []
+        added = 0
+
+        def add_line(raw):
+            nonlocal timestamp
+            line = raw.decode('utf-8', 'replace').rstrip('\r')[:MAX_LINE_LENGTH]
+            if line.strip():
+                timestamp = parse_line_timestamp(line) or timestamp
+                batch.append((file_id, line_no, timestamp, line))
+
+        raw = runs.open_run_file(f)
+        if compressed:
+            source = gzip.GzipFile(fileobj=raw)
+        else:
+            source = raw
+            source.seek(offset)
+        with raw, source:
+            remainder = b''
+            while True:
+                data = source.read(READ_SIZE)
+                if not data:
+                    break
+                data = remainder + data
+                end = data.rfind(b'\n')
+                if end < 0:
+                    remainder = data
+                    continue
+                remainder = data[end + 1:]
+                # Only complete lines are indexed; the rest is picked up next run
+                offset += end + 1
+                for raw in data[:end].split(b'\n'):
+                    line_no += 1
+                    add_line(raw)
+                if len(batch) >= INSERT_BATCH:
+                    self._insert(db, batch)
+                    added += len(batch)
+                    batch = []
+            # A compressed log is complete, so its last line is indexed too
+            if compressed and remainder:
+                line_no += 1
+                add_line(remainder)
+        if batch:
+            self._insert(db, batch)
+            added += len(batch)
+
+        db.execute("UPDATE files SET size = ?, mtime = ?, offset = ?, line_count = ?, "
+                   "head_crc = ?, last_timestamp = ? WHERE id = ?",
+                   (f['size'], f['mtime'], offset, line_no,
+                    head_crc(f, min(HEAD_SIZE, offset)), timestamp, file_id))
+        return added
+
+    def _insert(self, db, batch):
+        last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM lines").fetchone()[0]
+        db.executemany("INSERT INTO lines (file_id, line_no, timestamp, content) "
+                       "VALUES (?, ?, ?, ?)", batch)
+        # Adding the batch to the full-text index in one statement is several
+        # times faster than a per-row trigger
+        db.execute("INSERT INTO lines_fts (rowid, content) "
+                   "SELECT id, content FROM lines WHERE id > ?", (last_id,))
+
+    def prune(self):
+        """Drop files that are no longer stored in any run directory"""
+        stored = set()
+        for run in runs.list_runs(self.base_dir):
+            stored.update((f['server'], f['name']) for f in runs.iter_run_files(run['path']))
+        with self._connect() as db:
+            expired = [(row['id'],) for row in db.execute("SELECT id, server, name FROM files")
+                       if (row['server'], row['name']) not in stored]
+            db.executemany("DELETE FROM lines WHERE file_id = ?", expired)
+            db.executemany("DELETE FROM files WHERE id = ?", expired)
+        return len(expired)
+
+    def search(self, text, servers=None, start=None, end=None, limit=DEFAULT_LIMIT):
+        """Matching lines, newest first.
+
+        Returns dicts with server, file, line_no, timestamp and line.
+        start and end are epoch seconds.
+        """
+        query = build_query(text)
+        if not query:
+            return []
+        sql = ("SELECT f.server, f.name, l.line_no, l.timestamp, l.content FROM lines_fts "
+               "JOIN lines l ON l.id = lines_fts.rowid JOIN files f ON f.id = l.file_id "
+               "WHERE lines_fts MATCH ?")
+        params = [query]
+        if servers:
+            sql += f" AND f.server IN ({', '.join('?' * len(servers))})"
+            params.extend(servers)
+        if start is not None:
+            sql += " AND l.timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND l.timestamp <= ?"
+            params.append(end)
+        sql += " ORDER BY l.timestamp DESC, l.id DESC LIMIT ?"
+        params.append(limit)
+        with self._connect() as db:
+            rows = db.execute(sql, params).fetchall()
+        return [{'server': row['server'], 'file': row['name'], 'line_no': row['line_no'],
+                 'timestamp': row['timestamp'], 'line': row['content']} for row in rows]
+
+
+def index_collection(config, log_dir, log=print):
+    """Index a finished collection if SEARCH_INDEX is enabled"""
+    if not config_bool(config, 'SEARCH_INDEX', True):
+        return
+    start = time.time()
+    try:
+        added = SearchIndex(config['BASE_DIR']).index_run(log_dir, log=log)
+        log(f"Search index updated: {added} new lines in {time.time() - start:.1f}s")
+    except sqlite3.Error as e:
+        log(f"Error updating search index: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index or search the stored Harmonic logs")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    parser.add_argument('-s', dest='server', action='append', help="Only search this server")
+    parser.add_argument('-n', dest='limit', type=int, default=DEFAULT_LIMIT,
+                        help="Maximum number of lines to show")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Index every stored run directory")
+    parser.add_argument('query', nargs='*', help="Words or \"phrases\" to search for")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+    index = SearchIndex(config['BASE_DIR'])
+
+    if args.rebuild:
+        removed = index.prune()
+        # Oldest first, so each file ends up indexed from its newest copy
+        for run in reversed(runs.list_runs(config['BASE_DIR'])):
+            added = index.index_run(run['path'])
+            print(f"Indexed {run['name']}: {added} new lines")
+        print(f"Removed {removed} files that are no longer stored")
+
+    if args.query:
+        start = time.time()
+        results = index.search(' '.join(args.query), servers=args.server, limit=args.limit)
+        for result in reversed(results):
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(result['timestamp']))
+            print(f"{when} {result['server']}/{result['file']}:{result['line_no']}: {result['line']}")
+        print(f"{len(results)} lines in {time.time() - start:.3f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
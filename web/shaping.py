@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Bandwidth and concurrency limits for the Harmonic Log Fetcher.
+Each server can be given a bandwidth cap (PREFIX_MAX_KBPS in config.cfg)
+that is shared by all of its FTP connections, and the number of files
+downloaded from it at once adapts to how the server responds: when its
+response time or error rate rises the fetcher halves the transfers, and adds
+them back one at a time while the server keeps up.
+
+During ONAIR_HOURS the lower ONAIR_MAX_KBPS and ONAIR_CONNECTIONS limits
+apply (or PREFIX_ONAIR_*), so collections can run at full speed in quiet
+hours without disturbing the playout servers while they are on air.
+
+The limits of a server are shared by every collection in one process (the
+web interface's jobs and the collector), like its connection pool. Separate
+processes, such as cron runs, each have their own.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# Latency and error samples per adjustment of the concurrency
+ADJUST_WINDOW = 4
+# Back off when the median response time is this many times the best seen
+# (and at least LATENCY_BACKOFF_MIN seconds slower)...
+LATENCY_BACKOFF_FACTOR = 2.0
+LATENCY_BACKOFF_MIN = 0.05
+# ...or when more than this share of the transfers failed
+ERROR_BACKOFF_RATE = 0.25
+# Ramp up while the median response time stays within this factor of the best
+LATENCY_RAMP_FACTOR = 1.25
+# The best response time slowly drifts up so a server that got slower for good
+# is not treated as overloaded forever
+BASELINE_DRIFT = 1.05
+# How often the on-air/quiet profile is checked during a collection
+PROFILE_CHECK_SECONDS = 30
+
+
+class TokenBucket:
+    """Limit a byte rate shared by several threads.
+
+    Tokens (bytes) are added at rate per second, up to burst. take() waits
+    until enough tokens are available; a rate of 0 means no limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self._lock:
+            self._refill()
+            self.rate = max(0, rate)
+            # Allow about a quarter of a second of traffic at once
+            self.burst = burst or max(64 * 1024, self.rate / 4)
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self, nbytes):
+        """Wait until nbytes may be sent; returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return waited
+                self._refill()
+                # Blocks bigger than the burst are let through once the bucket is full
+                needed = min(nbytes, self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= nbytes
+                    return waited
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class ConcurrencyController:
+    """Limit concurrent transfers, adapting the limit to the server's response.
+
+    Additive increase, multiplicative decrease: every ADJUST_WINDOW samples the
+    limit is halved if the server slowed down or transfers failed, and raised
+    by one (up to maximum) if it responded as fast as it ever has.
+    """
+
+    def __init__(self, maximum, adaptive=True):
+        self.maximum = max(1, maximum)
+        self.limit = self.maximum
+        self.adaptive = adaptive
+        self.baseline = None
+        # Median response time and error rate of the last window
+        self.median = None
+        self.error_rate = 0.0
+        self._active = 0
+        self._samples = []
+        self._cond = threading.Condition()
+
+    def set_maximum(self, maximum):
+        with self._cond:
+            self.maximum = max(1, maximum)
+            if self.limit > self.maximum or not self.adaptive:
+                self.limit = self.maximum
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def observe(self, latency=None, error=False):
+        """Record one response time (seconds) or failure; returns the new limit if it changed"""
+        if not self.adaptive:
+            return None
+        with self._cond:
+            self._samples.append((latency, error))
+            if len(self._samples) < ADJUST_WINDOW:
+                return None
+            samples, self._samples = self._samples, []
+            latencies = sorted(s[0] for s in samples if not s[1] and s[0] is not None)
+            self.error_rate = error_rate = sum(1 for s in samples if s[1]) / len(samples)
+            self.median = median = latencies[len(latencies) // 2] if latencies else None
+            if median is not None:
+                self.baseline = median if self.baseline is None else min(
+                    median, self.baseline * BASELINE_DRIFT)
+            previous = self.limit
+            slow = median is not None and median > max(self.baseline * LATENCY_BACKOFF_FACTOR,
+                                                        self.baseline + LATENCY_BACKOFF_MIN)
+            if error_rate > ERROR_BACKOFF_RATE or slow:
+                self.limit = max(1, self.limit // 2)
+            elif median is not None and median <= self.baseline * LATENCY_RAMP_FACTOR:
+                self.limit = min(self.maximum, self.limit + 1)
+            if self.limit == previous:
+                return None
+            self._cond.notify_all()
+            return self.limit
+
+
+def in_hours(hours, now=None):
+    """Whether the local time is inside any of the (start hour, end hour) ranges"""
+    hour = time.localtime(now).tm_hour
+    for start, end in hours:
+        if (start <= hour < end) if start < end else (hour >= start or hour < end):
+            return True
+    return False
+
+
+# (TokenBucket, ConcurrencyController) of each server name, for all collections in this process
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def shared_limits(server):
+    """The bandwidth cap and concurrency controller of a server in this process"""
+    with _limits_lock:
+        limits = _limits.get(server['name'])
+        if limits is None:
+            limits = _limits[server['name']] = (
+                TokenBucket(0), ConcurrencyController(server['connections']))
+        # The configuration may have been reloaded since they were created
+        limits[1].adaptive = server.get('adaptive', True)
+        return limits
+
+
+class ServerShaper:
+    """Bandwidth cap and adaptive concurrency of one server, for one collection's log"""
+
+    def __init__(self, server, log=print):
+        self.server = server
+        self.log = log
+        self.profile = None
+        self.bucket, self.concurrency = shared_limits(server)
+        self._checked = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Apply the on-air or quiet hours limits if the profile changed"""
+        now = time.time()
+        if not force and now - self._checked < PROFILE_CHECK_SECONDS:
+            return
+        self._checked = now
+        server = self.server
+        onair = bool(server.get('onair_hours')) and in_hours(server['onair_hours'], now)
+        profile = 'onair' if onair else 'quiet'
+        if profile == self.profile:
+            return
+        self.profile = profile
+        rate = server.get('max_rate', 0)
+        connections = server['connections']
+        if onair:
+            rate = server.get('onair_max_rate') or rate
+            # The connection pool is sized for quiet hours, so on air can only use fewer
+            connections = min(server.get('onair_connections') or connections, connections)
+        self.bucket.set_rate(rate)
+        self.concurrency.set_maximum(connections)
+        name = server['name']
+        metrics.RATE_LIMIT.labels(server=name).set(rate)
+        metrics.CONCURRENCY.labels(server=name).set(self.concurrency.limit)
+        if not force or onair:
+            self.log(f"{server['label']}: using {'on-air' if onair else 'quiet hours'} limits "
+                     f"({connections} transfer{'s' if connections != 1 else ''}"
+                     + (f", {rate // 1024} KB/s" if rate else "") + ")")
+
+    @contextmanager
+    def transfer(self):
+        """Hold one of the server's transfer slots"""
+        self.refresh()
+        with self.concurrency.slot():
+            yield
+
+    def throttle(self, nbytes):
+        """Wait until nbytes more may be received from the server"""
+        waited = self.bucket.take(nbytes)
+        if waited:
+            metrics.THROTTLE_SECONDS.labels(server=self.server['name']).inc(waited)
+
+    def observe(self, latency=None, error=False):
+        """Record a response time or failure and adapt the number of transfers"""
+        limit = self.concurrency.observe(latency, error)
+        if limit is None:
+            return
+        metrics.CONCURRENCY.labels(server=self.server['name']).set(limit)
+        concurrency = self.concurrency
+        details = [f"{concurrency.error_rate:.0%} failed"]
+        if concurrency.median is not None:
+            details.insert(0, f"response {concurrency.median * 1000:.0f} ms, "
+                              f"best {concurrency.baseline * 1000:.0f} ms")
+        self.log(f"{self.server['label']}: now {limit} concurrent transfers ({', '.join(details)})")
+
+
+def create_shapers(servers, log=print):
+    """Return a ServerShaper for each server name"""
+    return {server['name']: ServerShaper(server, log=log) for server in servers}
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Merged timeline of the stored Harmonic logs.
+Interleaves the lines of several servers' log files in time order for a
+time window, so an incident can be followed across MediaCenter and MediaDeck
+in one list. Each file is read as a stream (.gz logs are decompressed on the
+fly, plain logs are bisected to the start of the window) and the streams are
+combined with a k-way heap merge, so memory use depends on the number of
+files open, not on how much they contain. Pages continue from a cursor that
+holds, for each file, the byte offset and timestamp of the last line shown,
+so every page continues the same merge instead of searching by time again.
+"""
+import argparse
+import base64
+import datetime
+import gzip
+import heapq
+import io
+import itertools
+import json
+import sys
+import time
+import zlib
+
+import runs
+from config import DEFAULT_CONFIG_FILE, load_config
+from search import MAX_LINE_LENGTH, match_line_timestamp
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+# Files merged at once; each keeps a read buffer (a 1 MB chunk from the blob store)
+MAX_FILES = 100
+# Lines read past a file's start, or a bisection point, to find a timestamp
+HEADER_LINES = 100
+# Bisection of plain logs stops when the range is this small
+SEEK_GRANULARITY = 64 * 1024
+
+
+def encode_cursor(positions):
+    """Page cursor for {(server, file): (offset, timestamp) of the last line shown}"""
+    data = [[server, name, offset, timestamp]
+            for (server, name), (offset, timestamp) in sorted(positions.items())]
+    return base64.urlsafe_b64encode(zlib.compress(json.dumps(data).encode())).decode()
+
+
+def decode_cursor(cursor):
+    """The {(server, file): (offset, timestamp)} positions of a page cursor"""
+    try:
+        data = json.loads(zlib.decompress(base64.urlsafe_b64decode(cursor.encode())))
+        return {(str(server), str(name)): (int(offset), float(timestamp))
+                for server, name, offset, timestamp in data}
+    except (ValueError, TypeError, zlib.error) as e:
+        raise ValueError(f"Invalid cursor: {e}") from None
+
+
+def select_timeline_files(base_dir, servers=None, start=None, pattern=None, names=None):
+    """Stored files that can hold lines after start, oldest first.
+
+    A file's modification time is its last line, so only files modified before
+    start are left out; files that start after the end of the window stop at
+    their first line. names ({(server, file name)}) picks individual files.
+    """
+    files = runs.select_files(base_dir, servers=servers, start=start, pattern=pattern)
+    if names:
+        files = [f for f in files if (f['server'], f['name']) in names]
+    return sorted(files, key=lambda f: (f['mtime'], f['server'], f['name']))
+
+
+def select_window_files(base_dir, servers=None, start=None, end=None, pattern=None):
+    """Stored files with lines between start and end, by server and modification time.
+
+    Files modified before start are left out, and so are files whose first line
+    is after end; a file without a timestamp in its first lines is kept.
+    """
+    files = runs.select_files(base_dir, servers=servers, start=start, pattern=pattern)
+    if end is None:
+        return files
+    return [f for f in files if (first_timestamp(f) or 0) <= end]
+
+
+def _line_timestamp(line):
+    return match_line_timestamp(line[:64].decode('utf-8', 'replace'))[0]
+
+
+def _open_source(f):
+    """(raw file, buffered line source) for a stored file; .gz logs are decompressed"""
+    raw = runs.open_run_file(f)
+    if f['name'].endswith('.gz'):
+        return raw, gzip.GzipFile(fileobj=raw)
+    if isinstance(raw, io.BufferedIOBase):
+        return raw, raw
+    return raw, io.BufferedReader(raw)
+
+
+def first_timestamp(f):
+    """Timestamp of a stored file's first line, or None if its first lines have none"""
+    raw, source = _open_source(f)
+    with raw, source:
+        try:
+            for line in itertools.islice(source, HEADER_LINES):
+                timestamp = _line_timestamp(line)
+                if timestamp is not None:
+                    return timestamp
+        except (OSError, EOFError, zlib.error):
+            pass
+    return None
+
+
+def seek_time(source, size, start):
+    """Offset of a line shortly before the first line at or after start.
+
+    Bisects a plain log on its byte offsets, assuming its timestamps only grow.
+    """
+    low, high = 0, size
+    while high - low > SEEK_GRANULARITY:
+        middle = (low + high) // 2
+        source.seek(middle)
+        source.readline()  # Skip the partial line
+        timestamp = None
+        for line in itertools.islice(source, HEADER_LINES):
+            timestamp = _line_timestamp(line)
+            if timestamp is not None:
+                break
+        if timestamp is not None and timestamp < start:
+            low = middle
+        else:
+            high = middle
+    if not low:
+        return 0
+    source.seek(low)
+    return low + len(source.readline())
+
+
+def iter_file_lines(f, start=None, end=None, position=None):
+    """Yield (timestamp, server, file, offset, line) for one stored file in time order.
+
+    Lines without a timestamp of their own (continuations) take the one before
+    them, and a timestamp earlier than the line before it is raised to match, so
+    each stream is sorted as the merge needs. Lines before the file's first
+    timestamp take that timestamp; a file with none in its first lines is
+    skipped, and a damaged .gz file ends where it can no longer be read.
+
+    position, the (offset, timestamp) of the last line already shown, continues
+    after that line with the same timestamps as reading on from it would give.
+    """
+    compressed = f['name'].endswith('.gz')
+    raw, source = _open_source(f)
+    with raw, source:
+        timestamp = None
+        if position is not None:
+            offset, timestamp = position
+            source.seek(offset)
+            offset += len(source.readline())
+        elif start is not None and not compressed:
+            offset = seek_time(source, f['size'], start)
+            source.seek(offset)
+        else:
+            offset = 0
+        pending = []
+        lines = iter(source)
+        while True:
+            try:
+                line = next(lines)
+            except (StopIteration, OSError, EOFError, zlib.error):
+                return
+            line_offset = offset
+            offset += len(line)
+            text = line.rstrip(b'\r\n')
+            if not text.strip():
+                continue
+            parsed = _line_timestamp(text)
+            if parsed is not None:
+                timestamp = parsed if timestamp is None else max(timestamp, parsed)
+            pending.append((line_offset, text))
+            if timestamp is None:
+                if len(pending) > HEADER_LINES:
+                    return
+                continue
+            if end is not None and timestamp > end:
+                return
+            if start is None or timestamp >= start:
+                for pending_offset, pending_text in pending:
+                    yield (timestamp, f['server'], f['name'], pending_offset,
+                           pending_text[:MAX_LINE_LENGTH].decode('utf-8', 'replace'))
+            pending = []
+
+
+def iter_timeline(files, start=None, end=None, positions=None):
+    """Merge the lines of several files in time order (a generator).
+
+    Ties are broken by server, file and offset, so the order is the same on
+    every page. positions (from a cursor) continues each file after the last
+    line shown from it; a file with no lines shown yet has none before them.
+    """
+    positions = positions or {}
+    streams = [iter_file_lines(f, start, end, positions.get((f['server'], f['name'])))
+               for f in files]
+    try:
+        yield from heapq.merge(*streams)
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def as_dict(entry):
+    timestamp, server, name, offset, line = entry
+    return {'timestamp': timestamp,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+            'server': server, 'file': name, 'offset': offset, 'line': line}
+
+
+def _advance(positions, entry):
+    timestamp, server, name, offset, _ = entry
+    positions[(server, name)] = (offset, timestamp)
+
+
+def timeline_page(files, start=None, end=None, cursor=None, limit=DEFAULT_LIMIT):
+    """One page of the merged timeline; returns (lines, cursor of the next page or None)"""
+    positions = decode_cursor(cursor) if cursor else {}
+    merged = iter_timeline(files, start, end, positions)
+    try:
+        entries = list(itertools.islice(merged, limit + 1))
+    finally:
+        merged.close()
+    more = len(entries) > limit
+    entries = entries[:limit]
+    for entry in entries:
+        _advance(positions, entry)
+    return [as_dict(entry) for entry in entries], encode_cursor(positions) if more else None
+
+
+def stream_ndjson(files, start=None, end=None, cursor=None, limit=0):
+    """The merged timeline as JSON lines, ending with {"next": cursor} if limit cut it short.
+
+    The cursor is checked straight away; the lines are produced as they are read.
+    """
+    positions = decode_cursor(cursor) if cursor else {}
+    return _ndjson_lines(files, start, end, positions, limit)
+
+
+def _ndjson_lines(files, start, end, positions, limit):
+    merged = iter_timeline(files, start, end, dict(positions))
+    try:
+        for count, entry in enumerate(merged):
+            if limit and count == limit:
+                yield json.dumps({'next': encode_cursor(positions)}) + '\n'
+                return
+            yield json.dumps(as_dict(entry)) + '\n'
+            _advance(positions, entry)
+    finally:
+        merged.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the stored logs of several servers in time order")
+    parser.add_argument('-c', dest='config_file', default=DEFAULT_CONFIG_FILE,
+                        help="Path to configuration file")
+    parser.add_argument('--start', required=True, help="Start time (YYYY-MM-DDTHH:MM)")
+    parser.add_argument('--end', help="End time (YYYY-MM-DDTHH:MM)")
+    parser.add_argument('-s', dest='server', action='append', help="Only this server")
+    parser.add_argument('--pattern', help="Only files whose name matches this pattern (e.g. *.log)")
+    parser.add_argument('-n', dest='limit', type=int, default=0,
+                        help="Maximum number of lines to show (default: all)")
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args.config_file)
+    except OSError as e:
+        print(f"Error loading config: {e}")
+        return 1
+
+    def epoch(value):
+        return time.mktime(datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M').timetuple())
+
+    start = epoch(args.start)
+    end = epoch(args.end) if args.end else None
+    files = select_timeline_files(config['BASE_DIR'], servers=args.server, start=start,
+                                  pattern=args.pattern)
+    if len(files) > MAX_FILES:
+        print(f"Error: {len(files)} files match, narrow the servers, time or pattern "
+              f"to at most {MAX_FILES}")
+        return 1
+    merged = iter_timeline(files, start, end)
+    for entry in itertools.islice(merged, args.limit or None):
+        line = as_dict(entry)
+        print(f"{line['time']} {line['server']}/{line['file']}: {line['line']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
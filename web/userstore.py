@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Web user store for the Harmonic Log Fetcher.
+Keeps web_users.cfg in memory and re-reads it only when the file changes,
+writes it atomically under a lock, and hashes passwords with salted
+PBKDF2-SHA256. Hashes from older versions (unsalted SHA-256) are still
+accepted and are upgraded the next time the user logs in.
+"""
+import collections
+import fcntl
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import tempfile
+import threading
+
+HASH_SCHEME = 'pbkdf2_sha256'
+# A PBKDF2 hash wrapped around an old unsalted SHA-256 hash (see migrate_users.py)
+LEGACY_WRAPPED_SCHEME = 'pbkdf2_sha256_legacy'
+PBKDF2_ITERATIONS = 310000
+LEGACY_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# Successful logins remembered so repeat checks skip the key derivation
+VERIFY_CACHE_SIZE = 256
+# Checked for unknown users, so a login takes as long whether or not the user exists
+_DUMMY_HASH = f"{HASH_SCHEME}${PBKDF2_ITERATIONS}${secrets.token_hex(16)}${secrets.token_hex(32)}"
+
+HEADER = ("# Web users configuration for Harmonic Log Fetcher\n"
+          "# Format: username:role=password_hash\n")
+
+
+def _pbkdf2(secret, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', secret.encode(), bytes.fromhex(salt), iterations).hex()
+
+
+def hash_password(password, iterations=PBKDF2_ITERATIONS):
+    """Salted hash in the form pbkdf2_sha256$iterations$salt$hash"""
+    salt = secrets.token_hex(16)
+    return f"{HASH_SCHEME}${iterations}${salt}${_pbkdf2(password, salt, iterations)}"
+
+
+def wrap_legacy_hash(legacy_hash, iterations=PBKDF2_ITERATIONS):
+    """Protect an old SHA-256 hash with PBKDF2 without knowing the password"""
+    salt = secrets.token_hex(16)
+    return f"{LEGACY_WRAPPED_SCHEME}${iterations}${salt}${_pbkdf2(legacy_hash, salt, iterations)}"
+
+
+def verify_password(password, stored_hash):
+    """Check a password against any supported hash format"""
+    if LEGACY_HASH_PATTERN.match(stored_hash):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored_hash)
+    try:
+        scheme, iterations, salt, expected = stored_hash.split('$')
+        iterations = int(iterations)
+    except ValueError:
+        return False
+    if scheme == LEGACY_WRAPPED_SCHEME:
+        password = hashlib.sha256(password.encode()).hexdigest()
+    elif scheme != HASH_SCHEME:
+        return False
+    return hmac.compare_digest(_pbkdf2(password, salt, iterations), expected)
+
+
+def needs_upgrade(stored_hash):
+    """True for hashes that should be replaced by a current salted hash"""
+    return not stored_hash.startswith(HASH_SCHEME + '$')
+
+
+def parse_users(lines):
+    """Parse username:role=password_hash lines into a dict"""
+    users = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split('=', 1)
+        if len(parts) != 2:
+            continue
+        user_info, password_hash = parts[0].strip(), parts[1].strip()
+        # Default to admin for backward compatibility
+        username, _, role = user_info.partition(':')
+        users[username] = {'password_hash': password_hash, 'role': role or 'admin'}
+    return users
+
+
+class UserStore:
+    """In-memory copy of web_users.cfg that follows changes to the file"""
+
+    def __init__(self, path, cache_size=VERIFY_CACHE_SIZE):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.cache_size = cache_size
+        self._users = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self._verified = collections.OrderedDict()  # keyed digest -> stored hash
+        self._cache_key = secrets.token_bytes(32)
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return parse_users(f)
+        except FileNotFoundError:
+            return {}
+
+    def users(self):
+        """All users; the file is only re-read when it has changed"""
+        signature = self._file_signature()
+        with self._lock:
+            if signature != self._signature:
+                try:
+                    self._users = self._read()
+                    self._signature = signature
+                except (OSError, UnicodeDecodeError) as e:
+                    print(f"Error loading users: {e}")
+            return self._users
+
+    def get(self, username):
+        return self.users().get(username)
+
+    def check(self, username, password):
+        """Check a login, upgrading an old password hash when it succeeds"""
+        user = self.get(username)
+        if user is None:
+            verify_password(password, _DUMMY_HASH)
+            return False
+        stored_hash = user['password_hash']
+        key = hmac.new(self._cache_key, f"{username}\0{password}".encode(), 'sha256').digest()
+        with self._lock:
+            if self._verified.get(key) == stored_hash:
+                self._verified.move_to_end(key)
+                return True
+        if not verify_password(password, stored_hash):
+            return False
+        if needs_upgrade(stored_hash):
+            try:
+                stored_hash = self._update(username, user['role'], hash_password(password))
+            except OSError as e:
+                print(f"Error upgrading password hash for {username}: {e}")
+        with self._lock:
+            self._verified[key] = stored_hash
+            self._verified.move_to_end(key)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return True
+
+    def save(self, username, password, role='user'):
+        """Add a user or change their password and role"""
+        self._update(username, role, hash_password(password))
+
+    def _update(self, username, role, password_hash):
+        # Lock, then re-read, so concurrent changes from other processes are kept
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            users = self._read()
+            users[username] = {'password_hash': password_hash, 'role': role}
+            self._write(users)
+        with self._lock:
+            self._users = users
+            self._signature = self._file_signature()
+        return password_hash
+
+    def _write(self, users):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+        try:
+            # mkstemp creates the file readable by its owner only
+            with os.fdopen(fd, 'w') as f:
+                f.write(HEADER)
+                for user, data in users.items():
+                    f.write(f"{user}:{data['role']}={data['password_hash']}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise